@@ -1,30 +1,64 @@
 import os
 import uuid
-import requests
-import base64
-from openai import AsyncOpenAI
-from dotenv import load_dotenv
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 
-load_dotenv()
+import llm_provider
+from cache_backend import Cache, hash_key
+from image_store import save_image_variants
+from llm_provider import ChatMessage, warm_up
+from llm_resilience import (
+    CallPolicy, CircuitBreaker, CircuitOpenError, LatencyTracker, call_with_policy, env_float
+)
 
-try:
-    client = AsyncOpenAI()
-except Exception as e:
-    print(f"Error al inicializar OpenAI: {e}")
-    client = None
+POLICIES: Dict[str, CallPolicy] = {
+    "intent": CallPolicy(timeout_s=env_float("LLM_INTENT_TIMEOUT_S", 4), retries=1,
+                         hedge=os.environ.get("LLM_INTENT_HEDGE", "0") == "1", hedge_default_delay_s=1.0),
+    "chat": CallPolicy(timeout_s=env_float("LLM_CHAT_TIMEOUT_S", 20), retries=2,
+                       total_budget_s=env_float("LLM_CHAT_BUDGET_S", 30)),
+    "intent_prompt": CallPolicy(timeout_s=env_float("LLM_INTENT_PROMPT_TIMEOUT_S", 20), retries=1,
+                                total_budget_s=env_float("LLM_INTENT_PROMPT_BUDGET_S", 30)),
+    "vision": CallPolicy(timeout_s=env_float("LLM_VISION_TIMEOUT_S", 30), retries=1),
+    "image": CallPolicy(timeout_s=env_float("LLM_IMAGE_TIMEOUT_S", 60), retries=1,
+                        total_budget_s=env_float("LLM_IMAGE_BUDGET_S", 90)),
+}
+# Preguntas por llamada en la clasificación en lote.
+INTENT_BATCH_CHUNK = int(os.environ.get("INTENT_BATCH_CHUNK", "50"))
 
-ChatMessage = Dict[str, str]
+# Cachés compartidas entre workers (ver cache_backend.CACHE_URL). Solo se guardan respuestas válidas.
+intent_cache = Cache("intents", ttl_s=env_float("INTENT_CACHE_TTL_S", 86400))
+intent_prompt_cache = Cache("intent_prompts", ttl_s=env_float("INTENT_PROMPT_CACHE_TTL_S", 86400))
+# Prompt de DALL-E -> ruta de la imagen ya generada (0 desactiva la reutilización).
+IMAGE_CACHE_TTL_S = env_float("IMAGE_CACHE_TTL_S", 7 * 86400)
+image_cache = Cache("prompt_images", ttl_s=IMAGE_CACHE_TTL_S)
+
+def _question_key(user_question: str) -> str:
+    return hash_key(" ".join(user_question.lower().split()))
+
+# Un circuito por backend: si cae el modelo local, las tareas servidas por OpenAI siguen abiertas.
+breakers: Dict[str, CircuitBreaker] = {}
+latencies: Dict[str, LatencyTracker] = {name: LatencyTracker() for name in POLICIES}
+
+def _breaker(kind: str) -> CircuitBreaker:
+    backend = llm_provider.route(kind)[0]
+    if backend not in breakers:
+        breakers[backend] = CircuitBreaker(
+            backend,
+            failure_rate=env_float("LLM_BREAKER_FAILURE_RATE", 0.5),
+            cooldown_s=env_float("LLM_BREAKER_COOLDOWN_S", 30),
+        )
+    return breakers[backend]
+
+async def _call(kind: str, fn):
+    return await call_with_policy(fn, POLICIES[kind], _breaker(kind), latencies[kind])
 
 async def create_prompt_from_image(user_text: str, image_bytes: bytes) -> str:
     """
     Usa GPT-4o para analizar una imagen y un texto, y crear un prompt detallado para DALL-E.
     """
-    if not client:
+    if not llm_provider.is_available("vision"):
         return "Error: Cliente de IA no configurado."
 
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-
     system_prompt = """
     Eres un 'mejorador de prompts' para un generador de imágenes de IA. 
     Tu tarea es analizar la imagen y el texto del usuario. 
@@ -34,82 +68,225 @@ async def create_prompt_from_image(user_text: str, image_bytes: bytes) -> str:
     """
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_text},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500 
-        )
-        detailed_prompt = response.choices[0].message.content.strip()
+        detailed_prompt = await _call("vision", lambda: llm_provider.avision(
+            "vision", system_prompt, user_text, image_bytes, max_tokens=500))
         print(f"Prompt mejorado por GPT-4o: {detailed_prompt}")
         return detailed_prompt
+    except CircuitOpenError:
+        return "VISION_ERROR: circuito abierto."
     except Exception as e:
         print(f"Error al analizar la imagen con GPT-4o: {e}")
         return f"Error al analizar la imagen: {e}"
 
+SCENE_DIRECTOR_PROMPT = "Eres un director de escena para una serie de animación. Tu tarea es sintetizar la información proporcionada para crear un único y detallado prompt visual para un artista de IA (DALL-E). Combina la descripción base del personaje, el contexto del episodio y la acción solicitada por el usuario. El resultado debe ser un párrafo descriptivo que pinte una imagen vívida de la escena completa."
+
+INTENT_AND_PROMPT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "intent_and_scene_prompt",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": ["chat", "image"]},
+                "image_prompt": {"type": "string"}
+            },
+            "required": ["intent", "image_prompt"],
+            "additionalProperties": False
+        }
+    }
+}
+
+async def classify_intent_and_build_prompt(user_question: str, scene_material: str) -> Optional[Dict[str, str]]:
+    """
+    Una sola llamada estructurada que clasifica la intención y, si es 'image',
+    sintetiza también el prompt de DALL-E a partir de `scene_material`.
+    Devuelve None si falla, para que el llamador use el flujo de dos llamadas.
+    """
+    if not llm_provider.is_available("intent_prompt"): return None
+    return await intent_prompt_cache.aget_or_set(
+        hash_key(_question_key(user_question), scene_material),
+        lambda: _request_intent_and_prompt(user_question, scene_material)
+    )
+
+async def _request_intent_and_prompt(user_question: str, scene_material: str) -> Optional[Dict[str, str]]:
+    system_prompt = (
+        "Primero clasifica la intención del mensaje del usuario: 'image' si pide una imagen, dibujo o foto; "
+        "'chat' en cualquier otro caso. Si la intención es 'chat', deja 'image_prompt' vacío.\n"
+        f"Si la intención es 'image', actúa así: {SCENE_DIRECTOR_PROMPT}"
+    )
+    try:
+        data = await _call("intent_prompt", lambda: llm_provider.achat_json(
+            "intent_prompt",
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Mensaje del usuario: {user_question}\n\n{scene_material}"}
+            ],
+            schema=INTENT_AND_PROMPT_SCHEMA, temperature=0.7, max_tokens=300
+        ))
+        intent = data.get("intent") if data.get("intent") in ("chat", "image") else "chat"
+        image_prompt = (data.get("image_prompt") or "").strip()
+        if intent == "image" and not image_prompt:
+            return None
+        print(f"Intención clasificada como: '{intent}' (modo combinado)")
+        return {"intent": intent, "image_prompt": image_prompt}
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        print(f"Error en la clasificación combinada: {e}")
+        return None
+
 async def classify_intent(user_question: str) -> str:
-    if not client: return "chat"
+    if not llm_provider.is_available("intent"): return "chat"
+    intent = await intent_cache.aget_or_set(_question_key(user_question), lambda: _request_intent(user_question))
+    return intent or "chat"
+
+async def _request_intent(user_question: str) -> Optional[str]:
+    """Intención según el modelo, o None si la llamada falla (no se cachea)."""
     system_prompt = "Tu única tarea es clasificar la intención del usuario. Responde únicamente con 'chat' o 'image'."
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        intent = await _call("intent", lambda: llm_provider.achat(
+            "intent",
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_question}
             ],
             temperature=0, max_tokens=5
-        )
-        intent = response.choices[0].message.content.strip().lower()
+        ))
+        intent = intent.lower()
         if intent in ["image", "chat"]:
             print(f"Intención clasificada como: '{intent}'")
             return intent
-        return "chat"
+        return None
+    except CircuitOpenError:
+        return None
     except Exception as e:
         print(f"Error al clasificar la intención: {e}")
-        return "chat"
+        return None
+
+async def classify_intents(user_questions: List[str]) -> List[str]:
+    """
+    Clasifica varias preguntas en una sola llamada (modo lote).
+    Si la respuesta no cuadra con la entrada, clasifica una a una.
+    """
+    if not llm_provider.is_available("intent_prompt"): return ["chat"] * len(user_questions)
+    keys = [_question_key(q) for q in user_questions]
+    intents = [await intent_cache.aget(key) for key in keys]
+    missing = [i for i, intent in enumerate(intents) if intent is None]
+    if len(missing) == 1:
+        intents[missing[0]] = await classify_intent(user_questions[missing[0]])
+    elif missing:
+        fresh = await _request_intents([user_questions[i] for i in missing])
+        if fresh is None:
+            fresh = list(await asyncio.gather(*(classify_intent(user_questions[i]) for i in missing)))
+        else:
+            for i, intent in zip(missing, fresh):
+                await intent_cache.aset(keys[i], intent)
+        for i, intent in zip(missing, fresh):
+            intents[i] = intent
+    return intents
+
+async def _request_intents(user_questions: List[str]) -> Optional[List[str]]:
+    """Clasificación en lote por el modelo; None si falla o no cuadra con la entrada."""
+    if len(user_questions) > INTENT_BATCH_CHUNK:
+        chunks = [user_questions[i:i + INTENT_BATCH_CHUNK] for i in range(0, len(user_questions), INTENT_BATCH_CHUNK)]
+        results = await asyncio.gather(*(_request_intents(c) for c in chunks))
+        if any(result is None for result in results):
+            return None
+        return [intent for chunk in results for intent in chunk]
+
+    system_prompt = (
+        "Tu única tarea es clasificar la intención de cada mensaje numerado del usuario: 'image' si pide "
+        "una imagen, dibujo o foto; 'chat' en cualquier otro caso. Devuelve la lista de intenciones en el mismo orden."
+    )
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(user_questions, 1))
+    schema = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "intents",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"intents": {"type": "array", "items": {"type": "string", "enum": ["chat", "image"]}}},
+                "required": ["intents"],
+                "additionalProperties": False
+            }
+        }
+    }
+    try:
+        data = await _call("intent_prompt", lambda: llm_provider.achat_json(
+            "intent_prompt",
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": numbered}
+            ],
+            schema=schema, temperature=0, max_tokens=8 * len(user_questions) + 20
+        ))
+        intents = data.get("intents", [])
+        if len(intents) == len(user_questions):
+            return intents
+        print(f"Clasificación en lote devolvió {len(intents)} de {len(user_questions)} intenciones; se clasifica una a una.")
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        print(f"Error en la clasificación en lote: {e}")
+    return None
+
+def _history_message(message: ChatMessage) -> ChatMessage:
+    # En el historial, las imágenes se guardan con su ruta y un rol propio que la API no admite.
+    if message.get("role") == "assistant_image":
+        return {"role": "assistant", "content": "[Imagen generada para el usuario]"}
+    return {"role": message["role"], "content": message["content"]}
+
+def build_chat_messages(persona_prompt: str, chat_history: List[ChatMessage],
+                        episode_context: str, user_question: str) -> List[ChatMessage]:
+    """
+    Persona primero y sin nada variable: el mensaje de sistema es idéntico byte a byte en todos los
+    turnos de un personaje, así que el proveedor puede servir ese prefijo desde su caché de prompts.
+    El historial solo crece por el final, y el contexto de episodios (distinto en cada pregunta) va
+    justo antes de la pregunta.
+    """
+    messages = [{"role": "system", "content": f"{persona_prompt}\nTu objetivo es responder como el personaje."},
+                *(_history_message(m) for m in chat_history)]
+    if episode_context:
+        messages.append({"role": "system", "content": f"Contexto para esta pregunta: {episode_context}"})
+    messages.append({"role": "user", "content": user_question})
+    return messages
 
 async def generate_character_response(
     persona_prompt: str, chat_history: List[ChatMessage],
     episode_context: str, user_question: str
 ) -> str:
-    if not client: return "Miau... (Error: el cliente de IA no está configurado)."
-    system_prompt = f"{persona_prompt}\nTu objetivo es responder como el personaje. Contexto: {episode_context if episode_context else 'N/A'}"
-    messages = [{"role": "system", "content": system_prompt}, *chat_history, {"role": "user", "content": user_question}]
+    if not llm_provider.is_available("chat"): return "Miau... (Error: el cliente de IA no está configurado)."
+    messages = build_chat_messages(persona_prompt, chat_history, episode_context, user_question)
+    cache_key = f"persona-{hash_key(messages[0]['content'])[:16]}"
     try:
-        response = await client.chat.completions.create(model="gpt-4o-mini", messages=messages, temperature=0.7, max_tokens=200)
-        return response.choices[0].message.content.strip()
+        return await _call("chat", lambda: llm_provider.achat("chat", messages, temperature=0.7, max_tokens=200,
+                                                              cache_key=cache_key))
+    except CircuitOpenError:
+        return "Miau... (Estoy descansando un momento, pregúntame otra vez en un rato)."
     except Exception as e:
         print(f"Error en la API de OpenAI (Chat): {e}")
         return "Miau... (Tuve un problema para pensar)."
 
 async def generate_visual_image(prompt: str) -> str:
-    if not client: raise Exception("El cliente de IA no está configurado.")
+    if not llm_provider.is_available("image"): raise Exception("El cliente de IA no está configurado.")
+    if IMAGE_CACHE_TTL_S > 0:
+        # El mismo prompt reutiliza la imagen mientras el archivo siga en disco (el janitor puede borrarlo).
+        cached_path = await image_cache.aget(hash_key(prompt))
+        if cached_path and os.path.exists(cached_path):
+            print(f"Imagen reutilizada para el prompt: {cached_path}")
+            return cached_path
     print(f"Generando imagen para el prompt: {prompt}")
     try:
-        response = await client.images.generate(model="dall-e-3", prompt=prompt, n=1, size="1024x1024", quality="standard")
-        image_url = response.data[0].url
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
-        save_dir = "generated_images"
-        os.makedirs(save_dir, exist_ok=True)
-        file_name = f"{uuid.uuid4()}.png"
-        file_path = os.path.join(save_dir, file_name)
-        with open(file_path, "wb") as f: f.write(image_response.content)
+        png_bytes = await _call("image", lambda: llm_provider.aimage("image", prompt))
+        file_path = await asyncio.to_thread(save_image_variants, str(uuid.uuid4()), png_bytes)
         print(f"Imagen guardada en: {file_path}")
+        if IMAGE_CACHE_TTL_S > 0:
+            await image_cache.aset(hash_key(prompt), file_path)
         return file_path
+    except CircuitOpenError:
+        return "Miau... (Ahora mismo no puedo dibujar, inténtalo en un rato)."
     except Exception as e:
         print(f"Error en DALL-E o al descargar: {e}")
         return "Miau... (Lo siento, no pude dibujar eso. Revisa el log para más detalles)."
\ No newline at end of file
@@ -1,31 +1,150 @@
 import os
+import re
+import hmac
+import json
 import random
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.staticfiles import StaticFiles
+import glob
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from character_models import CharacterSheet
 from sheet_reader import load_character_sheet
 from episodes_db import (
+    init_pool,
+    close_pool,
+    pool_stats,
+    history_buffer_stats,
+    close_history_writer,
     search_episodes, 
+    search_episodes_with_citations,
     format_citation, 
+    format_scene_context,
+    get_scene_prompt,
+    scene_overlap,
     save_message_to_history, 
     get_history_by_session,
     delete_history_by_session
 )
-from ai_core import classify_intent, create_prompt_from_image, generate_character_response, generate_visual_image
+from cache_backend import Cache, cache_stats
+from db_status import get_operational_status
+from episode_snapshot import activate_snapshot
+from request_profiler import ProfilingMiddleware
+from cache_warmer import CACHE_WARMUP, run_warmup_in_background, warmup_report
+import ai_core
+import llm_provider
+from ai_core import (
+    SCENE_DIRECTOR_PROMPT,
+    classify_intent,
+    classify_intent_and_build_prompt,
+    classify_intents,
+    create_prompt_from_image,
+    generate_character_response,
+    generate_visual_image,
+    warm_up
+)
+from image_jobs import ImageJobQueue, QueueFullError, TERMINAL_STATUSES, get_job
+from session_export import EXPORT_DIR, EXPORT_FORMATS, export_session, export_sessions, iter_session_ids, make_executor
+from image_store import IMAGE_DIR, IMAGE_DISK_QUOTA_MB, SIZES, ImmutableStaticFiles, disk_usage, run_janitor, variant_url
+
+# Si es "0", /ask genera la imagen dentro de la propia petición (modo antiguo).
+IMAGE_JOBS_ASYNC = os.environ.get("IMAGE_JOBS_ASYNC", "1") == "1"
+# Si es "1", la intención y el prompt de imagen salen de una única llamada estructurada.
+COMBINED_INTENT_MODE = os.environ.get("COMBINED_INTENT_MODE", "0") == "1"
+
+# Segundos que se reutiliza la respuesta de /status (las sondas del balanceador no llegan a la BD).
+STATUS_TTL_S = float(os.environ.get("STATUS_TTL_S", "15"))
+SHEETS_GLOB = os.environ.get("SHEETS_GLOB", "data/ficha/*.json")
+# Límites de /ask/batch: preguntas por petición y preguntas procesadas a la vez.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+SHEETS_DIR = os.environ.get("SHEETS_DIR", "data/ficha")
+# Parecido mínimo (palabras clave compartidas) para usar la escena precalculada sin llamar al modelo.
+SCENE_TEMPLATE_MIN_OVERLAP = float(os.environ.get("SCENE_TEMPLATE_MIN_OVERLAP", "0.5"))
+STARTUP_WARMUP_HTTP = os.environ.get("STARTUP_WARMUP_HTTP", "1") == "1"
+# Token para los endpoints de administración (/export); sin él quedan deshabilitados.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+image_queue: Optional[ImageJobQueue] = None
+episodes_snapshot = None
+_export_executor = None
+# Las fichas validadas son objetos del proceso: se cachean en local (releer el archivo es barato).
+_sheet_cache = Cache("sheets", local_only=True)
+_status_cache: Dict[str, object] = {"expires": 0.0, "value": None}
+_status_lock = asyncio.Lock()
+
+def get_sheet(path: str) -> CharacterSheet:
+    """Ficha validada y cacheada por ruta; se relee solo si el archivo cambió."""
+    mtime = os.path.getmtime(path) if os.path.exists(path) else -1.0
+    return _sheet_cache.get_or_set(f"{path}:{mtime}", lambda: CharacterSheet(**load_character_sheet(path)))
+
+def preload_sheets() -> int:
+    loaded = 0
+    for path in glob.glob(SHEETS_GLOB):
+        try:
+            get_sheet(path)
+            loaded += 1
+        except Exception as e:
+            print(f"No se pudo precargar la ficha {path}: {e}")
+    return loaded
+
+def preload_readonly_data() -> int:
+    """
+    Snapshot de episodios y fichas. Con preload_app (gunicorn.conf.py) se llama en el proceso
+    maestro antes del fork y los workers heredan estos datos sin copiarlos (copy-on-write).
+    """
+    global episodes_snapshot
+    if episodes_snapshot is None:
+        # Con EPISODES_SNAPSHOT, la búsqueda de episodios no necesita Postgres en el arranque.
+        episodes_snapshot = activate_snapshot()
+    return preload_sheets()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque controlado: pool de BD, fichas y conexión con la API antes de aceptar tráfico."""
+    global image_queue
+    try:
+        await asyncio.to_thread(init_pool)
+    except Exception as e:
+        print(f"Pool de BD no disponible al arrancar, se usarán conexiones directas: {e}")
+    print(f"Fichas precargadas: {await asyncio.to_thread(preload_readonly_data)}")
+    if STARTUP_WARMUP_HTTP:
+        await warm_up()
+    if IMAGE_JOBS_ASYNC:
+        image_queue = ImageJobQueue(process_image_job)
+        await image_queue.start()
+    janitor = asyncio.create_task(run_janitor())
+    # En segundo plano: el servicio acepta tráfico mientras se calientan las cachés.
+    warmup = asyncio.create_task(run_warmup_in_background()) if CACHE_WARMUP else None
+    yield
+    janitor.cancel()
+    if warmup:
+        warmup.cancel()
+    if image_queue:
+        await image_queue.stop()
+    if _export_executor:
+        _export_executor.shutdown(cancel_futures=True)
+    # Al parar o reciclar el worker, el historial pendiente se escribe antes de cerrar el pool.
+    await asyncio.to_thread(close_history_writer)
+    close_pool()
 
-app = FastAPI(title="GaryBot API", version="0.1.0")
+app = FastAPI(title="GaryBot API", version="0.1.0", lifespan=lifespan)
 
-app.mount("/images", StaticFiles(directory="generated_images"), name="images")
+os.makedirs(IMAGE_DIR, exist_ok=True)
+app.mount("/images", ImmutableStaticFiles(directory=IMAGE_DIR), name="images")
 
 origins = ["http://localhost:3000"]
 app.add_middleware(
     CORSMiddleware, allow_origins=origins, allow_credentials=True, 
     allow_methods=["*"], allow_headers=["*"]
 )
+# Perfilado opcional de peticiones (cabecera X-Profile o PROFILE_SAMPLE_RATE); va por fuera del resto.
+app.add_middleware(ProfilingMiddleware)
 
 class UnifiedResponse(BaseModel):
     type: str
@@ -34,90 +153,400 @@ class UnifiedResponse(BaseModel):
 class ResetRequest(BaseModel):
     session_id: str
 
-#ENDPOINTS
-@app.post("/ask", response_model=UnifiedResponse)
-async def unified_ask_endpoint(
-    question: str = Form(...),
-    session_id: str = Form(...),
-    image: Optional[UploadFile] = File(None),
-    character_sheet_path: str = Form("data/ficha/gary.json")
-):
-    raw_sheet = load_character_sheet(character_sheet_path)
-    sheet = CharacterSheet(**raw_sheet)
-    detailed_prompt = ""
+class BatchItem(BaseModel):
+    question: str
+    session_id: str
+    character: str = "gary"
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
+    image_size: str = "full"
+
+class ExportRequest(BaseModel):
+    session_ids: List[str] = []
+    all: bool = False
+    since: Optional[str] = None
+    format: str = "pdf"
+    character: str = "GaryBot"
+
+class JobStatusResponse(BaseModel):
+    id: str
+    status: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+
+def _image_url(path_or_error: str, size: str = "full") -> Optional[str]:
+    if os.path.exists(path_or_error):
+        return variant_url(path_or_error, size)
+    return None
+
+def is_specific_request(question: str) -> bool:
+    generic_phrases = ["de ti", "tuya", "una imagen de gary", "una foto tuya"]
+    is_generic_request = any(phrase in question.lower() for phrase in generic_phrases)
+    return len(question.split()) > 4 and not is_generic_request
+
+async def episode_scene(question: str, sheet: CharacterSheet, hits: List[dict]) -> Tuple[str, Optional[str]]:
+    """
+    Devuelve (contexto del episodio para el director de escena, prompt final por plantilla o None).
+    Si el episodio tiene un prompt de escena precalculado para este personaje y la petición
+    se parece a esa escena, basta con añadir la acción del usuario: no hace falta llamar al modelo.
+    """
+    if not hits or not hits[0].get('visual_summary'):
+        return "No hay contexto de episodio específico.", None
+    ep = hits[0]
+    stored = await asyncio.to_thread(get_scene_prompt, ep["id"], sheet.name)
+    if not stored:
+        return format_scene_context(ep), None
+    if scene_overlap(question, ep) >= SCENE_TEMPLATE_MIN_OVERLAP:
+        print("Escena precalculada aplicada por plantilla.")
+        return stored, f"{stored}\nAcción solicitada: {question}"
+    return f"Escena precalculada del episodio '{ep.get('title')}': {stored}", None
+
+def scene_material(question: str, sheet: CharacterSheet, episode_context: str) -> str:
+    visual_desc = getattr(sheet, 'visual_description_for_ai', 'Un caracol de dibujos animados.')
+    return f"Descripción Base del Personaje: {visual_desc}\nContexto del Episodio: {episode_context}\nAcción Solicitada por el Usuario: {question}"
+
+async def build_image_prompt(question: str, sheet: CharacterSheet, image_bytes: Optional[bytes] = None) -> str:
+    """Construye el prompt para DALL-E, a partir de la imagen subida o del contexto del episodio."""
 
     def get_fallback_prompt():
         print("Fallback activado: Usando descripción visual del JSON.")
         visual_desc = getattr(sheet, 'visual_description_for_ai', 'Un caracol de dibujos animados.')
         return f"{visual_desc}. {question}."
 
-    if image:
-        image_bytes = await image.read()
+    if image_bytes:
         detailed_prompt = await create_prompt_from_image(question, image_bytes)
         if "VISION_REJECTED" in detailed_prompt or "VISION_ERROR" in detailed_prompt:
             detailed_prompt = get_fallback_prompt()
+        return detailed_prompt
+
+    print("Intención de imagen detectada. Construyendo prompt...")
+    
+    hits = []
+    if is_specific_request(question):
+        print("Petición específica detectada. Buscando contexto de episodio...")
+        hits = await asyncio.to_thread(search_episodes, question, 1)
     else:
-        intent = await classify_intent(question)
-        if intent == "image":
-            print("Intención de imagen detectada. Construyendo prompt...")
-            
-            episode_context = "No hay contexto de episodio específico."
-            
-            generic_phrases = ["de ti", "tuya", "una imagen de gary", "una foto tuya"]
-            is_generic_request = any(phrase in question.lower() for phrase in generic_phrases)
-            
-            if len(question.split()) > 4 and not is_generic_request:
-                print("Petición específica detectada. Buscando contexto de episodio...")
-                hits = search_episodes(question, limit=1)
-                if hits and hits[0].get('visual_summary'):
-                    ep = hits[0]
-                    episode_context = f"Título del Episodio: {ep.get('title')}\nDescripción Visual de la Escena: {ep.get('visual_summary')}\nPersonajes Clave: {ep.get('key_characters')}\nObjetos/Lugares Clave: {ep.get('key_objects_locations')}"
-            else:
-                print("Petición genérica o corta detectada. No se usará contexto de episodio.")
-
-            visual_desc = getattr(sheet, 'visual_description_for_ai', 'Un caracol de dibujos animados.')
-            synthesis_system_prompt = "Eres un director de escena para una serie de animación. Tu tarea es sintetizar la información proporcionada para crear un único y detallado prompt visual para un artista de IA (DALL-E). Combina la descripción base del personaje, el contexto del episodio y la acción solicitada por el usuario. El resultado debe ser un párrafo descriptivo que pinte una imagen vívida de la escena completa."
-            synthesis_user_prompt = f"Descripción Base del Personaje: {visual_desc}\nContexto del Episodio: {episode_context}\nAcción Solicitada por el Usuario: {question}"
-            
-            detailed_prompt = await generate_character_response(
-                persona_prompt=synthesis_system_prompt, 
-                chat_history=[],
-                episode_context="", 
-                user_question=synthesis_user_prompt
-            )
-            
-        else: 
-            persona_prompt = sheet.persona_prompt()
-            visual_desc = getattr(sheet, 'visual_description_for_ai', '')
-            full_persona_prompt = f"{persona_prompt}\n\nDescripción física detallada de ti mismo para tu referencia interna:\n{visual_desc}"
-            
-            hits = search_episodes(question, limit=2)
-            episode_context = "\n".join([format_citation(ep) for ep in hits])
-            chat_history = get_history_by_session(session_id, limit=10)
-            
-            ai_answer = await generate_character_response(
-                persona_prompt=full_persona_prompt,
-                chat_history=chat_history,
-                episode_context=episode_context,
-                user_question=question
-            )
-            save_message_to_history(session_id, "user", question)
-            save_message_to_history(session_id, "assistant", ai_answer)
-            return {"type": "text", "content": ai_answer}
+        print("Petición genérica o corta detectada. No se usará contexto de episodio.")
+
+    episode_context, template_prompt = await episode_scene(question, sheet, hits)
+    if template_prompt:
+        return template_prompt
 
+    return await generate_character_response(
+        persona_prompt=SCENE_DIRECTOR_PROMPT, 
+        chat_history=[],
+        episode_context="", 
+        user_question=scene_material(question, sheet, episode_context)
+    )
+
+async def answer_text(question: str, session_id: str, sheet: CharacterSheet,
+                      hits: Optional[List[dict]] = None) -> dict:
+    """Respuesta de chat en personaje con citas de episodios e historial de la sesión."""
+    persona_prompt = sheet.persona_prompt()
+    visual_desc = getattr(sheet, 'visual_description_for_ai', '')
+    full_persona_prompt = f"{persona_prompt}\n\nDescripción física detallada de ti mismo para tu referencia interna:\n{visual_desc}"
+    
+    if hits is None:
+        hits, citations = await asyncio.to_thread(search_episodes_with_citations, question, 2)
+    else:
+        citations = [format_citation(ep) for ep in hits]
+    episode_context = "\n".join(citations)
+    chat_history = await asyncio.to_thread(get_history_by_session, session_id, 10)
+    
+    ai_answer = await generate_character_response(
+        persona_prompt=full_persona_prompt,
+        chat_history=chat_history,
+        episode_context=episode_context,
+        user_question=question
+    )
+    await asyncio.to_thread(save_message_to_history, session_id, "user", question)
+    await asyncio.to_thread(save_message_to_history, session_id, "assistant", ai_answer)
+    return {"type": "text", "content": ai_answer}
+
+async def run_image_request(question: str, session_id: str, sheet: CharacterSheet,
+                            image_bytes: Optional[bytes] = None, size: str = "full",
+                            prompt: Optional[str] = None) -> dict:
+    """Prompt + generación + historial. Devuelve la respuesta unificada ({type, content})."""
+    detailed_prompt = prompt or await build_image_prompt(question, sheet, image_bytes)
     if "Error" in detailed_prompt:
         return {"type": "text", "content": detailed_prompt}
 
     path_or_error = await generate_visual_image(detailed_prompt)
-    save_message_to_history(session_id, "user", question)
-    save_message_to_history(session_id, "assistant_image", path_or_error)
+    await asyncio.to_thread(save_message_to_history, session_id, "user", question)
+    await asyncio.to_thread(save_message_to_history, session_id, "assistant_image", path_or_error)
     
-    if os.path.exists(path_or_error):
-        content = f"/images/{os.path.basename(path_or_error)}"
-        return {"type": "image", "content": content}
+    url = _image_url(path_or_error, size)
+    if url:
+        return {"type": "image", "content": url}
     else:
         return {"type": "text", "content": path_or_error}
 
+async def process_image_job(job: dict) -> str:
+    """Procesador de la cola: devuelve la URL /images/... o lanza si no se pudo generar."""
+    sheet = get_sheet(job["character_sheet_path"])
+    response = await run_image_request(job["question"], job["session_id"], sheet,
+                                       job.get("source_image"), prompt=job.get("prompt"))
+    if response["type"] != "image":
+        raise RuntimeError(response["content"])
+    return response["content"]
+
+async def route_question(question: str, sheet: CharacterSheet) -> Tuple[str, Optional[str], Optional[List[dict]]]:
+    """
+    Decide la intención de una pregunta sin imagen adjunta.
+    Devuelve (intención, prompt de imagen ya sintetizado o None, episodios ya buscados o None).
+    """
+    if not COMBINED_INTENT_MODE:
+        return await classify_intent(question), None, None
+
+    # Modo combinado: el contexto se busca antes y una sola llamada decide intención y prompt.
+    hits = await asyncio.to_thread(search_episodes, question, 2)
+    scene_hits = hits[:1] if is_specific_request(question) else []
+    episode_context, template_prompt = await episode_scene(question, sheet, scene_hits)
+    if template_prompt:
+        # Con la escena ya resuelta solo falta la intención, que es la llamada más barata.
+        intent = await classify_intent(question)
+        return intent, template_prompt if intent == "image" else None, hits
+    routed = await classify_intent_and_build_prompt(question, scene_material(question, sheet, episode_context))
+    if routed is None:
+        return await classify_intent(question), None, hits
+    return routed["intent"], routed["image_prompt"] or None, hits
+
+def resolve_sheet_path(character: str) -> str:
+    """'gary' -> data/ficha/gary.json. Solo se aceptan nombres ([a-z0-9_]), nunca rutas."""
+    slug = character.strip().lower().replace(" ", "_")
+    if not re.fullmatch(r"[a-z0-9_]+", slug):
+        raise ValueError(f"Personaje no válido: '{character}'.")
+    sheets_dir = os.path.realpath(SHEETS_DIR)
+    path = os.path.realpath(os.path.join(sheets_dir, f"{slug}.json"))
+    # Un enlace simbólico dentro de SHEETS_DIR tampoco puede sacar la ruta fuera.
+    if os.path.dirname(path) != sheets_dir:
+        raise ValueError(f"Personaje no válido: '{character}'.")
+    return path
+
+async def dispatch_image(question: str, session_id: str, sheet: CharacterSheet, sheet_path: str,
+                         image_bytes: Optional[bytes] = None, size: str = "full", prompt: Optional[str] = None) -> dict:
+    """Encola la imagen (o la genera en línea si no hay cola) y devuelve la respuesta unificada."""
+    if image_queue is None:
+        return await run_image_request(question, session_id, sheet, image_bytes, size, prompt)
+
+    try:
+        job_id = await image_queue.submit(session_id, question, sheet_path, image_bytes, prompt)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Miau... (Estoy dibujando demasiado, inténtalo en un momento).")
+    return {"type": "image_job", "content": job_id}
+
+def get_export_executor():
+    """Pool de procesos para el renderizado de documentos (CPU), creado al primer uso."""
+    global _export_executor
+    if _export_executor is None:
+        _export_executor = make_executor()
+    return _export_executor
+
+def _check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Formato no válido: '{fmt}'. Usa uno de {', '.join(EXPORT_FORMATS)}.")
+
+def _job_response(job: dict, size: str = "full") -> dict:
+    content = job.get("result")
+    if content and size != "full":
+        content = variant_url(content, size) or content
+    return {"id": job["id"], "status": job["status"], "content": content, "error": job.get("error")}
+
+def _check_size(size: str):
+    if size not in SIZES:
+        raise HTTPException(status_code=422, detail=f"Tamaño no válido: '{size}'. Usa uno de {', '.join(SIZES)}.")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoint deshabilitado: define ADMIN_TOKEN.")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Token de administración no válido.")
+
+#ENDPOINTS
+@app.post("/ask", response_model=UnifiedResponse)
+async def unified_ask_endpoint(
+    question: str = Form(...),
+    session_id: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    character_sheet_path: str = Form("data/ficha/gary.json"),
+    image_size: str = Form("full")
+):
+    _check_size(image_size)
+    sheet = get_sheet(character_sheet_path)
+
+    image_bytes = await image.read() if image else None
+    prompt = None
+    if not image_bytes:
+        intent, prompt, hits = await route_question(question, sheet)
+        if intent != "image":
+            return await answer_text(question, session_id, sheet, hits)
+
+    return await dispatch_image(question, session_id, sheet, character_sheet_path, image_bytes, image_size, prompt)
+
+@app.post("/ask/batch")
+async def batch_ask_endpoint(request: BatchRequest):
+    """
+    Procesa muchas preguntas con concurrencia acotada y devuelve NDJSON, una línea por
+    pregunta en cuanto termina (con su 'index' original). Las fichas se cargan una vez por lote,
+    las intenciones se clasifican en una sola llamada y las preguntas de una misma sesión
+    se procesan en orden para no mezclar su historial.
+    """
+    items = request.items
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} preguntas por lote.")
+    _check_size(request.image_size)
+
+    sheet_paths: Dict[str, str] = {}
+    sheets: Dict[str, CharacterSheet] = {}
+    sheet_errors: Dict[str, str] = {}
+    for character in {item.character for item in items}:
+        try:
+            sheet_paths[character] = resolve_sheet_path(character)
+            sheets[character] = get_sheet(sheet_paths[character])
+        except Exception as e:
+            sheet_errors[character] = str(e)
+
+    # Las preguntas con un personaje no válido solo devolverán un error: no se clasifican.
+    valid = [index for index, item in enumerate(items) if item.character not in sheet_errors]
+    classified = await classify_intents([items[index].question for index in valid]) if valid else []
+    intents = dict(zip(valid, classified))
+    semaphore = asyncio.Semaphore(max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)))
+    results: "asyncio.Queue[dict]" = asyncio.Queue()
+
+    async def process(index: int, item: BatchItem) -> dict:
+        if item.character in sheet_errors:
+            return {"index": index, "session_id": item.session_id, "type": "error", "content": sheet_errors[item.character]}
+        sheet = sheets[item.character]
+        try:
+            async with semaphore:
+                if intents[index] == "image":
+                    response = await dispatch_image(item.question, item.session_id, sheet,
+                                                    sheet_paths[item.character], size=request.image_size)
+                else:
+                    response = await answer_text(item.question, item.session_id, sheet)
+        except HTTPException as e:
+            response = {"type": "error", "content": str(e.detail)}
+        except Exception as e:
+            print(f"Error en el elemento {index} del lote: {e}")
+            response = {"type": "error", "content": "Miau... (Tuve un problema con esta pregunta)."}
+        return {"index": index, "session_id": item.session_id, **response}
+
+    async def run_session(indexed_items: List[Tuple[int, BatchItem]]):
+        for index, item in indexed_items:
+            await results.put(await process(index, item))
+
+    by_session: Dict[str, List[Tuple[int, BatchItem]]] = {}
+    for index, item in enumerate(items):
+        by_session.setdefault(item.session_id, []).append((index, item))
+
+    async def stream():
+        tasks = [asyncio.create_task(run_session(group)) for group in by_session.values()]
+        try:
+            for _ in range(len(items)):
+                yield json.dumps(await results.get(), ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_image_job(job_id: str, size: str = "full"):
+    """Estado de un trabajo de imagen; 'content' es la URL /images/... cuando está 'done'."""
+    _check_size(size)
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return _job_response(job, size)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_image_job(job_id: str, size: str = "full"):
+    """Server-Sent Events con cada cambio de estado hasta que el trabajo termina."""
+    _check_size(size)
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"data: {json.dumps(_job_response(current, size))}\n\n"
+            if current["status"] in TERMINAL_STATUSES:
+                return
+            if image_queue:
+                await image_queue.wait_for_update(job_id, timeout=1.0)
+            else:
+                await asyncio.sleep(1.0)
+            current = await asyncio.to_thread(get_job, job_id) or current
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/export/{session_id}", dependencies=[Depends(require_admin)])
+async def export_session_endpoint(session_id: str, format: str = "pdf", character: str = "GaryBot"):
+    """Exporta una conversación completa a PDF/DOCX sin bloquear el event loop."""
+    _check_format(format)
+    loop = asyncio.get_running_loop()
+    _, path, error = await loop.run_in_executor(get_export_executor(), export_session, session_id, format, EXPORT_DIR, character)
+    if error:
+        raise HTTPException(status_code=500, detail=f"No se pudo exportar la sesión: {error}")
+    return FileResponse(path, filename=os.path.basename(path))
+
+@app.post("/export", dependencies=[Depends(require_admin)])
+def export_sessions_endpoint(request: ExportRequest):
+    """Exportación masiva: devuelve NDJSON con la ruta (o el error) de cada sesión según se renderiza."""
+    _check_format(request.format)
+    if not request.all and not request.session_ids:
+        raise HTTPException(status_code=422, detail="Indica 'session_ids' o 'all': true.")
+    session_ids = iter_session_ids(request.since) if request.all else iter(request.session_ids)
+
+    def lines():
+        # Generador síncrono: Starlette lo recorre en su threadpool.
+        for session_id, path, error in export_sessions(session_ids, request.format, EXPORT_DIR,
+                                                       request.character, executor=get_export_executor()):
+            yield json.dumps({"session_id": session_id, "path": path, "error": error}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def collect_status() -> dict:
+    """Foto del estado operativo del proceso y de la base de datos (se ejecuta en un hilo)."""
+    image_bytes, image_files = disk_usage(IMAGE_DIR)
+    return {
+        "database": get_operational_status(),
+        # Con varios workers cada uno responde con sus propias cifras de pool, cachés y colas.
+        "worker_pid": os.getpid(),
+        "db_pool": pool_stats(),
+        "history_buffer": history_buffer_stats(),
+        "episodes_snapshot": {"path": episodes_snapshot.path, "episodes": len(episodes_snapshot),
+                              "age_s": round(episodes_snapshot.age_s)} if episodes_snapshot else None,
+        "caches": cache_stats(),
+        "cache_warmup": warmup_report(),
+        "upstream": {"circuit_breakers": {name: b.stats() for name, b in ai_core.breakers.items()},
+                     # cached_tokens: parte del prompt servida desde la caché de prompts del proveedor.
+                     "token_usage": llm_provider.usage_stats()},
+        "image_queue": image_queue.stats() if image_queue else None,
+        "images_disk": {"bytes": image_bytes, "files": image_files,
+                        "quota_bytes": int(IMAGE_DISK_QUOTA_MB * 1024 * 1024)},
+    }
+
+@app.get("/status")
+async def status_endpoint():
+    """Estado operativo cacheado STATUS_TTL_S segundos; un solo cálculo concurrente."""
+    now = time.monotonic()
+    if _status_cache["value"] is not None and now < _status_cache["expires"]:
+        return _status_cache["value"]
+    async with _status_lock:
+        if _status_cache["value"] is None or time.monotonic() >= _status_cache["expires"]:
+            value = await asyncio.to_thread(collect_status)
+            value["generated_at"] = time.time()
+            _status_cache["value"] = value
+            _status_cache["expires"] = time.monotonic() + STATUS_TTL_S
+    return _status_cache["value"]
+
 @app.post("/reset")
 def reset_chat(request: ResetRequest):
     """
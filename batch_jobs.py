@@ -0,0 +1,375 @@
+"""
+Modo batch para los trabajos offline: enriquecimiento de episodios, prompts de escena y CSV de episodios.
+
+En lugar de cientos de llamadas interactivas, cada trabajo escribe sus peticiones pendientes en un
+JSONL con el formato de la Batch API de OpenAI (una petición por línea, con su custom_id), lo envía,
+espera a que termine y empareja el archivo de resultados por custom_id. La ingesta es idempotente:
+repetirla con los mismos resultados deja la BD o el CSV igual.
+
+BATCH_SERVICE elige el servicio: "openai" (Batch API) o "local", que procesa el archivo en este
+proceso con el backend de la tarea (p. ej. LLM_BACKEND=stub) y escribe la salida en el mismo formato.
+Por defecto se usa "openai" si la tarea va a OpenAI y "local" en otro caso.
+
+    python batch_jobs.py run enrich
+    python batch_jobs.py submit episode_data --total 300
+    python batch_jobs.py wait data/batches/episode_data-20250101-120000-3f9a1c
+    python batch_jobs.py ingest data/batches/episode_data-20250101-120000-3f9a1c
+"""
+
+import os
+import json
+import time
+import uuid
+import argparse
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import llm_provider
+
+load_dotenv()
+
+BATCH_DIR = os.environ.get("BATCH_DIR", "data/batches")
+BATCH_SERVICE = os.environ.get("BATCH_SERVICE", "")
+BATCH_POLL_S = float(os.environ.get("BATCH_POLL_S", "60"))
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def request_line(custom_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def write_jsonl(path: str, lines: List[Dict[str, Any]]):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class OpenAIBatchService:
+    """Batch API de OpenAI: sube el JSONL, crea el batch y descarga salida y errores."""
+    name = "openai"
+
+    def __init__(self):
+        self.client = llm_provider.get_backend("openai").sync_client
+
+    def submit(self, input_path: str, metadata: Dict[str, str]) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window="24h", metadata=metadata)
+        return batch.id
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {"status": batch.status, "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id,
+                "completed": counts.completed if counts else 0, "failed": counts.failed if counts else 0,
+                "total": counts.total if counts else 0}
+
+    def download(self, info: Dict[str, Any], output_path: str):
+        # Las peticiones fallidas van a un archivo aparte con el mismo formato: se juntan en uno.
+        with open(output_path, "wb") as out:
+            for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+                if file_id:
+                    out.write(self.client.files.content(file_id).read())
+
+
+class LocalBatchService:
+    """
+    Sustituto local de la Batch API: procesa el JSONL con el backend indicado al enviarlo
+    y guarda la salida en el formato de OpenAI. Sirve para probar todo el flujo sin red (stub).
+    """
+    name = "local"
+
+    def __init__(self, backend: str, directory: Optional[str] = None):
+        self.backend = backend
+        self.directory = directory or os.path.join(BATCH_DIR, "local")
+
+    def _paths(self, batch_id: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, batch_id)
+        return base + ".json", base + ".output.jsonl"
+
+    def _execute(self, index: int, line: Dict[str, Any]) -> Dict[str, Any]:
+        body = line["body"]
+        provider = llm_provider.get_backend(self.backend)
+        try:
+            if "response_format" in body:
+                content = json.dumps(provider.chat_json(body["model"], body["messages"], body["response_format"],
+                                                        body.get("temperature"), body.get("max_tokens")),
+                                     ensure_ascii=False)
+            else:
+                content = provider.chat(body["model"], body["messages"], body.get("temperature"), body.get("max_tokens"))
+        except Exception as e:
+            return {"id": f"batch_req_{index}", "custom_id": line["custom_id"], "response": None,
+                    "error": {"code": type(e).__name__, "message": str(e)}}
+        completion = {"object": "chat.completion", "model": body["model"],
+                      "choices": [{"index": 0, "finish_reason": "stop",
+                                   "message": {"role": "assistant", "content": content}}]}
+        return {"id": f"batch_req_{index}", "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion}, "error": None}
+
+    def submit(self, input_path: str, metadata: Dict[str, str]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        batch_id = f"batch_local_{uuid.uuid4().hex[:16]}"
+        state_path, output_path = self._paths(batch_id)
+        results = [self._execute(i, line) for i, line in enumerate(read_jsonl(input_path))]
+        write_jsonl(output_path, results)
+        failed = sum(1 for r in results if r["error"])
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"status": "completed", "metadata": metadata, "total": len(results),
+                       "completed": len(results) - failed, "failed": failed}, f)
+        return batch_id
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        state_path, output_path = self._paths(batch_id)
+        with open(state_path, encoding="utf-8") as f:
+            return {**json.load(f), "output_path": output_path}
+
+    def download(self, info: Dict[str, Any], output_path: str):
+        with open(info["output_path"], "rb") as src, open(output_path, "wb") as out:
+            out.write(src.read())
+
+
+def get_service(task: str, name: str = BATCH_SERVICE):
+    backend, _ = llm_provider.route(task)
+    name = name or ("openai" if backend == "openai" else "local")
+    if name == "openai":
+        return OpenAIBatchService()
+    if name == "local":
+        return LocalBatchService(backend)
+    raise ValueError(f"Servicio de batch desconocido: '{name}' (usa openai o local).")
+
+
+def iter_results(output_path: str, json_content: bool) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    """(custom_id, contenido o None, error o None) por cada línea del archivo de resultados."""
+    for line in read_jsonl(output_path):
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or (response.get("body") or {}).get("error")
+            yield line["custom_id"], None, json.dumps(error, ensure_ascii=False)
+            continue
+        content = response["body"]["choices"][0]["message"]["content"] or ""
+        if json_content:
+            try:
+                content = json.loads(content)
+            except ValueError as e:
+                yield line["custom_id"], None, f"JSON no válido: {e}"
+                continue
+        yield line["custom_id"], content, None
+
+
+# --- Trabajos ---------------------------------------------------------------------------------
+
+def _enrich_lines(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    from enrich_episodes_db import ENRICH_SCHEMA, enrich_messages, fetch_episodes_to_enrich
+    return [request_line(f"enrich-{ep_id}", llm_provider.request_body("enrich", enrich_messages(title, summary),
+                                                                      ENRICH_SCHEMA))
+            for ep_id, title, summary in fetch_episodes_to_enrich(params.get("character", "Gary"))]
+
+
+def _enrich_ingest(params: Dict[str, Any], results: Iterator[Tuple[str, Any]]) -> int:
+    from enrich_episodes_db import update_episode_in_db
+    return sum(1 for custom_id, data in results if update_episode_in_db(int(custom_id.split("-", 1)[1]), data))
+
+
+def _scene_prompt_lines(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    from character_models import CharacterSheet
+    from sheet_reader import load_character_sheet
+    from enrich_episodes_db import (SCENE_PROMPT_MAX_TOKENS, SCENE_PROMPT_TEMPERATURE,
+                                    fetch_episodes_without_scene_prompt, scene_prompt_messages)
+    sheet = CharacterSheet(**load_character_sheet(params.get("sheet", "data/ficha/gary.json")))
+    # El nombre se guarda con el trabajo: la ingesta no necesita volver a leer la ficha.
+    params["character"] = sheet.name
+    return [request_line(f"scene-{ep['id']}", llm_provider.request_body(
+                "scene_prompt", scene_prompt_messages(sheet, ep),
+                temperature=SCENE_PROMPT_TEMPERATURE, max_tokens=SCENE_PROMPT_MAX_TOKENS))
+            for ep in fetch_episodes_without_scene_prompt(sheet.name)]
+
+
+def _scene_prompt_ingest(params: Dict[str, Any], results: Iterator[Tuple[str, Any]]) -> int:
+    from episodes_db import save_scene_prompt
+    saved = 0
+    for custom_id, prompt in results:
+        if prompt.strip():
+            save_scene_prompt(int(custom_id.split("-", 1)[1]), params["character"], prompt.strip())
+            saved += 1
+    return saved
+
+
+def _episode_data_lines(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    from generate_csv_with_ai import EPISODE_DATA_SCHEMA, episode_batch_messages, episode_ranges
+    return [request_line(f"episodes-{start:04d}-{end:04d}", llm_provider.request_body(
+                "episode_data", episode_batch_messages(start, end), EPISODE_DATA_SCHEMA))
+            for start, end in episode_ranges(params.get("total", 300), params.get("batch_size", 10))]
+
+
+def _episode_data_ingest(params: Dict[str, Any], results: Iterator[Tuple[str, Any]]) -> int:
+    from generate_csv_with_ai import EPISODES_CSV_PATH, find_list_in_json, save_episodes_csv
+    episodes = []
+    # Orden estable por custom_id: si dos lotes traen el mismo número de episodio, gana siempre el mismo.
+    for _, data in sorted(results, key=lambda item: item[0]):
+        episodes.extend(find_list_in_json(data) or [])
+    if not episodes:
+        return 0
+    save_episodes_csv(episodes, params.get("output", EPISODES_CSV_PATH), merge=True)
+    return len(episodes)
+
+
+@dataclass(frozen=True)
+class JobKind:
+    task: str
+    json_content: bool
+    build: Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+    ingest: Callable[[Dict[str, Any], Iterator[Tuple[str, Any]]], int]
+
+
+JOB_KINDS: Dict[str, JobKind] = {
+    "enrich": JobKind("enrich", True, _enrich_lines, _enrich_ingest),
+    "scene_prompts": JobKind("scene_prompt", False, _scene_prompt_lines, _scene_prompt_ingest),
+    "episode_data": JobKind("episode_data", True, _episode_data_lines, _episode_data_ingest),
+}
+
+
+def _load_job(job_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(job_dir, "job.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_job(job_dir: str, job: Dict[str, Any]):
+    tmp_path = os.path.join(job_dir, "job.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(job_dir, "job.json"))
+
+
+def submit_job(kind: str, service_name: str = BATCH_SERVICE, **params) -> Optional[str]:
+    """Escribe las peticiones pendientes del trabajo y las envía. Devuelve el directorio del trabajo (None si no hay nada)."""
+    job_kind = JOB_KINDS[kind]
+    lines = job_kind.build(params)
+    if not lines:
+        print(f"No hay peticiones pendientes para el trabajo '{kind}'.")
+        return None
+    # El sufijo aleatorio evita que dos envíos del mismo tipo en el mismo segundo compartan directorio.
+    job_dir = os.path.join(BATCH_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+    os.makedirs(job_dir)
+    input_path = os.path.join(job_dir, "input.jsonl")
+    write_jsonl(input_path, lines)
+
+    service = get_service(job_kind.task, service_name)
+    batch_id = service.submit(input_path, {"job": kind})
+    _save_job(job_dir, {"kind": kind, "service": service.name, "backend": llm_provider.route(job_kind.task)[0],
+                        "batch_id": batch_id, "requests": len(lines), "params": params,
+                        "status": "submitted", "ingested": False})
+    print(f"Trabajo '{kind}' enviado al servicio '{service.name}': {len(lines)} peticiones, batch {batch_id} ({job_dir}).")
+    return job_dir
+
+
+def _service_for_job(job: Dict[str, Any]):
+    if job["service"] == "local":
+        return LocalBatchService(job["backend"])
+    return OpenAIBatchService()
+
+
+def wait_job(job_dir: str, poll_s: float = BATCH_POLL_S, timeout_s: Optional[float] = None) -> Dict[str, Any]:
+    """Consulta el batch hasta que termina y descarga output.jsonl. Se puede reanudar en otro proceso."""
+    job = _load_job(job_dir)
+    service = _service_for_job(job)
+    started = time.monotonic()
+    while True:
+        info = service.status(job["batch_id"])
+        if info["status"] in TERMINAL_STATUSES:
+            break
+        if timeout_s is not None and time.monotonic() - started > timeout_s:
+            return info
+        print(f"  -> Batch {job['batch_id']}: {info['status']} ({info.get('completed', 0)}/{info.get('total', 0)})")
+        time.sleep(poll_s)
+
+    output_path = os.path.join(job_dir, "output.jsonl")
+    if info["status"] == "completed":
+        service.download(info, output_path)
+    job["status"] = info["status"]
+    _save_job(job_dir, job)
+    print(f"Batch {job['batch_id']} terminado con estado '{info['status']}' "
+          f"({info.get('completed', 0)} correctas, {info.get('failed', 0)} con error).")
+    return info
+
+
+def ingest_job(job_dir: str) -> Dict[str, int]:
+    """Ingiere output.jsonl. Las peticiones con error quedan pendientes para el siguiente trabajo."""
+    job = _load_job(job_dir)
+    job_kind = JOB_KINDS[job["kind"]]
+    output_path = os.path.join(job_dir, "output.jsonl")
+    if not os.path.exists(output_path):
+        raise FileNotFoundError(f"El trabajo {job_dir} aún no tiene resultados; ejecuta antes 'wait'.")
+
+    errors: List[Tuple[str, str]] = []
+
+    def successful():
+        for custom_id, content, error in iter_results(output_path, job_kind.json_content):
+            if error:
+                errors.append((custom_id, error))
+            else:
+                yield custom_id, content
+
+    applied = job_kind.ingest(job["params"], successful())
+    for custom_id, error in errors[:10]:
+        print(f"  -> {custom_id}: {error}")
+    job["ingested"] = True
+    _save_job(job_dir, job)
+    print(f"Trabajo '{job['kind']}' ingerido: {applied} cambios aplicados, {len(errors)} peticiones con error.")
+    return {"applied": applied, "errors": len(errors)}
+
+
+def run_job(kind: str, service_name: str = BATCH_SERVICE, poll_s: float = BATCH_POLL_S, **params) -> Optional[Dict[str, int]]:
+    job_dir = submit_job(kind, service_name, **params)
+    if job_dir is None:
+        return None
+    if wait_job(job_dir, poll_s)["status"] != "completed":
+        return None
+    return ingest_job(job_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trabajos offline por lotes (formato Batch API de OpenAI).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("submit", "Escribe y envía las peticiones pendientes"),
+                               ("run", "Envía, espera e ingiere")):
+        p = sub.add_parser(command, help=help_text)
+        p.add_argument("kind", choices=sorted(JOB_KINDS))
+        p.add_argument("--service", default=BATCH_SERVICE, help="openai o local (por defecto, según el backend de la tarea)")
+        p.add_argument("--character", default="Gary", help="enrich: personaje cuyos episodios se enriquecen")
+        p.add_argument("--sheet", default="data/ficha/gary.json", help="scene_prompts: ficha del personaje")
+        p.add_argument("--total", type=int, default=300, help="episode_data: número de episodios")
+        p.add_argument("--batch-size", type=int, default=10, help="episode_data: episodios por petición")
+    p_wait = sub.add_parser("wait", help="Espera a que termine un trabajo y descarga los resultados")
+    p_wait.add_argument("job_dir")
+    p_ingest = sub.add_parser("ingest", help="Ingiere (de forma idempotente) los resultados de un trabajo")
+    p_ingest.add_argument("job_dir")
+    args = parser.parse_args()
+
+    if args.command in ("submit", "run"):
+        params = {"enrich": {"character": args.character}, "scene_prompts": {"sheet": args.sheet},
+                  "episode_data": {"total": args.total, "batch_size": args.batch_size}}[args.kind]
+        if args.command == "submit":
+            submit_job(args.kind, args.service, **params)
+        else:
+            run_job(args.kind, args.service, **params)
+    elif args.command == "wait":
+        wait_job(args.job_dir)
+    else:
+        ingest_job(args.job_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Se ejecuta en un proceso hijo limpio: mide el tiempo de importación y la memoria residente.
+_PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = [m for m in ("pandas", "openai", "PIL", "docx", "reportlab") if m in sys.modules]
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"import_ms": elapsed * 1000, "rss_mb": rss_kb / 1024, "heavy_modules": heavy}}))
+"""
+
+
+def run_probe(module: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)],
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(module: str, top: int) -> list:
+    """Imports directos del módulo con mayor tiempo acumulado según `python -X importtime`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # La indentación indica la profundidad: 3 espacios = import directo del módulo medido.
+        if name.startswith("   ") and not name.startswith("     "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque: tiempo de import y RSS por worker.")
+    parser.add_argument("--module", default="app", help="Módulo a importar (por defecto: app)")
+    parser.add_argument("--runs", type=int, default=5, help="Número de arranques en frío a medir")
+    parser.add_argument("--top", type=int, default=10, help="Imports más caros a mostrar")
+    parser.add_argument("--max-import-ms", type=float, help="Falla (exit 1) si la mediana supera este valor")
+    parser.add_argument("--max-rss-mb", type=float, help="Falla (exit 1) si la mediana de RSS supera este valor")
+    args = parser.parse_args()
+
+    samples = [run_probe(args.module) for _ in range(args.runs)]
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    rss_mb = statistics.median(s["rss_mb"] for s in samples)
+
+    print(f"\n--- ARRANQUE DE '{args.module}' ({args.runs} ejecuciones) ---")
+    print(f"Tiempo de import (mediana): {import_ms:.0f} ms (min {min(s['import_ms'] for s in samples):.0f} ms)")
+    print(f"RSS tras importar (mediana): {rss_mb:.1f} MB")
+    print(f"Dependencias pesadas cargadas: {', '.join(samples[-1]['heavy_modules']) or 'ninguna'}")
+    print("\nImports más caros (acumulado):")
+    for ms, name in top_imports(args.module, args.top):
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"\nRegresión: el import tarda {import_ms:.0f} ms (> {args.max_import_ms:.0f} ms).")
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print(f"\nRegresión: RSS de {rss_mb:.1f} MB (> {args.max_rss_mb:.1f} MB).")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Caché compartida entre workers.
+
+CACHE_URL elige el backend:
+  - "" o "local://"  -> LRU en el propio proceso (por defecto; cada worker tiene la suya)
+  - "redis://..."    -> Redis (o cualquier servidor compatible); requiere el paquete `redis`
+  - "memory://"      -> backend Redis sobre un servidor simulado en memoria (pruebas/desarrollo)
+
+Cache(namespace) añade encima el prefijo de espacio de nombres, serialización JSON, TTL,
+invalidación por generación e instancia única de cálculo (single-flight) por clave.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "garybot")
+CACHE_LOCAL_MAX_ITEMS = int(os.environ.get("CACHE_LOCAL_MAX_ITEMS", "10000"))
+# Tiempo máximo que un worker espera a que otro termine de calcular la misma clave.
+CACHE_LOCK_WAIT_S = float(os.environ.get("CACHE_LOCK_WAIT_S", "30"))
+_LOCK_POLL_S = 0.05
+# Borra el cerrojo solo si sigue siendo del mismo dueño (pudo caducar y tomarlo otro worker).
+_COMPARE_AND_DELETE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Cada cuánto se relee la generación de un espacio de nombres en un backend compartido.
+_GENERATION_REFRESH_S = 1.0
+
+
+class LocalBackend:
+    """LRU con caducidad dentro del proceso. Guarda los valores tal cual (sin serializar)."""
+    shared = False
+
+    def __init__(self, max_items: int = CACHE_LOCAL_MAX_ITEMS):
+        self.max_items = max_items
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] and entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None, nx: bool = False) -> bool:
+        with self._lock:
+            if nx and self._alive(key) is not None:
+                return False
+            self._data[key] = (time.monotonic() + ttl_s if ttl_s else 0.0, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+            return True
+
+    def _alive(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None or (entry[0] and entry[0] <= time.monotonic()):
+            return None
+        return entry[1]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._alive(key) or 0) + 1
+            self._data[key] = (0.0, value)
+            return value
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class InMemoryRedis:
+    """Servidor Redis simulado en memoria con el subconjunto de la API de redis-py que usa RedisBackend."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] and entry[0] <= time.time():
+            del self._data[key]
+            return None
+        return entry[1]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._alive(key)
+
+    def set(self, key: str, value, ex: Optional[float] = None, px: Optional[int] = None, nx: bool = False):
+        with self._lock:
+            if nx and self._alive(key) is not None:
+                return None
+            ttl_s = ex if ex else (px / 1000 if px else 0)
+            data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+            self._data[key] = (time.time() + ttl_s if ttl_s else 0.0, data)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._alive(key) or 0) + 1
+            expires = self._data[key][0] if key in self._data else 0.0
+            self._data[key] = (expires, str(value).encode("utf-8"))
+            return value
+
+    def eval(self, script: str, numkeys: int, *args) -> int:
+        """Solo el script de borrado condicional de RedisBackend."""
+        if script != _COMPARE_AND_DELETE or numkeys != 1:
+            raise NotImplementedError("InMemoryRedis solo simula el borrado condicional.")
+        key, expected = args
+        with self._lock:
+            if self._alive(key) == expected:
+                del self._data[key]
+                return 1
+            return 0
+
+    def dbsize(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """Backend compartido sobre un cliente con la API de redis-py. Los valores son bytes."""
+    shared = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl_s: Optional[float] = None, nx: bool = False) -> bool:
+        px = max(1, int(ttl_s * 1000)) if ttl_s else None
+        return bool(self.client.set(key, value, px=px, nx=nx))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        """Borra la clave solo si aún contiene `value` (atómico en el servidor)."""
+        return bool(self.client.eval(_COMPARE_AND_DELETE, 1, key, value))
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+    def __len__(self) -> int:
+        return int(self.client.dbsize())
+
+
+def make_backend(url: str = CACHE_URL):
+    if not url or url.startswith("local://"):
+        return LocalBackend()
+    if url.startswith("memory://"):
+        return RedisBackend(InMemoryRedis())
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            # redis solo hace falta con una caché compartida; no es una dependencia obligatoria.
+            import redis
+        except Exception:
+            print("[Aviso] CACHE_URL apunta a Redis pero falta el paquete 'redis'; se usa la caché local.")
+            return LocalBackend()
+        return RedisBackend(redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0))
+    raise ValueError(f"CACHE_URL no soportada: {url}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend compartido del proceso (se crea en el primer uso)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = make_backend()
+    return _backend
+
+
+def hash_key(*parts: str) -> str:
+    """Clave corta y estable para textos largos (preguntas, prompts)."""
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _serialize(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _deserialize(data: bytes) -> Any:
+    return json.loads(data)
+
+
+_MISS = object()
+
+
+class Cache:
+    """
+    Espacio de nombres dentro de un backend. Los valores deben ser serializables a JSON
+    (salvo con `local_only`, donde se guardan los objetos tal cual). None no se cachea.
+    """
+    _registry: Dict[str, "Cache"] = {}
+
+    def __init__(self, namespace: str, ttl_s: Optional[float] = None, backend=None, local_only: bool = False):
+        self.namespace = namespace
+        self.ttl_s = ttl_s
+        self._backend = LocalBackend() if local_only else backend
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+        self._generation = (0, 0.0)  # (generación, próxima relectura)
+        self._inflight: Dict[str, threading.Lock] = {}
+        self._inflight_async: Dict[str, asyncio.Future] = {}
+        self._inflight_lock = threading.Lock()
+        Cache._registry[namespace] = self
+
+    @property
+    def backend(self):
+        return self._backend if self._backend is not None else get_backend()
+
+    def _gen_key(self) -> str:
+        return f"{CACHE_PREFIX}:{self.namespace}:gen"
+
+    def generation(self) -> int:
+        generation, refresh_at = self._generation
+        if self.backend.shared and time.monotonic() >= refresh_at:
+            try:
+                raw = self.backend.get(self._gen_key())
+                generation = int(raw) if raw else 0
+            except Exception:
+                self.stats["errors"] += 1
+            self._generation = (generation, time.monotonic() + _GENERATION_REFRESH_S)
+        return generation
+
+    def bump(self) -> int:
+        """Invalida todo el espacio de nombres (en todos los workers si el backend es compartido)."""
+        try:
+            generation = self.backend.incr(self._gen_key())
+        except Exception as e:
+            print(f"[Aviso] No se pudo invalidar la caché '{self.namespace}': {e}")
+            generation = self._generation[0] + 1
+        self._generation = (generation, time.monotonic() + _GENERATION_REFRESH_S)
+        return generation
+
+    def _full_key(self, key: str) -> str:
+        return f"{CACHE_PREFIX}:{self.namespace}:{self.generation()}:{key}"
+
+    def _get(self, full_key: str) -> Any:
+        backend = self.backend
+        try:
+            raw = backend.get(full_key)
+        except Exception:
+            self.stats["errors"] += 1
+            return _MISS
+        if raw is None:
+            return _MISS
+        return _deserialize(raw) if backend.shared else raw
+
+    def _set(self, full_key: str, value: Any, ttl_s: Optional[float] = None):
+        if value is None:
+            return
+        backend = self.backend
+        try:
+            backend.set(full_key, _serialize(value) if backend.shared else value, ttl_s or self.ttl_s)
+        except Exception:
+            self.stats["errors"] += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._get(self._full_key(key))
+        if value is _MISS:
+            self.stats["misses"] += 1
+            return default
+        self.stats["hits"] += 1
+        return value
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        """Como get, pero sin contar en las estadísticas (sondeos internos, p. ej. el precalentamiento)."""
+        value = self._get(self._full_key(key))
+        return default if value is _MISS else value
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None):
+        self._set(self._full_key(key), value, ttl_s)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        """get sin bloquear el event loop cuando el backend es remoto."""
+        if self.backend.shared:
+            return await asyncio.to_thread(self.get, key, default)
+        return self.get(key, default)
+
+    async def aset(self, key: str, value: Any, ttl_s: Optional[float] = None):
+        if self.backend.shared:
+            await asyncio.to_thread(self.set, key, value, ttl_s)
+        else:
+            self.set(key, value, ttl_s)
+
+    def claim(self, key: str, ttl_s: float) -> bool:
+        """True solo para el primero que la pide mientras no caduque (SET NX; con backend compartido, entre workers)."""
+        try:
+            return bool(self.backend.set(self._full_key(key), _serialize(os.getpid()), ttl_s, nx=True))
+        except Exception:
+            self.stats["errors"] += 1
+            return False
+
+    def delete(self, key: str):
+        try:
+            self.backend.delete(self._full_key(key))
+        except Exception:
+            self.stats["errors"] += 1
+
+    def _wait_for_other_worker(self, full_key: str) -> Tuple[Any, Optional[bytes]]:
+        """
+        Evita la estampida entre workers: solo uno calcula una clave a la vez (SET NX con caducidad);
+        los demás esperan a que aparezca el valor. Devuelve (valor o _MISS si hay que calcularlo,
+        token del cerrojo si se tomó).
+        """
+        backend = self.backend
+        if not backend.shared:
+            return _MISS, None
+        token = uuid.uuid4().hex.encode("ascii")
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_S
+        try:
+            while not backend.set(f"{full_key}:lock", token, CACHE_LOCK_WAIT_S, nx=True):
+                value = self._get(full_key)
+                if value is not _MISS or time.monotonic() >= deadline:
+                    return value, None
+                time.sleep(_LOCK_POLL_S)
+        except Exception:
+            self.stats["errors"] += 1
+            return _MISS, None
+        # Con el cerrojo ya tomado: otro worker pudo guardar el valor justo antes de soltarlo.
+        value = self._get(full_key)
+        if value is not _MISS:
+            self._release(full_key, token)
+            return value, None
+        return value, token
+
+    def _release(self, full_key: str, token: Optional[bytes]):
+        if token is None:
+            return
+        try:
+            self.backend.delete_if(f"{full_key}:lock", token)
+        except Exception:
+            self.stats["errors"] += 1
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl_s: Optional[float] = None) -> Any:
+        """
+        Valor cacheado o calculado una sola vez aunque lo pidan varios hilos/workers a la vez.
+        Si el espacio de nombres se invalida durante el cálculo, el resultado queda en la generación anterior.
+        """
+        full_key = self._full_key(key)
+        value = self._get(full_key)
+        if value is not _MISS:
+            self.stats["hits"] += 1
+            return value
+        with self._inflight_lock:
+            key_lock = self._inflight.setdefault(full_key, threading.Lock())
+        with key_lock:
+            try:
+                value, token = self._get(full_key), None
+                if value is _MISS:
+                    value, token = self._wait_for_other_worker(full_key)
+                if value is not _MISS:
+                    self.stats["hits"] += 1
+                    return value
+                self.stats["misses"] += 1
+                try:
+                    value = compute()
+                    self._set(full_key, value, ttl_s)
+                finally:
+                    self._release(full_key, token)
+                return value
+            finally:
+                with self._inflight_lock:
+                    self._inflight.pop(full_key, None)
+
+    async def aget_or_set(self, key: str, compute: Callable[[], Awaitable[Any]], ttl_s: Optional[float] = None) -> Any:
+        """Versión async de get_or_set: las corrutinas que piden la misma clave esperan al primer cálculo."""
+        shared = self.backend.shared
+        full_key = self._full_key(key)
+        value = await asyncio.to_thread(self._get, full_key) if shared else self._get(full_key)
+        if value is not _MISS:
+            self.stats["hits"] += 1
+            return value
+        pending = self._inflight_async.get(full_key)
+        if pending is not None:
+            value = await asyncio.shield(pending)
+            if value is _MISS:
+                # Se canceló la corrutina que calculaba: esta lo intenta por su cuenta.
+                return await self.aget_or_set(key, compute, ttl_s)
+            self.stats["hits"] += 1
+            return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_async[full_key] = future
+        token = None
+        try:
+            if shared:
+                value, token = await asyncio.to_thread(self._wait_for_other_worker, full_key)
+                if value is not _MISS:
+                    self.stats["hits"] += 1
+                    future.set_result(value)
+                    return value
+            self.stats["misses"] += 1
+            try:
+                value = await compute()
+                if shared:
+                    await asyncio.to_thread(self._set, full_key, value, ttl_s)
+                else:
+                    self._set(full_key, value, ttl_s)
+            finally:
+                if token is not None:
+                    await asyncio.to_thread(self._release, full_key, token)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # La cancelación es de quien calculaba, no de las demás: reciben _MISS y reintentan.
+            if not future.done():
+                future.set_result(_MISS)
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # Marca la excepción como leída por si ninguna otra corrutina la esperaba.
+                future.exception()
+            raise
+        finally:
+            self._inflight_async.pop(full_key, None)
+
+    def info(self) -> Dict[str, Any]:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "hit_rate": round(self.stats["hits"] / total, 3) if total else None,
+                "backend": "shared" if self.backend.shared else "local"}
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Estadísticas de todos los espacios de nombres creados en este proceso."""
+    return {namespace: cache.info() for namespace, cache in Cache._registry.items()}
@@ -0,0 +1,239 @@
+"""
+Precalentamiento de cachés tras un arranque o despliegue.
+
+Saca de chat_history las preguntas de usuario más repetidas en las últimas WARMUP_WINDOW_H horas,
+junto con el tipo de respuesta que recibieron (assistant o assistant_image), y las pasa por el
+mismo camino que /ask: búsqueda de episodios, intención (y prompt de imagen en modo combinado) y,
+para las que acabaron en imagen, la caché prompt -> imagen. Un presupuesto de llamadas, imágenes
+y tiempo evita ráfagas sin límite contra la API.
+
+Desactivado por defecto. Con CACHE_WARMUP=1 la app lo lanza en segundo plano desde el lifespan,
+pero solo con un backend de caché compartido (CACHE_URL): un único worker calienta como mucho una
+vez cada WARMUP_EVERY_S, aunque los workers se reciclen. Con la caché local de cada proceso se omite,
+porque cada worker (y cada reciclado) gastaría su propio presupuesto. Por defecto no genera imágenes
+(WARMUP_MAX_IMAGES=0). También se puede ejecutar a mano:
+
+    python cache_warmer.py --questions 100
+"""
+
+import os
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg2.extras import DictCursor
+
+from cache_backend import Cache, hash_key
+from episodes_db import _connect
+
+CACHE_WARMUP = os.environ.get("CACHE_WARMUP", "0") == "1"
+WARMUP_QUESTIONS = int(os.environ.get("WARMUP_QUESTIONS", "50"))
+WARMUP_WINDOW_H = float(os.environ.get("WARMUP_WINDOW_H", "72"))
+# Llamadas al modelo (intención / prompt) e imágenes nuevas como máximo por calentamiento.
+WARMUP_MAX_CALLS = int(os.environ.get("WARMUP_MAX_CALLS", "60"))
+WARMUP_MAX_IMAGES = int(os.environ.get("WARMUP_MAX_IMAGES", "0"))
+WARMUP_MAX_SECONDS = float(os.environ.get("WARMUP_MAX_SECONDS", "300"))
+# Un calentamiento automático como mucho en este intervalo (entre todos los workers y reciclados).
+WARMUP_EVERY_S = float(os.environ.get("WARMUP_EVERY_S", str(6 * 3600)))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", "4"))
+WARMUP_SHEET = os.environ.get("WARMUP_SHEET", "data/ficha/gary.json")
+
+# Cachés que se calientan y, de ellas, las que cuestan una llamada al modelo en cada fallo.
+WARMED_CACHES = ("episode_search", "intents", "intent_prompts", "prompt_images")
+UPSTREAM_CACHES = ("intents", "intent_prompts")
+
+_warmup_state = Cache("cache_warmup")
+_report: Dict[str, Any] = {"status": "pending"}
+_baseline: Dict[str, Dict[str, int]] = {}
+
+HOT_QUESTIONS_SQL = r"""
+WITH turns AS (
+    SELECT role, content,
+           LEAD(role) OVER (PARTITION BY session_id ORDER BY created_at, id) AS reply_role
+    FROM chat_history
+    WHERE created_at >= NOW() - make_interval(secs => %s)
+)
+SELECT MIN(content) AS question, COUNT(*) AS asked,
+       SUM(CASE WHEN reply_role = 'assistant_image' THEN 1 ELSE 0 END) AS image_replies,
+       SUM(COUNT(*)) OVER () AS total_asked
+FROM turns
+WHERE role = 'user'
+GROUP BY lower(regexp_replace(btrim(content), '\s+', ' ', 'g'))
+ORDER BY asked DESC
+LIMIT %s
+"""
+
+
+def hot_questions(limit: int = WARMUP_QUESTIONS, window_h: float = WARMUP_WINDOW_H) -> Tuple[List[Dict[str, Any]], int]:
+    """(preguntas más repetidas con su rol de respuesta dominante, total de preguntas en la ventana)."""
+    with _connect() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(HOT_QUESTIONS_SQL, (window_h * 3600, limit))
+            rows = [dict(row) for row in cur.fetchall()]
+    total = int(rows[0]["total_asked"]) if rows else 0
+    return [{"question": row["question"], "asked": int(row["asked"]),
+             "reply_role": "assistant_image" if row["image_replies"] * 2 > row["asked"] else "assistant"}
+            for row in rows], total
+
+
+def _cache_counters() -> Dict[str, Dict[str, int]]:
+    return {name: dict(Cache._registry[name].stats) for name in WARMED_CACHES if name in Cache._registry}
+
+
+def _delta(after: Dict[str, Dict[str, int]], before: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, Any]]:
+    result = {}
+    for name, stats in after.items():
+        hits = stats["hits"] - before.get(name, {}).get("hits", 0)
+        misses = stats["misses"] - before.get(name, {}).get("misses", 0)
+        result[name] = {"hits": hits, "misses": misses,
+                        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None}
+    return result
+
+
+def _upstream_misses() -> int:
+    counters = _cache_counters()
+    return sum(counters.get(name, {}).get("misses", 0) for name in UPSTREAM_CACHES)
+
+
+async def warm_caches(limit: int = WARMUP_QUESTIONS, window_h: float = WARMUP_WINDOW_H,
+                      max_calls: int = WARMUP_MAX_CALLS, max_images: int = WARMUP_MAX_IMAGES,
+                      max_seconds: float = WARMUP_MAX_SECONDS, sheet_path: str = WARMUP_SHEET) -> Dict[str, Any]:
+    """
+    Pasa las preguntas más frecuentes por las cachés de /ask sin generar respuestas ni tocar el historial.
+    El coste en llamadas se mide por los fallos de las cachés de intención, así que si hay tráfico real
+    a la vez el presupuesto se agota antes, nunca después.
+    """
+    global _report, _baseline
+    # Importación diferida: app importa este módulo para lanzarlo desde su lifespan.
+    import app
+    import ai_core
+    from episodes_db import search_episodes, search_episodes_with_citations
+
+    started = time.monotonic()
+    _report = {"status": "running", "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    questions, total_asked = await asyncio.to_thread(hot_questions, limit, window_h)
+    sheet = app.get_sheet(sheet_path)
+    before = _cache_counters()
+    misses_at_start = _upstream_misses()
+    counters = {"warmed": 0, "reserved": 0, "images": 0, "covered": 0}
+    stopped_by: Optional[str] = None
+    semaphore = asyncio.Semaphore(max(1, WARMUP_CONCURRENCY))
+
+    async def warm_one(item: Dict[str, Any]):
+        nonlocal stopped_by
+        async with semaphore:
+            if time.monotonic() - started > max_seconds:
+                stopped_by = stopped_by or "time"
+                return
+            # Cada pregunta cuesta como mucho dos llamadas: se reservan antes para no pasarse con las que están en vuelo.
+            if _upstream_misses() - misses_at_start + counters["reserved"] + 2 > max_calls:
+                stopped_by = stopped_by or "calls"
+                return
+            question = item["question"]
+            counters["reserved"] += 2
+            try:
+                intent, prompt, _ = await app.route_question(question, sheet)
+            finally:
+                counters["reserved"] -= 2
+            await asyncio.to_thread(search_episodes_with_citations, question, 2)
+            if item["reply_role"] == "assistant_image" and app.is_specific_request(question):
+                await asyncio.to_thread(search_episodes, question, 1)
+
+            # Solo con un prompt estable (modo combinado o escena por plantilla) la imagen se puede reutilizar.
+            if intent == "image" and prompt:
+                cached_path = await asyncio.to_thread(ai_core.image_cache.peek, hash_key(prompt))
+                if not (cached_path and os.path.exists(cached_path)):
+                    if counters["images"] < max_images:
+                        counters["images"] += 1
+                        await ai_core.generate_visual_image(prompt)
+                    else:
+                        stopped_by = stopped_by or "images"
+            counters["warmed"] += 1
+            counters["covered"] += item["asked"]
+
+    try:
+        results = await asyncio.gather(*(warm_one(item) for item in questions), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors[:3]:
+            print(f"Error calentando la caché: {error}")
+    except asyncio.CancelledError:
+        _report = {**_report, "status": "cancelled"}
+        raise
+
+    calls = _upstream_misses() - misses_at_start
+    _baseline = _cache_counters()
+    lookups = _delta(_baseline, before)
+    hits = sum(s["hits"] for s in lookups.values())
+    total = hits + sum(s["misses"] for s in lookups.values())
+    _report = {
+        "status": "done", "started_at": _report["started_at"], "elapsed_s": round(time.monotonic() - started, 1),
+        "questions": len(questions), "warmed": counters["warmed"], "errors": len(errors),
+        "upstream_calls": calls, "images_generated": counters["images"],
+        "stopped_by": stopped_by,
+        # Parte de las preguntas recientes que ahora encontrarán la caché caliente.
+        "traffic_coverage": round(counters["covered"] / total_asked, 3) if total_asked else None,
+        # Aciertos durante el propio calentamiento: lo que ya estaba en caché (p. ej. Redis sobrevivió al reinicio).
+        "warmup_hit_rate": round(hits / total, 3) if total else None,
+        "lookups": lookups,
+    }
+    print(f"Cachés precalentadas: {counters['warmed']}/{len(questions)} preguntas "
+          f"({_report['traffic_coverage'] or 0:.0%} del tráfico reciente), {calls} llamadas al modelo, "
+          f"{counters['images']} imágenes, {_report['elapsed_s']} s"
+          + (f"; detenido por presupuesto de {stopped_by}." if stopped_by else "."))
+    return _report
+
+
+def warmup_report() -> Dict[str, Any]:
+    """Último informe y tasa de aciertos del tráfico real desde que terminó el calentamiento."""
+    if not _baseline:
+        return _report
+    return {**_report, "since_warmup": _delta(_cache_counters(), _baseline)}
+
+
+async def run_warmup_in_background():
+    """Para el lifespan: no retrasa el arranque y solo calienta un worker cada WARMUP_EVERY_S, con caché compartida."""
+    global _report
+    if not _warmup_state.backend.shared:
+        _report = {"status": "skipped", "reason": "caché local por proceso: cada worker gastaría su propio presupuesto"}
+        print("Precalentamiento omitido: requiere una caché compartida (CACHE_URL).")
+        return
+    if not _warmup_state.claim("lock", max(WARMUP_EVERY_S, WARMUP_MAX_SECONDS)):
+        _report = {"status": "skipped", "reason": "otro worker ya calentó (o está calentando) la caché compartida"}
+        return
+    try:
+        await warm_caches()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _report = {"status": "failed", "error": str(e)}
+        print(f"No se pudieron precalentar las cachés: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalienta las cachés de /ask con las preguntas más frecuentes.")
+    parser.add_argument("--questions", type=int, default=WARMUP_QUESTIONS, help="Preguntas a calentar")
+    parser.add_argument("--hours", type=float, default=WARMUP_WINDOW_H, help="Ventana de historial (horas)")
+    parser.add_argument("--max-calls", type=int, default=WARMUP_MAX_CALLS, help="Llamadas al modelo como máximo")
+    parser.add_argument("--max-images", type=int, default=WARMUP_MAX_IMAGES, help="Imágenes nuevas como máximo")
+    parser.add_argument("--sheet", default=WARMUP_SHEET, help="Ficha del personaje")
+    parser.add_argument("--dry-run", action="store_true", help="Solo lista las preguntas que se calentarían")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        questions, total = hot_questions(args.questions, args.hours)
+        for item in questions:
+            print(f"{item['asked']:>5}  {item['reply_role']:<15}  {item['question']}")
+        covered = sum(item["asked"] for item in questions)
+        print(f"{len(questions)} preguntas, {covered / total:.0%} de las {total} recientes." if total else "Sin preguntas recientes.")
+        return
+    if not _warmup_state.backend.shared:
+        print("Aviso: la caché es local a este proceso (CACHE_URL vacío); el calentamiento no servirá a la API.")
+    report = asyncio.run(warm_caches(args.questions, args.hours, args.max_calls, args.max_images,
+                                     WARMUP_MAX_SECONDS, args.sheet))
+    for name, stats in report["lookups"].items():
+        print(f"  {name}: {stats['hits']} aciertos, {stats['misses']} fallos")
+
+
+if __name__ == "__main__":
+    main()
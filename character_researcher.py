@@ -1,15 +1,20 @@
 import os
+import re
 import json
-from openai import OpenAI
+import time
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from googlesearch import search
 
+import llm_provider
+
 load_dotenv()
-try:
-    client = OpenAI()
-except Exception as e:
-    print(f"Error al inicializar OpenAI: {e}")
-    client = None
 
 def search_internet_for(query: str, num_results: int = 5) -> list:
     """Busca en Google y devuelve una lista de URLs."""
@@ -22,29 +27,138 @@ def search_internet_for(query: str, num_results: int = 5) -> list:
         print(f"Error durante la búsqueda en internet: {e}")
         return []
 
-def get_text_from_url(url: str) -> str:
+RESEARCH_CACHE_DIR = os.environ.get("RESEARCH_CACHE_DIR", "data/cache/research")
+RESEARCH_CACHE_TTL_S = float(os.environ.get("RESEARCH_CACHE_TTL_S", str(7 * 24 * 3600)))
+RESEARCH_FETCH_WORKERS = int(os.environ.get("RESEARCH_FETCH_WORKERS", "8"))
+RESEARCH_TOKEN_BUDGET = int(os.environ.get("RESEARCH_TOKEN_BUDGET", "6000"))
+FETCH_TIMEOUT_S = 15
+# Aproximación suficiente para el presupuesto: ~4 caracteres por token.
+CHARS_PER_TOKEN = 4
+MIN_PASSAGE_CHARS = 40
+
+# Términos que delatan un pasaje útil para la ficha (personalidad y apariencia), en español e inglés.
+RELEVANT_TERMS = [
+    "personalidad", "personality", "carácter", "character", "actitud", "attitude", "comportamiento", "behavior",
+    "inteligente", "intelligent", "leal", "loyal", "perezoso", "lazy", "celoso", "jealous", "tímido", "shy",
+    "apariencia", "appearance", "aspecto", "color", "colour", "rosa", "pink", "azul", "blue", "amarillo", "yellow",
+    "concha", "shell", "ojos", "eyes", "cuerpo", "body", "tamaño", "size", "forma", "shape", "manchas", "spots",
+    "frase", "catchphrase", "dice", "says", "maúlla", "meow", "miau",
+]
+
+NOISE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg", "button"]
+
+_http: Optional[requests.Session] = None
+
+def _session() -> requests.Session:
+    """Sesión HTTP compartida con pool de conexiones (keep-alive entre páginas del mismo host)."""
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=RESEARCH_FETCH_WORKERS, pool_maxsize=RESEARCH_FETCH_WORKERS)
+        _http.mount("http://", adapter)
+        _http.mount("https://", adapter)
+        _http.headers["User-Agent"] = "Mozilla/5.0"
+    return _http
+
+def _cache_path(url: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+def fetch_html(url: str, cache_dir: str = RESEARCH_CACHE_DIR) -> str:
+    """Descarga el HTML de una URL, usando la caché en disco si es reciente."""
+    path = _cache_path(url, cache_dir)
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < RESEARCH_CACHE_TTL_S:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    try:
+        response = _session().get(url, timeout=FETCH_TIMEOUT_S)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"  -> Error al descargar {url}: {e}")
+        return ""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(response.text)
+    return response.text
+
+def fetch_pages(urls: List[str], cache_dir: str = RESEARCH_CACHE_DIR) -> Dict[str, str]:
+    """Descarga varias páginas en paralelo. Devuelve {url: html} solo de las que se obtuvieron."""
+    with ThreadPoolExecutor(max_workers=RESEARCH_FETCH_WORKERS) as executor:
+        pages = dict(zip(urls, executor.map(lambda url: fetch_html(url, cache_dir), urls)))
+    return {url: html for url, html in pages.items() if html}
+
+def extract_passages(html: str) -> List[str]:
     """
-    (Versión Simplificada) Esta es la parte más compleja en un proyecto real.
-    Para este prototipo, simularemos que obtenemos el texto, pero en realidad
-    le pasaremos la URL a la IA si tiene capacidad de navegación, o
-    simplemente usaremos el snippet de la búsqueda.
-    Para una implementación real, se usarían librerías como `BeautifulSoup` o `requests-html`.
-    Por ahora, vamos a devolver la URL para que la IA la procese si puede.
+    Extrae los párrafos del contenido principal de una página (wiki, artículo o <main>),
+    descartando navegación, scripts y demás ruido. No hace red: se puede probar con HTML guardado.
     """
-    return url 
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    root = (soup.find("div", class_="mw-parser-output") or soup.find("article")
+            or soup.find("main") or soup.body or soup)
+    passages = []
+    for element in root.find_all(["p", "li", "td", "blockquote"]):
+        if element.find(["p", "li"]):
+            continue  # El texto ya sale de los elementos hijos.
+        text = " ".join(element.get_text(" ").split())
+        if len(text) >= MIN_PASSAGE_CHARS:
+            passages.append(text)
+    return passages
+
+def get_text_from_url(url: str) -> str:
+    """Texto principal de la página (párrafos separados por saltos de línea)."""
+    return "\n".join(extract_passages(fetch_html(url)))
+
+def rank_passages(passages: List[str], character_name: str) -> List[str]:
+    """Elimina duplicados y ordena los pasajes por relevancia para personalidad y apariencia."""
+    name_terms = [t for t in re.findall(r"\w+", character_name.lower()) if len(t) > 2]
+    seen = set()
+    scored = []
+    for position, passage in enumerate(passages):
+        key = re.sub(r"\W+", " ", passage.lower()).strip()
+        if key in seen:
+            continue
+        seen.add(key)
+        # Palabras completas: 'color' no debe puntuar en 'colorful' ni 'eyes' en 'keyes'.
+        words = Counter(key.split())
+        score = sum(words[term] for term in RELEVANT_TERMS) + 2 * sum(1 for t in name_terms if t in words)
+        if score:
+            scored.append((score, position, passage))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [passage for _, _, passage in scored]
+
+def pack_passages(passages: List[str], token_budget: int = RESEARCH_TOKEN_BUDGET) -> List[str]:
+    """Toma los pasajes en orden hasta llenar el presupuesto de tokens."""
+    packed, used = [], 0
+    for passage in passages:
+        cost = len(passage) // CHARS_PER_TOKEN + 1
+        if used + cost > token_budget:
+            continue
+        packed.append(passage)
+        used += cost
+    return packed
+
+def gather_research_context(character_name: str, urls: List[str], token_budget: int = RESEARCH_TOKEN_BUDGET) -> List[str]:
+    """Descarga, extrae, deduplica, ordena y empaqueta los pasajes de todas las URLs."""
+    pages = fetch_pages(urls)
+    print(f"Se descargaron {len(pages)}/{len(urls)} páginas.")
+    passages = [passage for html in pages.values() for passage in extract_passages(html)]
+    packed = pack_passages(rank_passages(passages, character_name), token_budget)
+    print(f"Pasajes relevantes: {len(packed)} de {len(passages)} (presupuesto {token_budget} tokens).")
+    return packed
 
 def analyze_and_extract_character_info(character_name: str, search_results: list) -> dict:
     """
-    Usa GPT-4o para analizar los resultados de búsqueda y rellenar una ficha de personaje.
+    Usa el modelo de la tarea 'research' para analizar los resultados de búsqueda y rellenar una ficha de personaje.
     """
-    if not client:
+    if not llm_provider.is_available("research"):
         raise Exception("Cliente de OpenAI no inicializado.")
 
     print("Analizando resultados con IA para extraer información del personaje...")
     
     system_prompt = f"""
     Eres un analista de investigación de personajes de ficción. Tu tarea es analizar
-    las siguientes URLs y fragmentos de texto sobre el personaje "{character_name}".
+    los siguientes fragmentos de texto extraídos de páginas web sobre el personaje "{character_name}".
     Debes extraer y sintetizar la información para rellenar una ficha de personaje
     en formato JSON.
 
@@ -58,24 +172,17 @@ def analyze_and_extract_character_info(character_name: str, search_results: list
         "catchphrases": ["lista", "de", "frases", "típicas"]
     }}
 
-    Analiza el contenido de las URLs proporcionadas y genera únicamente el objeto JSON como respuesta, sin ningún texto adicional.
+    Analiza los fragmentos proporcionados y genera únicamente el objeto JSON como respuesta, sin ningún texto adicional.
     """
 
  
-    context = "\n".join(search_results)
+    context = "\n\n".join(search_results)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Aquí están los resultados de la búsqueda para '{character_name}':\n\n{context}"}
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        extracted_json_str = response.choices[0].message.content
-        character_data = json.loads(extracted_json_str)
+        character_data = llm_provider.chat_json("research", [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Aquí están los resultados de la búsqueda para '{character_name}':\n\n{context}"}
+        ])
         print("Análisis completado. Ficha de personaje extraída.")
         return character_data
         
@@ -97,17 +204,21 @@ def main():
         f"{character_name} physical appearance description",
         f"{character_name} Fandom wiki"
     ]
-    all_urls = []
-    for q in queries:
-        all_urls.extend(search_internet_for(q, num_results=2))
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        url_lists = list(executor.map(lambda q: search_internet_for(q, num_results=2), queries))
     
-    unique_urls = list(set(all_urls))
+    unique_urls = list(dict.fromkeys(url for urls in url_lists for url in urls))
 
     if not unique_urls:
         print("No se encontraron resultados en internet. No se puede continuar.")
         return
 
-    character_info = analyze_and_extract_character_info(character_name, unique_urls)
+    passages = gather_research_context(character_name, unique_urls)
+    if not passages:
+        print("No se pudo extraer texto de las páginas; se enviarán solo las URLs.")
+        passages = unique_urls
+
+    character_info = analyze_and_extract_character_info(character_name, passages)
 
     if not character_info:
         print("La IA no pudo generar la ficha de personaje.")
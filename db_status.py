@@ -1,5 +1,7 @@
 from episodes_db import _connect
 
+ENRICHED_SQL = "e.visual_summary IS NOT NULL AND e.visual_summary != ''"
+
 def get_database_status():
     """
     Se conecta a la base de datos y recupera un resumen del estado de los episodios.
@@ -12,18 +14,69 @@ def get_database_status():
     try:
         with _connect() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM episodes;")
-                status["total_episodes"] = cur.fetchone()[0]
-
-                cur.execute(
-                    "SELECT COUNT(*) FROM episodes WHERE visual_summary IS NOT NULL AND visual_summary != '';"
-                )
-                status["enriched_episodes"] = cur.fetchone()[0]
+                cur.execute(f"SELECT COUNT(*), COUNT(*) FILTER (WHERE {ENRICHED_SQL}) FROM episodes e;")
+                status["total_episodes"], status["enriched_episodes"] = cur.fetchone()
         return status
     except Exception as e:
         status["connection_error"] = str(e)
         return status
 
+def get_enrichment_coverage(cur) -> dict:
+    """
+    Cobertura de enriquecimiento total, por temporada y por personaje clave en una
+    sola pasada sobre `episodes` (GROUPING SETS).
+    """
+    cur.execute(f"""
+        SELECT GROUPING(e.season) AS season_rolled_up, GROUPING(kc.name) AS name_rolled_up, e.season, kc.name,
+               COUNT(DISTINCT e.id) AS total,
+               COUNT(DISTINCT e.id) FILTER (WHERE {ENRICHED_SQL}) AS enriched
+        FROM episodes e
+        LEFT JOIN LATERAL (
+            SELECT NULLIF(trim(x), '') AS name
+            FROM unnest(string_to_array(COALESCE(e.key_characters, ''), ',')) AS x
+        ) kc ON true
+        GROUP BY GROUPING SETS ((e.season), (kc.name), ())
+    """)
+    coverage = {"total_episodes": 0, "enriched_episodes": 0, "by_season": {}, "by_key_character": {}}
+    for season_rolled_up, name_rolled_up, season, name, total, enriched in cur.fetchall():
+        entry = {"total": total, "enriched": enriched}
+        if season_rolled_up and name_rolled_up:
+            coverage["total_episodes"], coverage["enriched_episodes"] = total, enriched
+        elif name_rolled_up:
+            coverage["by_season"][str(season)] = entry
+        elif name:
+            coverage["by_key_character"][name] = entry
+    return coverage
+
+def get_chat_history_stats(cur, active_minutes: int = 60) -> dict:
+    """Tamaño de chat_history (estimado por el planificador, sin escanear) y sesiones activas recientes."""
+    cur.execute("""
+        SELECT c.reltuples::BIGINT, pg_total_relation_size(c.oid)
+        FROM pg_class c WHERE c.oid = 'chat_history'::regclass
+    """)
+    estimated_rows, size_bytes = cur.fetchone()
+    cur.execute(
+        "SELECT COUNT(DISTINCT session_id) FROM chat_history WHERE created_at > CURRENT_TIMESTAMP - make_interval(mins => %s)",
+        (active_minutes,)
+    )
+    return {
+        "estimated_messages": max(0, estimated_rows),
+        "size_bytes": size_bytes,
+        f"active_sessions_{active_minutes}m": cur.fetchone()[0],
+    }
+
+def get_operational_status(active_minutes: int = 60) -> dict:
+    """Estado operativo de la base de datos para el endpoint /status."""
+    status = {"connection_error": None}
+    try:
+        with _connect() as conn:
+            with conn.cursor() as cur:
+                status["episodes"] = get_enrichment_coverage(cur)
+                status["chat_history"] = get_chat_history_stats(cur, active_minutes)
+    except Exception as e:
+        status["connection_error"] = str(e)
+    return status
+
 if __name__ == "__main__":
     print("🔍 Realizando auditoría de la base de datos de episodios...")
     
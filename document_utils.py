@@ -1,5 +1,8 @@
+import uuid
+import hashlib
 from pathlib import Path
 from datetime import datetime
+from typing import Dict, Iterable
 
 try:
     from docx import Document
@@ -13,6 +16,11 @@ def _sanitize_filename(name: str) -> str:
         name = name.replace(ch, "_")
     return name.strip()
 
+def _session_filename(character_name: str, session_id: str, extension: str) -> str:
+    # El hash del session_id original evita que dos sesiones que se sanean igual se pisen.
+    digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8]
+    return f"{_sanitize_filename(character_name)}_sesion_{_sanitize_filename(session_id)}_{digest}.{extension}"
+
 def save_response_to_docx(character_name: str, question: str, answer: str, out_dir: str = "data/out") -> str:
     """
     Crea un .docx con la pregunta y respuesta del personaje.
@@ -23,8 +31,9 @@ def save_response_to_docx(character_name: str, question: str, answer: str, out_d
 
     Path(out_dir).mkdir(parents=True, exist_ok=True)
     safe_name = _sanitize_filename(character_name)
+    # El sufijo aleatorio evita colisiones entre respuestas guardadas en el mismo segundo (p. ej. --batch).
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = Path(out_dir) / f"{safe_name}_respuesta_{ts}.docx"
+    file_path = Path(out_dir) / f"{safe_name}_respuesta_{ts}_{uuid.uuid4().hex[:8]}.docx"
 
     doc = Document()
     doc.add_heading(f"Respuesta de {character_name}", 0)
@@ -57,7 +66,7 @@ def save_response_to_pdf(character_name: str, question: str, answer: str, out_di
     Path(out_dir).mkdir(parents=True, exist_ok=True)
     safe_name = _sanitize_filename(character_name)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = Path(out_dir) / f"{safe_name}_respuesta_{ts}.pdf"
+    file_path = Path(out_dir) / f"{safe_name}_respuesta_{ts}_{uuid.uuid4().hex[:8]}.pdf"
 
     c = canvas.Canvas(str(file_path), pagesize=A4)
     width, height = A4
@@ -87,3 +96,84 @@ def save_response_to_pdf(character_name: str, question: str, answer: str, out_di
 
     c.save()
     return str(file_path)
+
+ROLE_LABELS = {"user": "Usuario", "assistant": "Respuesta", "assistant_image": "Imagen"}
+
+def _message_lines(message: Dict[str, str]):
+    label = ROLE_LABELS.get(message["role"], message["role"])
+    created_at = message.get("created_at")
+    stamp = f" ({created_at:%Y-%m-%d %H:%M})" if created_at else ""
+    yield f"{label}{stamp}:"
+    yield from message["content"].splitlines() or [""]
+
+def save_session_to_docx(character_name: str, session_id: str, messages: Iterable[Dict[str, str]], out_dir: str = "data/out") -> str:
+    """
+    Crea un .docx con toda una conversación. Los mensajes se consumen de uno en uno;
+    python-docx mantiene el documento en memoria hasta guardarlo.
+    Requiere: pip install python-docx
+    """
+    if Document is None:
+        raise RuntimeError("Falta python-docx. Instala con: pip install python-docx")
+
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    file_path = Path(out_dir) / _session_filename(character_name, session_id, "docx")
+
+    doc = Document()
+    doc.add_heading(f"Conversación con {character_name}", 0)
+    doc.add_paragraph(f"Sesión: {session_id}")
+    doc.add_paragraph(f"Exportado: {datetime.now().isoformat(timespec='seconds')}")
+    for message in messages:
+        doc.add_paragraph("")
+        for line in _message_lines(message):
+            doc.add_paragraph(line)
+
+    doc.save(file_path)
+    return str(file_path)
+
+def save_session_to_pdf(character_name: str, session_id: str, messages: Iterable[Dict[str, str]], out_dir: str = "data/out") -> str:
+    """
+    Crea un PDF con toda una conversación, página a página, consumiendo los mensajes
+    de uno en uno (sin cargar la transcripción completa). Ajusta las líneas largas al ancho.
+    Requiere: pip install reportlab
+    """
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.units import cm
+        from reportlab.lib.utils import simpleSplit
+    except Exception:
+        raise RuntimeError("Falta reportlab. Instala con: pip install reportlab")
+
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    file_path = Path(out_dir) / _session_filename(character_name, session_id, "pdf")
+
+    c = canvas.Canvas(str(file_path), pagesize=A4, pageCompression=1)
+    width, height = A4
+    font, font_size = "Helvetica", 10
+
+    x = 2 * cm
+    y = height - 2 * cm
+    line_height = 0.5 * cm
+    max_width = width - 4 * cm
+    c.setFont(font, font_size)
+
+    def writeln(text: str):
+        nonlocal y
+        for chunk in simpleSplit(text, font, font_size, max_width) or [""]:
+            c.drawString(x, y, chunk)
+            y -= line_height
+            if y < 2 * cm:
+                c.showPage()
+                c.setFont(font, font_size)
+                y = height - 2 * cm
+
+    writeln(f"Conversación con {character_name}")
+    writeln(f"Sesión: {session_id}")
+    writeln(f"Exportado: {datetime.now().isoformat(timespec='seconds')}")
+    for message in messages:
+        writeln("")
+        for line in _message_lines(message):
+            writeln(line)
+
+    c.save()
+    return str(file_path)
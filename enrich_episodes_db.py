@@ -1,14 +1,12 @@
-import json
-from openai import OpenAI
+import argparse
+import llm_provider
 from dotenv import load_dotenv
-from episodes_db import _connect
+from psycopg2.extras import DictCursor
+from character_models import CharacterSheet
+from sheet_reader import load_character_sheet
+from episodes_db import _connect, bump_episodes_generation, format_scene_context, save_scene_prompt
 
 load_dotenv()
-try:
-    client = OpenAI()
-except Exception as e:
-    print(f"Error al inicializar OpenAI: {e}")
-    client = None
 
 def fetch_episodes_to_enrich(target_character: str = "Gary"):
     """
@@ -29,11 +27,26 @@ def fetch_episodes_to_enrich(target_character: str = "Gary"):
             episodes = cur.fetchall()
     return episodes
 
-def enrich_episode_with_ai(title, summary) -> dict:
-    """Usa GPT-4o para extraer información visual y estructurada de un resumen."""
-    if not client:
-        raise Exception("Cliente de OpenAI no inicializado.")
+ENRICH_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "episode_enrichment",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "visual_summary": {"type": "string"},
+                "key_characters": {"type": "array", "items": {"type": "string"}},
+                "key_objects_locations": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["visual_summary", "key_characters", "key_objects_locations"],
+            "additionalProperties": False,
+        },
+    },
+}
 
+def enrich_messages(title, summary) -> list:
+    """Mensajes de la tarea 'enrich' (compartidos por el modo interactivo y el modo batch)."""
     system_prompt = """
     Eres un analista de guiones de animación. Tu tarea es leer el título y el resumen de un
     episodio y extraer información clave en formato JSON.
@@ -49,24 +62,23 @@ def enrich_episode_with_ai(title, summary) -> dict:
     """
     
     user_content = f"Título: {title}\nResumen: {summary}"
-    
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+
+def enrich_episode_with_ai(title, summary) -> dict:
+    """Usa el modelo de la tarea 'enrich' para extraer información visual y estructurada de un resumen."""
+    if not llm_provider.is_available("enrich"):
+        raise Exception("Cliente de OpenAI no inicializado.")
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            response_format={"type": "json_object"}
-        )
-        extracted_data_str = response.choices[0].message.content
-        return json.loads(extracted_data_str)
+        return llm_provider.chat_json("enrich", enrich_messages(title, summary), ENRICH_SCHEMA)
     except Exception as e:
         print(f"  -> Error durante el análisis de IA: {e}")
         return {}
 
-def update_episode_in_db(episode_id, enriched_data):
-    """Actualiza un episodio en la BD con los nuevos datos."""
+def update_episode_in_db(episode_id, enriched_data) -> bool:
+    """Actualiza un episodio en la BD con los nuevos datos. Devuelve False si ya los tenía (no cambia nada)."""
     visual_summary = enriched_data.get("visual_summary", "")
     key_characters = ", ".join(enriched_data.get("key_characters", []))
     key_objects_locations = ", ".join(enriched_data.get("key_objects_locations", []))
@@ -78,18 +90,101 @@ def update_episode_in_db(episode_id, enriched_data):
                 UPDATE episodes
                 SET visual_summary = %s, key_characters = %s, key_objects_locations = %s
                 WHERE id = %s
+                  AND (visual_summary, key_characters, key_objects_locations) IS DISTINCT FROM (%s, %s, %s)
                 """,
-                (visual_summary, key_characters, key_objects_locations, episode_id)
+                (visual_summary, key_characters, key_objects_locations, episode_id,
+                 visual_summary, key_characters, key_objects_locations)
             )
+            changed = cur.rowcount > 0
+            if changed:
+                # El prompt de escena precalculado dependía del resumen visual anterior.
+                cur.execute("DELETE FROM episode_scene_prompts WHERE episode_id = %s", (episode_id,))
         conn.commit()
+    if changed:
+        bump_episodes_generation()
+    return changed
+
+def fetch_episodes_without_scene_prompt(character: str):
+    """Episodios enriquecidos que aún no tienen prompt de escena para este personaje."""
+    with _connect() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                """
+                SELECT e.id, e.title, e.visual_summary, e.key_characters, e.key_objects_locations
+                FROM episodes e
+                LEFT JOIN episode_scene_prompts p ON p.episode_id = e.id AND p.character = %s
+                WHERE e.visual_summary IS NOT NULL AND e.visual_summary != '' AND p.episode_id IS NULL
+                """,
+                (character,)
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+SCENE_PROMPT_TEMPERATURE = 0.7
+SCENE_PROMPT_MAX_TOKENS = 300
+
+def scene_prompt_messages(sheet: CharacterSheet, episode: dict) -> list:
+    from ai_core import SCENE_DIRECTOR_PROMPT
+
+    visual_desc = sheet.visual_description_for_ai or "Un caracol de dibujos animados."
+    user_content = (
+        f"Descripción Base del Personaje: {visual_desc}\n"
+        f"Contexto del Episodio: {format_scene_context(episode)}\n"
+        "Acción Solicitada por el Usuario: ninguna todavía; describe la escena de forma que "
+        "se le pueda añadir después una acción concreta del personaje."
+    )
+    return [
+        {"role": "system", "content": SCENE_DIRECTOR_PROMPT},
+        {"role": "user", "content": user_content}
+    ]
+
+def build_scene_prompt_with_ai(sheet: CharacterSheet, episode: dict) -> str:
+    """Sintetiza el prompt de DALL-E de la escena del episodio, sin acción del usuario."""
+    if not llm_provider.is_available("scene_prompt"):
+        raise Exception("Cliente de OpenAI no inicializado.")
+    try:
+        return llm_provider.chat("scene_prompt", scene_prompt_messages(sheet, episode),
+                                 temperature=SCENE_PROMPT_TEMPERATURE, max_tokens=SCENE_PROMPT_MAX_TOKENS)
+    except Exception as e:
+        print(f"  -> Error al sintetizar el prompt de escena: {e}")
+        return ""
+
+def precompute_scene_prompts(sheet_path: str):
+    """Guarda un prompt de escena listo para usar por cada (episodio enriquecido, ficha)."""
+    sheet = CharacterSheet(**load_character_sheet(sheet_path))
+    episodes = fetch_episodes_without_scene_prompt(sheet.name)
+    if not episodes:
+        print(f"Todos los episodios enriquecidos tienen ya prompt de escena para '{sheet.name}'.")
+        return
+    print(f"Precalculando {len(episodes)} prompts de escena para '{sheet.name}'...")
+    for ep in episodes:
+        prompt = build_scene_prompt_with_ai(sheet, ep)
+        if prompt:
+            save_scene_prompt(ep["id"], sheet.name, prompt)
+            print(f"  -> Prompt de escena guardado para '{ep['title']}' (ID: {ep['id']}).")
 
 def main():
+    parser = argparse.ArgumentParser(description="Enriquece episodios y precalcula sus prompts de escena.")
+    parser.add_argument("--sheet", default="data/ficha/gary.json", help="Ficha para la que precalcular prompts de escena")
+    parser.add_argument("--skip-scene-prompts", action="store_true", help="No precalcular prompts de escena")
+    parser.add_argument("--batch", action="store_true",
+                        help="Usar el modo batch (más barato y sin límite de ritmo; tarda hasta 24 h con OpenAI)")
+    args = parser.parse_args()
+
+    if args.batch:
+        import batch_jobs
+        batch_jobs.run_job("enrich", character="Gary")
+        if not args.skip_scene_prompts:
+            batch_jobs.run_job("scene_prompts", sheet=args.sheet)
+        return
+
     print("Iniciando proceso de ENRIQUECIMIENTO DIRIGIDO de la base de datos...")
     
     episodes_to_process = fetch_episodes_to_enrich(target_character="Gary")
     
     if not episodes_to_process:
         print("¡No hay episodios nuevos de Gary que enriquecer! La base de datos está al día para este personaje.")
+        if not args.skip_scene_prompts:
+            precompute_scene_prompts(args.sheet)
         return
         
     print(f"Se encontraron {len(episodes_to_process)} episodios de Gary para enriquecer.")
@@ -108,5 +203,8 @@ def main():
             
     print("\nProceso de enriquecimiento finalizado.")
 
+    if not args.skip_scene_prompts:
+        precompute_scene_prompts(args.sheet)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,133 @@
+import re
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+from episodes_db import SEARCH_COLUMNS, _extract_keywords
+
+_TOKEN_RE = re.compile(r"\w+")
+# Palabras clave memorizadas (palabra -> documentos) antes de vaciar la memoria.
+_MAX_MEMO_KEYWORDS = 10000
+
+
+def tokenize_row(row: Dict[str, Any]) -> Set[str]:
+    """Términos buscables de un episodio (los mismos para el índice en memoria y el snapshot)."""
+    text = " ".join(str(row.get(col) or "") for col in SEARCH_COLUMNS).lower()
+    return set(_TOKEN_RE.findall(text))
+
+
+def build_postings(rows: Iterable[Dict[str, Any]]) -> Dict[str, List[int]]:
+    postings: Dict[str, List[int]] = {}
+    for doc_id, row in enumerate(rows):
+        for term in tokenize_row(row):
+            postings.setdefault(term, []).append(doc_id)
+    return postings
+
+
+def build_suffixes(vocabulary: Sequence[str]) -> List[Tuple[bytes, int, int]]:
+    """
+    Todos los sufijos de los términos, en UTF-8 y ordenados: (sufijo, id del término, byte de inicio).
+    Un término contiene una palabra si alguno de sus sufijos empieza por ella, así que la
+    búsqueda por subcadena se resuelve con una búsqueda binaria en lugar de recorrer el vocabulario.
+    """
+    suffixes = []
+    for term_id, term in enumerate(vocabulary):
+        encoded = term.encode("utf-8")
+        start = 0
+        for char in term:
+            suffixes.append((encoded[start:], term_id, start))
+            start += len(char.encode("utf-8"))
+    suffixes.sort()
+    return suffixes
+
+
+def terms_containing(suffixes: Sequence[bytes], term_ids: Sequence[int], keyword: str) -> Set[int]:
+    """IDs de los términos con algún sufijo que empieza por `keyword` (el orden de bytes UTF-8 es el de los caracteres)."""
+    key = keyword.encode("utf-8")
+    found = set()
+    i = bisect_left(suffixes, key)
+    while i < len(suffixes) and suffixes[i].startswith(key):
+        found.add(term_ids[i])
+        i += 1
+    return found
+
+
+class KeywordSearch(ABC):
+    """
+    Búsqueda sobre un índice invertido con la semántica de search_episodes.
+    Reproduce `col ILIKE '%palabra%'` buscando la palabra clave dentro de los términos del
+    vocabulario, y ordena por la suma del IDF de las palabras clave coincidentes (las palabras
+    raras pesan más que las que aparecen en todo el corpus).
+    """
+
+    def __init__(self):
+        self._keyword_docs: Dict[str, Set[int]] = {}
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Número de documentos."""
+
+    @abstractmethod
+    def _terms_containing(self, keyword: str) -> Iterable[int]:
+        """IDs de los términos del vocabulario que contienen `keyword`."""
+
+    @abstractmethod
+    def _postings_for(self, term_id: int) -> Sequence[int]:
+        """Documentos que contienen el término."""
+
+    @abstractmethod
+    def _row(self, doc_id: int) -> Dict[str, Any]:
+        """Fila del documento."""
+
+    def docs_for_keyword(self, keyword: str) -> Set[int]:
+        memo = self._keyword_docs
+        docs = memo.get(keyword)
+        if docs is None:
+            docs = set()
+            for term_id in self._terms_containing(keyword):
+                docs.update(self._postings_for(term_id))
+            if len(memo) >= _MAX_MEMO_KEYWORDS:
+                memo.clear()
+            memo[keyword] = docs
+        return docs
+
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        keywords = _extract_keywords(query)
+        if not keywords:
+            return []
+        scores: Dict[int, float] = {}
+        for keyword in set(keywords):
+            docs = self.docs_for_keyword(keyword)
+            if not docs:
+                continue
+            idf = math.log(1 + len(self) / len(docs))
+            for doc_id in docs:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf
+        best = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:limit]
+        return [self._row(doc_id) for doc_id in best]
+
+
+class EpisodeIndex(KeywordSearch):
+    """Índice invertido construido en memoria a partir de filas de `episodes`."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        super().__init__()
+        self.rows: List[Dict[str, Any]] = list(rows)
+        self.postings = build_postings(self.rows)
+        self._vocabulary = sorted(self.postings)
+        suffixes = build_suffixes(self._vocabulary)
+        self._suffixes = [suffix for suffix, _, _ in suffixes]
+        self._suffix_terms = [term_id for _, term_id, _ in suffixes]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _terms_containing(self, keyword: str) -> Iterable[int]:
+        return terms_containing(self._suffixes, self._suffix_terms, keyword)
+
+    def _postings_for(self, term_id: int) -> Sequence[int]:
+        return self.postings[self._vocabulary[term_id]]
+
+    def _row(self, doc_id: int) -> Dict[str, Any]:
+        return self.rows[doc_id]
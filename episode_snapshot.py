@@ -0,0 +1,298 @@
+"""
+Formato del snapshot (little-endian):
+
+    b"GBSNAP\\0\\0" | versión u32 | longitud de la cabecera u32 | cabecera JSON | secciones
+
+Cada sección empieza alineada a 8 bytes y la cabecera guarda su offset y longitud:
+  - columnas enteras: int64 por fila (INT_NULL = NULL)
+  - columnas de texto: offsets u32 (filas + 1) y un bloque UTF-8 con todos los valores
+  - índice de búsqueda: vocabulario ordenado (como una columna de texto), offsets u32 de postings
+    (términos + 1), los postings (u32, número de fila) y los sufijos del vocabulario ordenados
+    por bytes (u32 id de término y u32 byte de inicio), para buscar subcadenas con búsqueda binaria
+Todo se lee con mmap: los workers de un mismo host comparten una única copia en la page cache.
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import DictCursor, execute_values
+
+import episodes_db
+from episodes_db import EPISODE_COLUMNS, _connect
+from episode_index import KeywordSearch, build_postings, build_suffixes, terms_containing
+
+
+MAGIC = b"GBSNAP\0\0"
+FORMAT_VERSION = 2
+INT_NULL = -(2 ** 63)
+INT_COLUMNS = ("id", "season", "episode")
+EPISODES_SNAPSHOT = os.environ.get("EPISODES_SNAPSHOT", "")
+# Con BD disponible, un snapshot más antiguo que esto se considera obsoleto (0 = sin límite).
+SNAPSHOT_MAX_AGE_S = float(os.environ.get("SNAPSHOT_MAX_AGE_S", "0"))
+
+FINGERPRINT_SQL = """
+    SELECT COUNT(*), COALESCE(MAX(id), 0),
+           md5(COALESCE(string_agg(id::text || ':' || md5(concat_ws('|', season, episode, code, title, summary,
+               quotes, characters, visual_summary, key_characters, key_objects_locations)), ',' ORDER BY id), ''))
+    FROM episodes
+"""
+
+
+def db_fingerprint() -> Dict[str, Any]:
+    """Huella del contenido de `episodes` para detectar si un snapshot quedó obsoleto."""
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(FINGERPRINT_SQL)
+            count, max_id, digest = cur.fetchone()
+    return {"count": count, "max_id": max_id, "digest": digest}
+
+
+def _fetch_rows() -> List[Dict[str, Any]]:
+    with _connect() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(f"SELECT {', '.join(EPISODE_COLUMNS)} FROM episodes ORDER BY id")
+            return [dict(row) for row in cur.fetchall()]
+
+
+def _pad(buf: bytearray):
+    buf.extend(b"\0" * (-len(buf) % 8))
+
+
+def _add_strings(buf: bytearray, values: Iterable[str]) -> Dict[str, int]:
+    offsets = array("I", [0])
+    blob = bytearray()
+    for value in values:
+        blob.extend((value or "").encode("utf-8"))
+        offsets.append(len(blob))
+    _pad(buf)
+    section = {"offsets": len(buf), "count": len(offsets) - 1}
+    buf.extend(offsets.tobytes())
+    section["blob"] = len(buf)
+    section["blob_length"] = len(blob)
+    buf.extend(blob)
+    return section
+
+
+def write_snapshot(path: str, rows: List[Dict[str, Any]], fingerprint: Optional[Dict[str, Any]] = None):
+    """Escribe filas de `episodes` (ordenadas por id) y su índice de búsqueda en un snapshot."""
+    if sys.byteorder != "little":
+        raise RuntimeError("El formato de snapshot requiere una plataforma little-endian.")
+    body = bytearray()
+    columns: Dict[str, Dict[str, int]] = {}
+    for col in EPISODE_COLUMNS:
+        if col in INT_COLUMNS:
+            values = array("q", (INT_NULL if row.get(col) in (None, "") else int(row[col]) for row in rows))
+            _pad(body)
+            columns[col] = {"kind": "int", "offset": len(body)}
+            body.extend(values.tobytes())
+        else:
+            columns[col] = {"kind": "str", **_add_strings(body, (str(row.get(col) or "") for row in rows))}
+
+    postings = build_postings(rows)
+    vocabulary = sorted(postings)
+    index = {"vocabulary": _add_strings(body, vocabulary)}
+    posting_offsets = array("I", [0])
+    flat = array("I")
+    for term in vocabulary:
+        flat.extend(postings[term])
+        posting_offsets.append(len(flat))
+    _pad(body)
+    index["posting_offsets"] = len(body)
+    body.extend(posting_offsets.tobytes())
+    index["postings"] = len(body)
+    body.extend(flat.tobytes())
+    suffixes = build_suffixes(vocabulary)
+    _pad(body)
+    index["suffix_count"] = len(suffixes)
+    index["suffix_terms"] = len(body)
+    body.extend(array("I", (term_id for _, term_id, _ in suffixes)).tobytes())
+    index["suffix_starts"] = len(body)
+    body.extend(array("I", (start for _, _, start in suffixes)).tobytes())
+
+    header = json.dumps({
+        "created_at": time.time(), "rows": len(rows), "columns": columns, "index": index,
+        "fingerprint": fingerprint,
+    }).encode("utf-8")
+    prefix = MAGIC + struct.pack("<II", FORMAT_VERSION, len(header)) + header
+    prefix += b"\0" * (-len(prefix) % 8)  # el cuerpo empieza alineado para memoryview.cast
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        f.write(body)
+    # Reemplazo atómico: los procesos que ya tienen el snapshot mapeado siguen leyendo el anterior.
+    os.replace(tmp_path, path)
+
+
+def export_snapshot(path: str) -> Dict[str, Any]:
+    rows = _fetch_rows()
+    fingerprint = db_fingerprint()
+    write_snapshot(path, rows, fingerprint)
+    return {"rows": len(rows), "bytes": os.path.getsize(path), "fingerprint": fingerprint}
+
+
+class _SuffixView:
+    """Sufijos del vocabulario leídos del mmap bajo demanda (para bisect, sin decodificar el vocabulario)."""
+
+    def __init__(self, offsets: memoryview, blob: memoryview, terms: memoryview, starts: memoryview):
+        self._offsets, self._blob, self._terms, self._starts = offsets, blob, terms, starts
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __getitem__(self, i: int) -> bytes:
+        term = self._terms[i]
+        return bytes(self._blob[self._offsets[term] + self._starts[i]:self._offsets[term + 1]])
+
+
+class EpisodeSnapshot(KeywordSearch):
+    """Lectura de un snapshot mapeado en memoria. Las filas se decodifican solo al devolverlas."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"{path} no es un snapshot de episodios.")
+        version, header_len = struct.unpack_from("<II", view, 8)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Versión de snapshot no soportada: {version} (se esperaba {FORMAT_VERSION}).")
+        self.header = json.loads(bytes(view[16:16 + header_len]))
+        body_start = 16 + header_len
+        self._body = view[body_start + (-body_start % 8):]
+        self._rows = self.header["rows"]
+        self._ints = {}
+        self._strings = {}
+        for col, spec in self.header["columns"].items():
+            if spec["kind"] == "int":
+                self._ints[col] = self._body[spec["offset"]:spec["offset"] + 8 * self._rows].cast("q")
+            else:
+                self._strings[col] = self._string_section(spec)
+        index = self.header["index"]
+        vocab_offsets, vocab_blob = self._string_section(index["vocabulary"])
+        self.n_terms = n_terms = index["vocabulary"]["count"]
+        n_suffixes = index["suffix_count"]
+        self._suffix_terms = self._body[index["suffix_terms"]:index["suffix_terms"] + 4 * n_suffixes].cast("I")
+        suffix_starts = self._body[index["suffix_starts"]:index["suffix_starts"] + 4 * n_suffixes].cast("I")
+        self._suffixes = _SuffixView(vocab_offsets, vocab_blob, self._suffix_terms, suffix_starts)
+        self._posting_offsets = self._body[index["posting_offsets"]:index["posting_offsets"] + 4 * (n_terms + 1)].cast("I")
+        n_postings = self._posting_offsets[n_terms] if n_terms else 0
+        self._postings = self._body[index["postings"]:index["postings"] + 4 * n_postings].cast("I")
+
+    def _string_section(self, spec: Dict[str, int]) -> Tuple[memoryview, memoryview]:
+        offsets = self._body[spec["offsets"]:spec["offsets"] + 4 * (spec["count"] + 1)].cast("I")
+        blob = self._body[spec["blob"]:spec["blob"] + spec["blob_length"]]
+        return offsets, blob
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def age_s(self) -> float:
+        return time.time() - self.header["created_at"]
+
+    def _terms_containing(self, keyword: str) -> Iterable[int]:
+        return terms_containing(self._suffixes, self._suffix_terms, keyword)
+
+    def _postings_for(self, term_id: int):
+        return self._postings[self._posting_offsets[term_id]:self._posting_offsets[term_id + 1]]
+
+    def _row(self, doc_id: int) -> Dict[str, Any]:
+        row: Dict[str, Any] = {}
+        for col in EPISODE_COLUMNS:
+            if col in self._ints:
+                value = self._ints[col][doc_id]
+                row[col] = None if value == INT_NULL else value
+            else:
+                offsets, blob = self._strings[col]
+                row[col] = bytes(blob[offsets[doc_id]:offsets[doc_id + 1]]).decode("utf-8")
+        return row
+
+    def rows(self) -> Iterable[Dict[str, Any]]:
+        return (self._row(i) for i in range(self._rows))
+
+    def is_stale(self, max_age_s: float = SNAPSHOT_MAX_AGE_S) -> Optional[bool]:
+        """True/False según la BD; None si la BD no está disponible (el snapshot se usa igualmente)."""
+        try:
+            current = db_fingerprint()
+        except Exception:
+            return None
+        if max_age_s and self.age_s > max_age_s:
+            return True
+        return current != self.header.get("fingerprint")
+
+
+def import_snapshot(path: str) -> int:
+    """Restaura la tabla `episodes` a partir de un snapshot (mismos IDs)."""
+    snapshot = EpisodeSnapshot(path)
+    rows = list(snapshot.rows())
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE episodes, episode_scene_prompts RESTART IDENTITY;")
+            execute_values(cur, f"INSERT INTO episodes ({', '.join(EPISODE_COLUMNS)}) VALUES %s",
+                           [tuple(row[col] for col in EPISODE_COLUMNS) for row in rows], page_size=1000)
+            cur.execute("SELECT setval(pg_get_serial_sequence('episodes', 'id'), GREATEST(COALESCE(MAX(id), 0), 1)) FROM episodes;")
+        conn.commit()
+    episodes_db.bump_episodes_generation()
+    return len(rows)
+
+
+def activate_snapshot(path: str = EPISODES_SNAPSHOT, verify: bool = True) -> Optional[EpisodeSnapshot]:
+    """
+    Sirve search_episodes desde el snapshot si existe y no está obsoleto; si no, se sigue
+    usando Postgres. Devuelve el snapshot activado o None.
+    """
+    if not path:
+        return None
+    if not os.path.exists(path):
+        print(f"[Aviso] No existe el snapshot de episodios {path}; se usará la base de datos.")
+        return None
+    try:
+        snapshot = EpisodeSnapshot(path)
+    except Exception as e:
+        print(f"[Aviso] Snapshot de episodios no válido ({e}); se usará la base de datos.")
+        return None
+    if verify and snapshot.is_stale():
+        print(f"[Aviso] El snapshot {path} está obsoleto; se usará la base de datos.")
+        return None
+    episodes_db.set_read_backend(snapshot)
+    print(f"Búsqueda de episodios servida desde el snapshot {path} ({len(snapshot)} episodios).")
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta/importa la tabla de episodios a un snapshot mapeable en memoria.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="Escribe la tabla episodes en un snapshot")
+    p_export.add_argument("path")
+    p_import = sub.add_parser("import", help="Restaura la tabla episodes desde un snapshot")
+    p_import.add_argument("path")
+    p_info = sub.add_parser("info", help="Muestra la cabecera y si el snapshot está al día")
+    p_info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        result = export_snapshot(args.path)
+        print(f"Snapshot guardado en {args.path}: {result['rows']} episodios, {result['bytes'] / 1024:.1f} KB.")
+    elif args.command == "import":
+        print(f"Importados {import_snapshot(args.path)} episodios desde {args.path}.")
+    else:
+        snapshot = EpisodeSnapshot(args.path)
+        stale = snapshot.is_stale()
+        print(f"Episodios: {len(snapshot)} | términos indexados: {snapshot.n_terms} | "
+              f"antigüedad: {snapshot.age_s / 3600:.1f} h")
+        print("Estado: " + {None: "BD no disponible", True: "obsoleto", False: "al día"}[stale])
+
+
+if __name__ == "__main__":
+    main()
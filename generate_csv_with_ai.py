@@ -1,16 +1,38 @@
 import os
 import json
+import argparse
 import pandas as pd
-from openai import OpenAI
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import llm_provider
+
 load_dotenv()
-try:
-    client = OpenAI()
-except Exception as e:
-    print(f"Error al inicializar OpenAI: {e}")
-    client = None
+
+EPISODES_CSV_PATH = os.path.join("data", "episodios", "episodios_generados_por_ia.csv")
+COLUMN_ORDER = ["season", "episode", "code", "title", "summary", "quotes", "characters"]
+EPISODE_DATA_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "episode_list",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"episodes": {"type": "array", "items": {
+                "type": "object",
+                "properties": {
+                    "season": {"type": "integer"}, "episode": {"type": "integer"}, "code": {"type": "string"},
+                    "title": {"type": "string"}, "summary": {"type": "string"}, "quotes": {"type": "string"},
+                    "characters": {"type": "string"},
+                },
+                "required": COLUMN_ORDER,
+                "additionalProperties": False,
+            }}},
+            "required": ["episodes"],
+            "additionalProperties": False,
+        },
+    },
+}
 
 def find_list_in_json(data):
     """Busca recursivamente la primera lista que encuentre en un objeto JSON."""
@@ -23,10 +45,12 @@ def find_list_in_json(data):
                 return result
     return None
 
-def generate_episode_batch_with_ai(start_episode: int, end_episode: int) -> list:
-    """Usa GPT-4o para generar un lote de datos de episodios."""
-    if not client: return []
+def episode_ranges(total: int, batch_size: int):
+    """Rangos (inicio, fin) de episodios, ambos incluidos."""
+    for start in range(1, total + 1, batch_size):
+        yield start, min(start + batch_size - 1, total)
 
+def episode_batch_messages(start_episode: int, end_episode: int) -> list:
     system_prompt = f"""
     Eres un experto mundial y archivista de la serie animada "Bob Esponja Pantalones Cuadrados".
     Tu tarea es generar un objeto JSON. La clave raíz del objeto JSON debe ser "episodes", 
@@ -47,19 +71,18 @@ def generate_episode_batch_with_ai(start_episode: int, end_episode: int) -> list
     """
     
     user_prompt = f"Por favor, genera los datos para los episodios de Bob Esponja desde el número {start_episode} hasta el {end_episode}."
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def generate_episode_batch_with_ai(start_episode: int, end_episode: int) -> list:
+    """Usa el modelo de la tarea 'episode_data' para generar un lote de datos de episodios."""
+    if not llm_provider.is_available("episode_data"): return []
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        response_data_str = response.choices[0].message.content
-        response_data = json.loads(response_data_str)
+        response_data = llm_provider.chat_json("episode_data", episode_batch_messages(start_episode, end_episode),
+                                              EPISODE_DATA_SCHEMA)
         
         episode_list = find_list_in_json(response_data)
         
@@ -67,29 +90,55 @@ def generate_episode_batch_with_ai(start_episode: int, end_episode: int) -> list
             return episode_list
         else:
             print(f"  -> La respuesta JSON no contenía una lista de episodios válida.")
-            print(f"  -> Recibido: {response_data_str[:200]}...") 
+            print(f"  -> Recibido: {json.dumps(response_data, ensure_ascii=False)[:200]}...") 
             return []
         
     except Exception as e:
         print(f"  -> Error durante la generación de IA para el lote {start_episode}-{end_episode}: {e}")
         return []
 
+def save_episodes_csv(episodes: list, output_path: str = EPISODES_CSV_PATH, merge: bool = False) -> pd.DataFrame:
+    """
+    Normaliza y guarda los episodios ordenados por número. Con merge, se combinan con los que ya
+    tenga el archivo y, si un número se repite, gana el nuevo: ingerir dos veces lo mismo no cambia nada.
+    """
+    df = pd.DataFrame([ep for ep in episodes if isinstance(ep, dict)])
+    if merge and os.path.exists(output_path):
+        df = pd.concat([pd.read_csv(output_path, dtype=str, keep_default_na=False), df], ignore_index=True)
+    df['episode'] = pd.to_numeric(df.get('episode'), errors='coerce')
+    df = df.dropna(subset=['episode'])
+    df['episode'] = df['episode'].astype(int)
+    df = df.drop_duplicates(subset='episode', keep='last').sort_values(by='episode')
+    df = df.reindex(columns=COLUMN_ORDER).fillna("")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    return df
+
 def main():
-    TOTAL_EPISODES_TO_GENERATE = 300
-    BATCH_SIZE = 10
+    parser = argparse.ArgumentParser(description="Genera el CSV de episodios con el modelo de la tarea 'episode_data'.")
+    parser.add_argument("--total", type=int, default=300, help="Número de episodios a generar")
+    parser.add_argument("--batch-size", type=int, default=10, help="Episodios por petición")
+    parser.add_argument("--batch", action="store_true",
+                        help="Usar el modo batch (más barato y sin límite de ritmo; tarda hasta 24 h con OpenAI)")
+    args = parser.parse_args()
+    TOTAL_EPISODES_TO_GENERATE = args.total
+    BATCH_SIZE = args.batch_size
+
+    if args.batch:
+        import batch_jobs
+        batch_jobs.run_job("episode_data", total=TOTAL_EPISODES_TO_GENERATE, batch_size=BATCH_SIZE,
+                           output=EPISODES_CSV_PATH)
+        return
     
     print(f"--- Iniciando Agente Generador de Datos para {TOTAL_EPISODES_TO_GENERATE} episodios ---")
     
     all_episodes_data = []
     
-    num_batches = (TOTAL_EPISODES_TO_GENERATE + BATCH_SIZE - 1) // BATCH_SIZE
     with tqdm(total=TOTAL_EPISODES_TO_GENERATE, desc="Episodios Generados") as pbar:
-        for i in range(num_batches):
-            start_ep = i * BATCH_SIZE + 1
-            end_ep = start_ep + BATCH_SIZE - 1
-            if end_ep > TOTAL_EPISODES_TO_GENERATE:
-                end_ep = TOTAL_EPISODES_TO_GENERATE
-            
+        for start_ep, end_ep in episode_ranges(TOTAL_EPISODES_TO_GENERATE, BATCH_SIZE):
             print(f"\nGenerando lote de episodios del {start_ep} al {end_ep}...")
             batch_data = generate_episode_batch_with_ai(start_ep, end_ep)
             
@@ -105,18 +154,8 @@ def main():
         print("No se pudo generar ningún dato de episodio.")
         return
 
-    df = pd.DataFrame(all_episodes_data)
-    
-    column_order = ["season", "episode", "code", "title", "summary", "quotes", "characters"]
-    df['episode'] = pd.to_numeric(df.get('episode'), errors='coerce')
-    df = df.dropna(subset=['episode'])
-    df['episode'] = df['episode'].astype(int)
-    df = df.sort_values(by='episode')
-    df = df.reindex(columns=column_order).fillna("")
-
-    output_path = os.path.join("data", "episodios", "episodios_generados_por_ia.csv")
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df.to_csv(output_path, index=False)
+    output_path = EPISODES_CSV_PATH
+    df = save_episodes_csv(all_episodes_data, output_path)
 
     print("\n--- ¡Proceso Completado! ---")
     print(f"Se ha generado un nuevo archivo con {len(df)} episodios.")
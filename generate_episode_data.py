@@ -1,19 +1,14 @@
 import os
-import json
 import requests
 from bs4 import BeautifulSoup
-from openai import OpenAI
 from dotenv import load_dotenv
 from googlesearch import search
 import pandas as pd
 from tqdm import tqdm
 
+import llm_provider
+
 load_dotenv()
-try:
-    client = OpenAI()
-except Exception as e:
-    print(f"Error al inicializar OpenAI: {e}")
-    client = None
 
 def find_episode_list_url() -> str:
     """Busca en Google la URL de la lista de episodios de la Fandom Wiki."""
@@ -65,8 +60,8 @@ def scrape_page_content(url: str) -> str:
     return ""
 
 def extract_structured_data_with_ai(page_content: str, episode_url: str) -> dict:
-    """Usa GPT-4o para rellenar nuestra ficha de episodio a partir de texto en bruto."""
-    if not client: return {}
+    """Usa el modelo de la tarea 'episode_data' para rellenar la ficha de episodio a partir de texto en bruto."""
+    if not llm_provider.is_available("episode_data"): return {}
 
     system_prompt = """
     Eres un archivista de datos. Tu tarea es leer el texto extraído de una página de la Fandom Wiki
@@ -87,16 +82,10 @@ def extract_structured_data_with_ai(page_content: str, episode_url: str) -> dict
     Analiza el siguiente texto y genera únicamente el objeto JSON como respuesta.
     """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"URL de referencia: {episode_url}\n\nContenido de la página:\n{page_content[:15000]}"} # Limitamos el contenido para no exceder el límite de tokens
-            ],
-            response_format={"type": "json_object"}
-        )
-        data_str = response.choices[0].message.content
-        return json.loads(data_str)
+        return llm_provider.chat_json("episode_data", [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"URL de referencia: {episode_url}\n\nContenido de la página:\n{page_content[:15000]}"} # Limitamos el contenido para no exceder el límite de tokens
+        ])
     except Exception as e:
         print(f"  -> Error durante el análisis de IA: {e}")
         return {}
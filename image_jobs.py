@@ -0,0 +1,263 @@
+import os
+import uuid
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+from episodes_db import _connect
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_QUEUE_MAX = int(os.environ.get("IMAGE_QUEUE_MAX", "100"))
+# Un trabajo 'running' sin actualizar en este tiempo se considera huérfano (proceso caído).
+# Los trabajos en curso se marcan como vivos en cada sondeo, así que basta con que supere con margen a IMAGE_JOB_POLL_S.
+IMAGE_JOB_STALE_S = int(os.environ.get("IMAGE_JOB_STALE_S", "300"))
+# Cada cuánto se buscan en la BD trabajos en cola (de este u otro proceso) y huérfanos.
+IMAGE_JOB_POLL_S = float(os.environ.get("IMAGE_JOB_POLL_S", "5"))
+
+TERMINAL_STATUSES = ("done", "failed")
+
+JobProcessor = Callable[[Dict[str, Any]], Awaitable[str]]
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de imágenes está llena."""
+
+
+def insert_job(session_id: str, question: str, character_sheet_path: str,
+               source_image: Optional[bytes] = None, prompt: Optional[str] = None) -> str:
+    job_id = str(uuid.uuid4())
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO image_jobs (id, session_id, question, character_sheet_path, source_image, prompt)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                (job_id, session_id, question, character_sheet_path,
+                 psycopg2.Binary(source_image) if source_image else None, prompt)
+            )
+        conn.commit()
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Devuelve el estado público de un trabajo (sin la imagen de origen)."""
+    with _connect() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                "SELECT id, session_id, status, result, error, created_at, updated_at FROM image_jobs WHERE id = %s",
+                (job_id,)
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["created_at"] = job["created_at"].isoformat() if job["created_at"] else None
+    job["updated_at"] = job["updated_at"].isoformat() if job["updated_at"] else None
+    return job
+
+
+def claim_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Marca el trabajo como 'running' solo si seguía en cola; evita que dos workers lo procesen."""
+    with _connect() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                """
+                UPDATE image_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'queued'
+                RETURNING id, session_id, question, character_sheet_path, source_image, prompt
+                """,
+                (job_id,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    if not row:
+        return None
+    job = dict(row)
+    if job["source_image"] is not None:
+        job["source_image"] = bytes(job["source_image"])
+    return job
+
+
+def finish_job(job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE image_jobs SET status = %s, result = %s, error = %s,
+                       source_image = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                """,
+                (status, result, error, job_id)
+            )
+        conn.commit()
+
+
+def requeue_job(job_id: str):
+    """Devuelve a la cola un trabajo que este proceso no llegó a terminar (parada o reciclado del worker)."""
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE image_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'running'",
+                (job_id,)
+            )
+        conn.commit()
+
+
+def recover_pending_jobs(running: Sequence[str] = (), limit: int = IMAGE_QUEUE_MAX) -> List[str]:
+    """
+    Marca como vivos los trabajos `running` de este proceso, devuelve a la cola los huérfanos
+    y lista hasta `limit` pendientes, del más antiguo al más nuevo.
+    """
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            if running:
+                cur.execute("UPDATE image_jobs SET updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s) AND status = 'running'",
+                            (list(running),))
+            cur.execute(
+                """
+                UPDATE image_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """,
+                (IMAGE_JOB_STALE_S,)
+            )
+            cur.execute("SELECT id FROM image_jobs WHERE status = 'queued' ORDER BY created_at ASC LIMIT %s", (limit,))
+            job_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    return job_ids
+
+
+class ImageJobQueue:
+    """
+    Cola acotada de trabajos de imagen con un pool fijo de workers asyncio.
+    El estado vive en Postgres (tabla image_jobs) para sobrevivir a reinicios;
+    la cola en memoria solo contiene los IDs pendientes de este proceso y se rellena
+    periódicamente desde la BD, así que ningún trabajo en cola se queda sin procesar.
+    """
+
+    def __init__(self, processor: JobProcessor, workers: int = IMAGE_WORKERS, maxsize: int = IMAGE_QUEUE_MAX):
+        self.processor = processor
+        self.workers = workers
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._events: Dict[str, asyncio.Event] = {}
+        # IDs en la cola en memoria o en proceso aquí (para no encolarlos dos veces desde la BD).
+        self._known: Set[str] = set()
+        self._running: Set[str] = set()
+        # Huecos apartados por submit mientras inserta en la BD.
+        self._reserved = 0
+
+    def _free_slots(self) -> int:
+        return self._queue.maxsize - self._queue.qsize() - self._reserved
+
+    def _enqueue(self, job_id: str):
+        self._known.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def _refill(self) -> int:
+        """Barrido de huérfanos y relleno de la cola con los trabajos en cola de la BD que quepan."""
+        pending = await asyncio.to_thread(recover_pending_jobs, tuple(self._running), self._queue.maxsize)
+        added = 0
+        for job_id in pending:
+            if self._free_slots() <= 0:
+                break
+            if job_id not in self._known:
+                self._enqueue(job_id)
+                added += 1
+        return added
+
+    async def _feeder(self):
+        while True:
+            await asyncio.sleep(IMAGE_JOB_POLL_S)
+            try:
+                await self._refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"No se pudo consultar la cola de imágenes en la BD: {e}")
+
+    async def start(self):
+        try:
+            recovered = await self._refill()
+            if recovered:
+                print(f"Recuperados {recovered} trabajos de imagen pendientes.")
+        except Exception as e:
+            print(f"No se pudieron recuperar los trabajos de imagen pendientes: {e}")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._feeder()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._known.clear()
+
+    async def submit(self, session_id: str, question: str, character_sheet_path: str,
+                     source_image: Optional[bytes] = None, prompt: Optional[str] = None) -> str:
+        """Encola un trabajo; `prompt` permite saltarse la síntesis si ya viene calculado."""
+        if self._free_slots() <= 0:
+            raise QueueFullError("La cola de imágenes está llena.")
+        # El hueco se aparta antes de insertar: ni otro submit ni el relleno desde la BD pueden ocuparlo.
+        self._reserved += 1
+        try:
+            job_id = await asyncio.to_thread(insert_job, session_id, question, character_sheet_path, source_image, prompt)
+        finally:
+            self._reserved -= 1
+        self._enqueue(job_id)
+        return job_id
+
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """Espera a que este proceso termine el trabajo o a que pase `timeout` (para volver a consultar la BD)."""
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Trabajos terminados por otro proceso o clientes que se desconectan no deben dejar eventos.
+            if self._events.get(job_id) is event:
+                del self._events[job_id]
+
+    def _notify(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event:
+            event.set()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await asyncio.to_thread(claim_job, job_id)
+                if job is None:
+                    continue
+                self._running.add(job_id)
+                try:
+                    result = await self.processor(job)
+                    await asyncio.to_thread(finish_job, job_id, "done", result)
+                except asyncio.CancelledError:
+                    # Parada o reciclado del worker: otro proceso lo retomará desde la cola.
+                    # shield: aunque llegue otra cancelación, la vuelta a la cola termina en su hilo.
+                    try:
+                        await asyncio.shield(asyncio.to_thread(requeue_job, job_id))
+                    except Exception as e:
+                        print(f"No se pudo devolver a la cola el trabajo de imagen {job_id}: {e}")
+                    raise
+                except Exception as e:
+                    print(f"Trabajo de imagen {job_id} falló: {e}")
+                    await asyncio.to_thread(finish_job, job_id, "failed", None, str(e))
+                self._notify(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error en el worker de imágenes {worker_id}: {e}")
+            finally:
+                self._running.discard(job_id)
+                self._known.discard(job_id)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "running": len(self._running), "workers": self.workers,
+                "maxsize": self._queue.maxsize}
@@ -0,0 +1,142 @@
+import os
+import time
+import asyncio
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.staticfiles import StaticFiles
+
+IMAGE_DIR = os.environ.get("IMAGE_DIR", "generated_images")
+IMAGE_DISK_QUOTA_MB = float(os.environ.get("IMAGE_DISK_QUOTA_MB", "2048"))
+IMAGE_JANITOR_INTERVAL_S = float(os.environ.get("IMAGE_JANITOR_INTERVAL_S", "300"))
+WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", "80"))
+THUMB_SIZE = int(os.environ.get("IMAGE_THUMB_SIZE", "256"))
+
+# Tamaños servibles: 'full' (WebP 1024), 'thumb' (WebP reducido) y 'original' (PNG de DALL-E).
+SIZES = ("full", "thumb", "original")
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Cada cuánto, como mucho, se actualiza el atime de un archivo servido (para el LRU).
+_ACCESS_TOUCH_INTERVAL_S = 60.0
+_last_touch: Dict[str, float] = {}
+
+
+def _variant_names(image_id: str) -> Dict[str, str]:
+    return {"original": f"{image_id}.png", "full": f"{image_id}.webp", "thumb": f"{image_id}_thumb.webp"}
+
+
+def _image_id(file_name: str) -> str:
+    stem = os.path.splitext(file_name)[0]
+    return stem[:-len("_thumb")] if stem.endswith("_thumb") else stem
+
+
+def save_image_variants(image_id: str, png_bytes: bytes, directory: str = IMAGE_DIR) -> str:
+    """
+    Guarda el PNG original y, si Pillow está disponible, sus variantes WebP (completa y miniatura).
+    Devuelve la ruta del PNG original.
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = _variant_names(image_id)
+    original_path = os.path.join(directory, names["original"])
+    with open(original_path, "wb") as f:
+        f.write(png_bytes)
+
+    try:
+        # Pillow solo hace falta al generar; no se importa en el arranque de la API.
+        from PIL import Image
+    except Exception:
+        print("[Aviso] Falta Pillow: solo se guarda el PNG original.")
+        return original_path
+
+    with Image.open(BytesIO(png_bytes)) as img:
+        img = img.convert("RGB")
+        img.save(os.path.join(directory, names["full"]), "WEBP", quality=WEBP_QUALITY, method=4)
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        img.save(os.path.join(directory, names["thumb"]), "WEBP", quality=WEBP_QUALITY, method=4)
+    return original_path
+
+
+def variant_url(path: str, size: str = "full", directory: str = IMAGE_DIR) -> Optional[str]:
+    """URL /images/... del tamaño pedido; cae al PNG original si la variante no existe."""
+    names = _variant_names(_image_id(os.path.basename(path)))
+    for candidate in (names.get(size, names["full"]), names["original"]):
+        if os.path.exists(os.path.join(directory, candidate)):
+            return f"/images/{candidate}"
+    return None
+
+
+def record_access(full_path: str):
+    """Actualiza el atime del archivo (sin tocar mtime) para que el janitor conozca el último acceso."""
+    now = time.time()
+    if now - _last_touch.get(full_path, 0.0) < _ACCESS_TOUCH_INTERVAL_S:
+        return
+    _last_touch[full_path] = now
+    try:
+        os.utime(full_path, (now, os.stat(full_path).st_mtime))
+    except OSError:
+        pass
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles con Cache-Control inmutable: los nombres de archivo son únicos (UUID)."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        record_access(str(full_path))
+        return response
+
+
+def disk_usage(directory: str = IMAGE_DIR) -> Tuple[int, int]:
+    """Devuelve (bytes totales, número de archivos) del directorio de imágenes."""
+    total, count = 0, 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                total += entry.stat().st_size
+                count += 1
+    return total, count
+
+
+def enforce_quota(quota_bytes: int, directory: str = IMAGE_DIR) -> int:
+    """
+    Borra imágenes (con todas sus variantes) por orden de último acceso hasta quedar
+    por debajo del 90% de la cuota. Devuelve los bytes liberados.
+    """
+    groups: Dict[str, List[os.DirEntry]] = {}
+    total = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                groups.setdefault(_image_id(entry.name), []).append(entry)
+                total += entry.stat().st_size
+    if total <= quota_bytes:
+        return 0
+
+    target = int(quota_bytes * 0.9)
+    by_last_access = sorted(groups.values(), key=lambda files: max(f.stat().st_atime for f in files))
+    freed = 0
+    for files in by_last_access:
+        if total - freed <= target:
+            break
+        for f in files:
+            try:
+                size = f.stat().st_size
+                os.remove(f.path)
+                _last_touch.pop(f.path, None)
+                freed += size
+            except OSError:
+                pass
+    print(f"Janitor de imágenes: liberados {freed / 1e6:.1f} MB (cuota {quota_bytes / 1e6:.0f} MB).")
+    return freed
+
+
+async def run_janitor(quota_mb: float = IMAGE_DISK_QUOTA_MB, interval_s: float = IMAGE_JANITOR_INTERVAL_S,
+                      directory: str = IMAGE_DIR):
+    """Tarea de fondo que aplica la cuota de disco periódicamente."""
+    quota_bytes = int(quota_mb * 1024 * 1024)
+    while True:
+        try:
+            await asyncio.to_thread(enforce_quota, quota_bytes, directory)
+        except Exception as e:
+            print(f"Error en el janitor de imágenes: {e}")
+        await asyncio.sleep(interval_s)
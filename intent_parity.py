@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import sys
+import time
+from typing import List
+
+from ai_core import SCENE_DIRECTOR_PROMPT, classify_intent, classify_intent_and_build_prompt, generate_character_response
+from app import episode_scene, get_sheet, is_specific_request, scene_material
+from episodes_db import search_episodes
+
+DEFAULT_QUESTIONS = [
+    "¿Qué comes normalmente?",
+    "¿Te acuerdas de cuando te escapaste de casa?",
+    "Dibújate durmiendo en tu concha",
+    "Hazme una imagen tuya en la fiesta de la medusa con Bob Esponja",
+    "¿Quién es tu mejor amigo?",
+    "Quiero una foto tuya comiendo galletas de caracol en la piña",
+]
+
+
+async def two_call_flow(question: str, material: str):
+    intent = await classify_intent(question)
+    prompt = ""
+    if intent == "image":
+        prompt = await generate_character_response(
+            persona_prompt=SCENE_DIRECTOR_PROMPT, chat_history=[], episode_context="", user_question=material
+        )
+    return intent, prompt
+
+
+async def compare(questions: List[str], sheet_path: str, use_db: bool) -> float:
+    sheet = get_sheet(sheet_path)
+    matches = 0
+    two_call_s, combined_s = 0.0, 0.0
+    for q in questions:
+        hits = search_episodes(q, limit=1) if use_db and is_specific_request(q) else []
+        episode_context, _ = await episode_scene(q, sheet, hits)
+        material = scene_material(q, sheet, episode_context)
+
+        t0 = time.perf_counter()
+        intent_a, prompt_a = await two_call_flow(q, material)
+        t1 = time.perf_counter()
+        routed = await classify_intent_and_build_prompt(q, material)
+        t2 = time.perf_counter()
+        two_call_s += t1 - t0
+        combined_s += t2 - t1
+
+        intent_b = routed["intent"] if routed else "(fallo)"
+        prompt_b = routed["image_prompt"] if routed else ""
+        same = intent_a == intent_b
+        matches += same
+        print(f"\n{'OK ' if same else 'DIF'} | {q}")
+        print(f"  dos llamadas: {intent_a} ({(t1 - t0) * 1000:.0f} ms) {prompt_a[:120]}")
+        print(f"  combinado:    {intent_b} ({(t2 - t1) * 1000:.0f} ms) {prompt_b[:120]}")
+
+    agreement = matches / len(questions) if questions else 1.0
+    print("\n--- PARIDAD INTENCIÓN + PROMPT ---")
+    print(f"Coincidencia de intención: {matches}/{len(questions)} ({agreement:.0%})")
+    print(f"Latencia media dos llamadas: {two_call_s / max(1, len(questions)) * 1000:.0f} ms")
+    print(f"Latencia media combinado:    {combined_s / max(1, len(questions)) * 1000:.0f} ms")
+    return agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el modo combinado de intención+prompt con el flujo de dos llamadas.")
+    parser.add_argument("--questions", help="Archivo con una pregunta por línea (por defecto, un set de ejemplo)")
+    parser.add_argument("--sheet", default="data/ficha/gary.json", help="Ficha del personaje")
+    parser.add_argument("--no-db", action="store_true", help="No buscar contexto de episodios en la BD")
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="Coincidencia mínima para salir con código 0")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    agreement = asyncio.run(compare(questions, args.sheet, not args.no_db))
+    sys.exit(0 if agreement >= args.min_agreement else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+"""
+Capa única de acceso a modelos de lenguaje (chat, JSON estructurado, visión e imagen).
+
+Cada tarea ("intent", "chat", "enrich", ...) se enruta a un backend y a un modelo:
+  - LLM_BACKEND                  backend por defecto: "openai", "local" o "stub"
+  - LLM_BACKEND_<TAREA>          backend para una tarea (p. ej. LLM_BACKEND_INTENT=local)
+  - LLM_MODEL_<TAREA>            modelo para una tarea (por defecto, DEFAULT_MODELS o LLM_LOCAL_MODEL)
+
+"local" es cualquier servidor compatible con la API de OpenAI (Ollama, llama.cpp, vLLM) en
+LLM_LOCAL_BASE_URL. "stub" responde de forma determinista y sin red (pruebas y benchmarks offline).
+Los clientes se crean una vez por proceso y backend, con un pool de conexiones HTTP compartido.
+"""
+
+import os
+import json
+import time
+import zlib
+import base64
+import struct
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from llm_resilience import env_float
+
+load_dotenv()
+
+ChatMessage = Dict[str, Any]
+
+DEFAULT_MODELS: Dict[str, str] = {
+    "intent": "gpt-4o-mini",
+    "intent_prompt": "gpt-4o-mini",
+    "chat": "gpt-4o-mini",
+    "vision": "gpt-4o",
+    "image": "dall-e-3",
+    "enrich": "gpt-4o",
+    "scene_prompt": "gpt-4o-mini",
+    "episode_data": "gpt-4o",
+    "research": "gpt-4o",
+}
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")
+LLM_LOCAL_BASE_URL = os.environ.get("LLM_LOCAL_BASE_URL", "http://localhost:11434/v1")
+LLM_LOCAL_MODEL = os.environ.get("LLM_LOCAL_MODEL", "llama3.1")
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "50"))
+LLM_CLIENT_TIMEOUT_S = env_float("LLM_CLIENT_TIMEOUT_S", 90)
+IMAGE_DOWNLOAD_TIMEOUT_S = env_float("IMAGE_DOWNLOAD_TIMEOUT_S", 20)
+# Latencia simulada del backend stub, para que los benchmarks offline no midan 0 ms.
+LLM_STUB_LATENCY_S = env_float("LLM_STUB_LATENCY_S", 0)
+
+
+class UsageStats:
+    """
+    Tokens por modelo según el campo usage de las respuestas, incluidos los que el proveedor sirvió
+    desde su caché de prompts (prompt_tokens_details.cached_tokens). La latencia se separa según
+    hubo o no acierto de caché, para comprobar su efecto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, float]] = {}
+
+    def record(self, model: str, usage, elapsed_s: float):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        with self._lock:
+            stats = self._models.setdefault(model, dict.fromkeys(
+                ("requests", "prompt_tokens", "cached_tokens", "completion_tokens", "cached_requests",
+                 "latency_s", "cached_latency_s"), 0))
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage.prompt_tokens or 0
+            stats["completion_tokens"] += usage.completion_tokens or 0
+            stats["cached_tokens"] += cached
+            if cached:
+                stats["cached_requests"] += 1
+                stats["cached_latency_s"] += elapsed_s
+            else:
+                stats["latency_s"] += elapsed_s
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            models = {model: dict(stats) for model, stats in self._models.items()}
+        result = {}
+        for model, s in models.items():
+            uncached = s["requests"] - s["cached_requests"]
+            result[model] = {
+                "requests": int(s["requests"]), "prompt_tokens": int(s["prompt_tokens"]),
+                "cached_tokens": int(s["cached_tokens"]), "completion_tokens": int(s["completion_tokens"]),
+                "cached_ratio": round(s["cached_tokens"] / s["prompt_tokens"], 3) if s["prompt_tokens"] else None,
+                "avg_latency_ms": round(s["latency_s"] / uncached * 1000) if uncached else None,
+                "avg_latency_cached_ms": round(s["cached_latency_s"] / s["cached_requests"] * 1000) if s["cached_requests"] else None,
+            }
+        return result
+
+
+usage = UsageStats()
+
+
+def usage_stats() -> Dict[str, Dict[str, Any]]:
+    return usage.snapshot()
+
+
+class ProviderNotConfigured(Exception):
+    """El backend de la tarea no se pudo inicializar (p. ej. falta OPENAI_API_KEY)."""
+
+
+def route(task: str) -> Tuple[str, str]:
+    """(backend, modelo) configurados para una tarea."""
+    backend = os.environ.get(f"LLM_BACKEND_{task.upper()}", LLM_BACKEND)
+    default_model = LLM_LOCAL_MODEL if backend == "local" else DEFAULT_MODELS.get(task, DEFAULT_MODELS["chat"])
+    return backend, os.environ.get(f"LLM_MODEL_{task.upper()}", default_model)
+
+
+def _json_format(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return schema if schema else {"type": "json_object"}
+
+
+def _vision_messages(system_prompt: str, text: str, image_bytes: bytes) -> List[ChatMessage]:
+    encoded = base64.b64encode(image_bytes).decode("utf-8")
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": [
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encoded}"}},
+        ]},
+    ]
+
+
+class OpenAIProvider:
+    """Backend sobre la API de OpenAI o un servidor compatible (base_url)."""
+
+    def __init__(self, name: str, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self._async_client = None
+        self._sync_client = None
+        self._init_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        # Los reintentos los gestiona call_with_policy; el SDK no debe reintentar por su cuenta.
+        kwargs: Dict[str, Any] = {"max_retries": 0, "timeout": LLM_CLIENT_TIMEOUT_S}
+        if self.base_url:
+            kwargs["base_url"] = self.base_url
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        return kwargs
+
+    def _failed(self, e: Exception) -> ProviderNotConfigured:
+        if self._init_error is None:
+            self._init_error = f"No se pudo inicializar el backend de LLM '{self.name}': {e}"
+            print(self._init_error)
+        return ProviderNotConfigured(self._init_error)
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._init_error:
+                    raise ProviderNotConfigured(self._init_error)
+                if self._async_client is None:
+                    try:
+                        # openai es caro de importar: solo se carga al primer uso.
+                        import httpx
+                        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                              max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                        self._async_client = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(limits=limits),
+                                                         **self._client_kwargs())
+                    except Exception as e:
+                        raise self._failed(e) from e
+        return self._async_client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            with self._lock:
+                if self._sync_client is None:
+                    try:
+                        from openai import OpenAI
+                        self._sync_client = OpenAI(**self._client_kwargs())
+                    except Exception as e:
+                        raise self._failed(e) from e
+        return self._sync_client
+
+    def available(self) -> bool:
+        try:
+            self.async_client
+            return True
+        except ProviderNotConfigured:
+            return False
+
+    @staticmethod
+    def _text(response) -> str:
+        return (response.choices[0].message.content or "").strip()
+
+    def _cache_kwargs(self, cache_key: Optional[str]) -> Dict[str, Any]:
+        # prompt_cache_key agrupa en el mismo servidor las peticiones con el mismo prefijo;
+        # los servidores compatibles (base_url) pueden no aceptarlo.
+        return {"prompt_cache_key": cache_key} if cache_key and not self.base_url else {}
+
+    async def _acreate(self, kwargs: Dict[str, Any]):
+        started = time.perf_counter()
+        response = await self.async_client.chat.completions.create(**kwargs)
+        usage.record(kwargs["model"], getattr(response, "usage", None), time.perf_counter() - started)
+        return response
+
+    def _create(self, kwargs: Dict[str, Any]):
+        started = time.perf_counter()
+        response = self.sync_client.chat.completions.create(**kwargs)
+        usage.record(kwargs["model"], getattr(response, "usage", None), time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _chat_kwargs(model: str, messages: List[ChatMessage], temperature: Optional[float],
+                     max_tokens: Optional[int], **extra) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"model": model, "messages": messages, **extra}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        return kwargs
+
+    async def achat(self, model: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+                    max_tokens: Optional[int] = None, cache_key: Optional[str] = None) -> str:
+        response = await self._acreate(
+            self._chat_kwargs(model, messages, temperature, max_tokens, **self._cache_kwargs(cache_key)))
+        return self._text(response)
+
+    async def achat_json(self, model: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                         temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+        response = await self._acreate(
+            self._chat_kwargs(model, messages, temperature, max_tokens, response_format=_json_format(schema)))
+        return json.loads(self._text(response))
+
+    async def aimage(self, model: str, prompt: str, size: str = "1024x1024") -> bytes:
+        response = await self.async_client.images.generate(model=model, prompt=prompt, n=1, size=size,
+                                                           quality="standard", response_format="b64_json")
+        return await asyncio.to_thread(self._image_bytes, response.data[0])
+
+    @staticmethod
+    def _image_bytes(item) -> bytes:
+        if getattr(item, "b64_json", None):
+            return base64.b64decode(item.b64_json)
+        # Servidores compatibles que solo devuelven URL.
+        import requests
+        image_response = requests.get(item.url, timeout=IMAGE_DOWNLOAD_TIMEOUT_S)
+        image_response.raise_for_status()
+        return image_response.content
+
+    def chat(self, model: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+             max_tokens: Optional[int] = None) -> str:
+        return self._text(self._create(self._chat_kwargs(model, messages, temperature, max_tokens)))
+
+    def chat_json(self, model: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                  temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+        response = self._create(
+            self._chat_kwargs(model, messages, temperature, max_tokens, response_format=_json_format(schema)))
+        return json.loads(self._text(response))
+
+    async def warm_up(self, timeout_s: float):
+        await asyncio.wait_for(self.async_client.models.list(), timeout=timeout_s)
+
+
+_IMAGE_WORDS = ("dibuj", "dibúj", "imagen", "foto", "pinta", "píntate", "muéstrame", "muestrame", "retrato", "draw", "picture")
+# Prefijo con el que ai_core envía la pregunta en la llamada combinada de intención + prompt.
+_USER_MESSAGE_PREFIX = "Mensaje del usuario: "
+
+
+def _stub_png(seed: bytes, size: int = 64) -> bytes:
+    """PNG RGB de un color derivado de `seed` (sin Pillow)."""
+    r, g, b = hashlib.sha1(seed).digest()[:3]
+    row = b"\x00" + bytes((r, g, b)) * size
+    raw = zlib.compress(row * size)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+def _last_user_text(messages: List[ChatMessage]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+            return str(content or "")
+    return ""
+
+
+def _looks_like_image_request(text: str) -> bool:
+    lowered = text.lower()
+    return any(word in lowered for word in _IMAGE_WORDS)
+
+
+def _stub_value(schema: Dict[str, Any], text: str, name: str = "") -> Any:
+    """Valor que cumple un JSON schema sencillo; las enumeraciones chat/image se deciden por palabras clave."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        options = schema["enum"]
+        if set(options) == {"chat", "image"}:
+            return "image" if _looks_like_image_request(text) else "chat"
+        return options[0]
+    if kind == "object":
+        return {key: _stub_value(sub, text, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        if name == "intents":
+            return [_stub_value(schema.get("items", {}), line) for line in text.splitlines() if line.strip()]
+        return [_stub_value(schema.get("items", {}), text)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    if name == "image_prompt" and not _looks_like_image_request(text):
+        return ""
+    return f"[stub] {text[:120]}"
+
+
+class StubProvider:
+    """Backend determinista sin red: misma entrada, misma salida."""
+    name = "stub"
+
+    def available(self) -> bool:
+        return True
+
+    async def _latency(self):
+        if LLM_STUB_LATENCY_S:
+            await asyncio.sleep(LLM_STUB_LATENCY_S)
+
+    def _chat(self, model: str, messages: List[ChatMessage]) -> str:
+        text = _last_user_text(messages)
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        if "'chat' o 'image'" in system:
+            return "image" if _looks_like_image_request(text) else "chat"
+        digest = hashlib.sha1(f"{model}\x1f{text}".encode("utf-8")).hexdigest()[:8]
+        return f"Miau... (respuesta simulada {digest} a: {text[:80]})"
+
+    def _chat_json(self, messages: List[ChatMessage], schema: Optional[Dict[str, Any]]) -> Any:
+        text = _last_user_text(messages)
+        # El modo combinado añade el material de escena tras el mensaje: se decide solo con el mensaje.
+        if text.startswith(_USER_MESSAGE_PREFIX):
+            text = text[len(_USER_MESSAGE_PREFIX):].split("\n", 1)[0]
+        if schema and "json_schema" in schema:
+            return _stub_value(schema["json_schema"]["schema"], text)
+        return {}
+
+    async def achat(self, model: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+                    max_tokens: Optional[int] = None, cache_key: Optional[str] = None) -> str:
+        await self._latency()
+        return self._chat(model, messages)
+
+    async def achat_json(self, model: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                         temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+        await self._latency()
+        return self._chat_json(messages, schema)
+
+    async def aimage(self, model: str, prompt: str, size: str = "1024x1024") -> bytes:
+        await self._latency()
+        return _stub_png(prompt.encode("utf-8"))
+
+    def chat(self, model: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+             max_tokens: Optional[int] = None) -> str:
+        if LLM_STUB_LATENCY_S:
+            time.sleep(LLM_STUB_LATENCY_S)
+        return self._chat(model, messages)
+
+    def chat_json(self, model: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                  temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+        if LLM_STUB_LATENCY_S:
+            time.sleep(LLM_STUB_LATENCY_S)
+        return self._chat_json(messages, schema)
+
+    async def warm_up(self, timeout_s: float):
+        return None
+
+
+_providers: Dict[str, Any] = {}
+_providers_lock = threading.Lock()
+
+
+def get_backend(name: str):
+    """Instancia única por proceso de cada backend."""
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                if name == "openai":
+                    provider = OpenAIProvider("openai")
+                elif name == "local":
+                    provider = OpenAIProvider("local", base_url=LLM_LOCAL_BASE_URL,
+                                              api_key=os.environ.get("LLM_LOCAL_API_KEY", "local"))
+                elif name == "stub":
+                    provider = StubProvider()
+                else:
+                    raise ValueError(f"Backend de LLM desconocido: '{name}' (usa openai, local o stub).")
+                _providers[name] = provider
+    return provider
+
+
+def provider_for(task: str):
+    """(backend, modelo) listos para usar en una tarea; ProviderNotConfigured si el backend no arranca."""
+    backend, model = route(task)
+    provider = get_backend(backend)
+    if not provider.available():
+        raise ProviderNotConfigured(f"El backend '{backend}' de la tarea '{task}' no está configurado.")
+    return provider, model
+
+
+def is_available(task: str) -> bool:
+    try:
+        provider_for(task)
+        return True
+    except ProviderNotConfigured:
+        return False
+
+
+async def achat(task: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None, cache_key: Optional[str] = None) -> str:
+    """`cache_key` identifica un prefijo estable (p. ej. el personaje) para la caché de prompts del proveedor."""
+    provider, model = provider_for(task)
+    return await provider.achat(model, messages, temperature, max_tokens, cache_key)
+
+
+async def achat_json(task: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                     temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+    """Respuesta JSON ya decodificada; con `schema` (response_format json_schema) la salida es estricta."""
+    provider, model = provider_for(task)
+    return await provider.achat_json(model, messages, schema, temperature, max_tokens)
+
+
+async def avision(task: str, system_prompt: str, text: str, image_bytes: bytes,
+                  max_tokens: Optional[int] = None) -> str:
+    provider, model = provider_for(task)
+    return await provider.achat(model, _vision_messages(system_prompt, text, image_bytes), None, max_tokens)
+
+
+async def aimage(task: str, prompt: str, size: str = "1024x1024") -> bytes:
+    """Bytes PNG de la imagen generada."""
+    provider, model = provider_for(task)
+    return await provider.aimage(model, prompt, size)
+
+
+def request_body(task: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+                 json_mode: bool = False, temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Cuerpo de /v1/chat/completions para una tarea, tal como lo enviaría chat/chat_json (modo batch)."""
+    _, model = route(task)
+    extra = {"response_format": _json_format(schema)} if schema or json_mode else {}
+    return OpenAIProvider._chat_kwargs(model, messages, temperature, max_tokens, **extra)
+
+
+def chat(task: str, messages: List[ChatMessage], temperature: Optional[float] = None,
+         max_tokens: Optional[int] = None) -> str:
+    """Versión síncrona para scripts y CLIs."""
+    provider, model = provider_for(task)
+    return provider.chat(model, messages, temperature, max_tokens)
+
+
+def chat_json(task: str, messages: List[ChatMessage], schema: Optional[Dict[str, Any]] = None,
+              temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+    provider, model = provider_for(task)
+    return provider.chat_json(model, messages, schema, temperature, max_tokens)
+
+
+async def warm_up(tasks: Tuple[str, ...] = ("intent", "chat"), timeout_s: float = 5.0):
+    """Abre las conexiones HTTP/TLS de los backends usados por estas tareas antes de la primera petición."""
+    for backend in sorted({route(task)[0] for task in tasks}):
+        try:
+            await get_backend(backend).warm_up(timeout_s)
+            print(f"Conexión con el backend de LLM '{backend}' precalentada.")
+        except Exception as e:
+            print(f"No se pudo precalentar el backend de LLM '{backend}': {e}")
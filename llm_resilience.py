@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=1)
+def _retryable_errors() -> Tuple[type, ...]:
+    # openai se importa al primer uso: es de lo más pesado del arranque de la API.
+    import openai
+    return (
+        asyncio.TimeoutError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+class CircuitOpenError(Exception):
+    """Se lanza cuando el circuito está abierto y la llamada no se intenta."""
+
+
+@dataclass
+class CallPolicy:
+    """Presupuesto de latencia y reintentos para un tipo de llamada al modelo."""
+    timeout_s: float
+    retries: int = 1
+    total_budget_s: Optional[float] = None
+    hedge: bool = False
+    hedge_default_delay_s: float = 1.0
+    backoff_base_s: float = 0.25
+    backoff_max_s: float = 4.0
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class LatencyTracker:
+    """Guarda las últimas latencias exitosas para estimar el p95 de cada tipo de llamada."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def p95(self, default: float, min_samples: int = 20) -> float:
+        if len(self._samples) < min_samples:
+            return default
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class CircuitBreaker:
+    """
+    Circuito con ventana deslizante: se abre cuando la tasa de errores reintentables
+    supera el umbral y deja pasar una llamada de prueba tras el enfriamiento.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, window: int = 20,
+                 min_calls: int = 5, cooldown_s: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown_s = cooldown_s
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._results.append(True)
+        if self._opened_at is not None:
+            print(f"Circuito '{self.name}' cerrado de nuevo.")
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._results.append(False)
+        if self._opened_at is not None:
+            # Falló la llamada de prueba: se reinicia el enfriamiento.
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+            return
+        if len(self._results) >= self.min_calls:
+            failures = self._results.count(False)
+            if failures / len(self._results) >= self.failure_rate:
+                self._opened_at = time.monotonic()
+                print(f"Circuito '{self.name}' abierto: {failures}/{len(self._results)} errores recientes.")
+
+    def release_probe(self):
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "recent_calls": len(self._results),
+                "recent_failures": self._results.count(False)}
+
+
+def _backoff(policy: CallPolicy, attempt: int) -> float:
+    # Backoff exponencial con "full jitter".
+    return random.uniform(0, min(policy.backoff_max_s, policy.backoff_base_s * (2 ** attempt)))
+
+
+async def _hedged(fn: Callable[[], Awaitable[T]], timeout_s: float, hedge_delay_s: float) -> T:
+    """Lanza una segunda petición idéntica si la primera no respondió tras `hedge_delay_s`."""
+    first = asyncio.ensure_future(fn())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay_s, timeout_s))
+        if not done:
+            tasks.append(asyncio.ensure_future(fn()))
+        deadline = time.monotonic() + max(0.0, timeout_s - hedge_delay_s) if not done else None
+        last_error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_with_policy(
+    fn: Callable[[], Awaitable[T]], policy: CallPolicy,
+    breaker: CircuitBreaker, latency: Optional[LatencyTracker] = None
+) -> T:
+    """
+    Ejecuta `fn` con timeout por intento, presupuesto total, reintentos con jitter
+    para errores reintentables, hedging opcional y circuito.
+    Lanza CircuitOpenError si el circuito está abierto.
+    """
+    # Si esta llamada es la de prueba del circuito medio abierto, hay que soltarla pase lo que pase.
+    is_probe = breaker.state == "half_open"
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuito '{breaker.name}' abierto.")
+    try:
+        return await _call_with_retries(fn, policy, breaker, latency)
+    except BaseException:
+        # Cancelaciones (hedge perdido, cliente desconectado) y errores no reintentables (que no
+        # cuentan para el circuito): sin esto la prueba quedaría en vuelo y el circuito no se cerraría nunca.
+        if is_probe:
+            breaker.release_probe()
+        raise
+
+
+async def _call_with_retries(
+    fn: Callable[[], Awaitable[T]], policy: CallPolicy,
+    breaker: CircuitBreaker, latency: Optional[LatencyTracker]
+) -> T:
+    budget = policy.total_budget_s or policy.timeout_s * (policy.retries + 1)
+    deadline = time.monotonic() + budget
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        timeout_s = min(policy.timeout_s, remaining)
+        started = time.monotonic()
+        delay = latency.p95(policy.hedge_default_delay_s) if latency else policy.hedge_default_delay_s
+        try:
+            # Sin margen para una segunda petición antes del timeout, el hedge solo duplicaría el gasto.
+            if policy.hedge and timeout_s > delay:
+                result = await _hedged(fn, timeout_s, delay)
+            else:
+                result = await asyncio.wait_for(fn(), timeout=timeout_s)
+        except _retryable_errors() as e:
+            wait = _backoff(policy, attempt)
+            if attempt >= policy.retries or time.monotonic() + wait >= deadline:
+                breaker.record_failure()
+                raise
+            print(f"Llamada a '{breaker.name}' falló ({type(e).__name__}), reintento {attempt + 1}/{policy.retries}...")
+            attempt += 1
+            await asyncio.sleep(wait)
+            continue
+        if latency is not None:
+            latency.record(time.monotonic() - started)
+        breaker.record_success()
+        return result
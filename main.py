@@ -1,8 +1,11 @@
+import sys
 import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor
 from character_models import CharacterSheet
 from sheet_reader import load_character_sheet
-from episodes_db import init_db, search_episodes, format_citation
+from episodes_db import init_db, init_pool, search_episodes_with_citations
+from episode_snapshot import EPISODES_SNAPSHOT, activate_snapshot
 
 try:
     from document_utils import save_response_to_docx
@@ -11,8 +14,7 @@ except Exception:
 
 def answer_as_character(sheet: CharacterSheet, question: str) -> str:
     """Responde en tono del personaje usando su ficha y citando episodios."""
-    init_db()
-    hits = search_episodes(question, limit=2)
+    hits, citations = search_episodes_with_citations(question, limit=2)
 
     traits = ", ".join(sheet.personality_traits) if sheet.personality_traits else "—"
     catch = sheet.catchphrases[0] if sheet.catchphrases else ""
@@ -24,14 +26,67 @@ def answer_as_character(sheet: CharacterSheet, question: str) -> str:
     reply.append(f"Yo soy {sheet.name}, suelo ser {traits}.")
     if hits:
         reply.append("Recuerdo algunos episodios relacionados:")
-        for ep in hits:
-            reply.append(f"- {format_citation(ep)}")
+        for citation in citations:
+            reply.append(f"- {citation}")
     else:
         reply.append("No recuerdo un episodio específico sobre eso...")
     reply.append("¡Miau!" if (not catch or catch.lower() == "miau") else catch)
     return "\n".join(reply)
 
 
+def save_doc(sheet: CharacterSheet, question: str, answer: str):
+    if save_response_to_docx is None:
+        # A stderr: en --batch con --out - la salida estándar es el JSONL.
+        print("\n[Aviso] Falta 'python-docx' o 'document_utils.py'. Instala con: pip install python-docx", file=sys.stderr)
+        return None
+    return save_response_to_docx(sheet.name, question, answer)
+
+
+def run_repl(sheet: CharacterSheet, save: bool):
+    """Modo interactivo: la ficha y la conexión se cargan una vez y se responde en bucle."""
+    print(f"\n=== Conversación con {sheet.name} (línea vacía o 'salir' para terminar) ===\n")
+    while True:
+        try:
+            question = input("> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+        if not question or question.lower() in ("salir", "exit", "quit"):
+            break
+        answer = answer_as_character(sheet, question)
+        print(f"\n{answer}\n")
+        if save:
+            path_doc = save_doc(sheet, question, answer)
+            if path_doc:
+                print(f"Respuesta guardada en: {path_doc}\n")
+
+
+def run_batch(sheet: CharacterSheet, source: str, out: str, workers: int, save: bool):
+    """Modo lote: lee una pregunta por línea (archivo o '-' para stdin) y escribe JSONL en orden."""
+    if source == "-":
+        questions = [line.strip() for line in sys.stdin if line.strip()]
+    else:
+        with open(source, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    def answer_one(question: str) -> dict:
+        answer = answer_as_character(sheet, question)
+        record = {"question": question, "answer": answer}
+        if save:
+            record["document"] = save_doc(sheet, question, answer)
+        return record
+
+    out_file = sys.stdout if out == "-" else open(out, "w", encoding="utf-8")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for record in executor.map(answer_one, questions):
+                out_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+    print(f"{len(questions)} preguntas respondidas.", file=sys.stderr)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Agente conversacional básico.")
     parser.add_argument(
@@ -43,11 +98,31 @@ def main():
     parser.add_argument("--ask", help="Pregunta del usuario al personaje")
     parser.add_argument("--save-doc", action="store_true", help="Guardar la respuesta en .docx (requiere python-docx y document_utils.py)")
     parser.add_argument("--save-img", action="store_true", help="Generar imagen con la respuesta (requiere Pillow y image_utils.py)")
+    parser.add_argument("--init-db", action="store_true", help="Crear/actualizar el esquema de la base de datos (una sola vez)")
+    parser.add_argument("--repl", action="store_true", help="Modo interactivo: responder preguntas en bucle")
+    parser.add_argument("--batch", metavar="ARCHIVO", help="Responder las preguntas de un archivo (una por línea, '-' para stdin)")
+    parser.add_argument("--out", default="-", help="Salida JSONL del modo --batch ('-' para stdout)")
+    parser.add_argument("--workers", type=int, default=4, help="Preguntas simultáneas en modo --batch")
+    parser.add_argument("--snapshot", default=EPISODES_SNAPSHOT, help="Buscar episodios en este snapshot en lugar de Postgres")
     args = parser.parse_args()
 
+    if args.init_db:
+        init_db()
+    if args.snapshot:
+        # Si está obsoleto y hay BD, se busca en Postgres; sin BD se usa igualmente.
+        activate_snapshot(args.snapshot)
+
     raw = load_character_sheet(args.path)
     sheet = CharacterSheet(**raw)
 
+    if args.repl or args.batch:
+        init_pool(1, max(1, args.workers))
+        if args.batch:
+            run_batch(sheet, args.batch, args.out, max(1, args.workers), args.save_doc)
+        else:
+            run_repl(sheet, args.save_doc)
+        return
+
     print("\n=== Persona prompt sugerido ===\n")
     print(sheet.persona_prompt())
 
@@ -57,13 +132,11 @@ def main():
         print(answer)
 
         if args.save_doc:
-            if save_response_to_docx is None:
-                print("\n[Aviso] Falta 'python-docx' o 'document_utils.py'. Instala con: pip install python-docx")
-            else:
-                path_doc = save_response_to_docx(sheet.name, args.ask, answer)
+            path_doc = save_doc(sheet, args.ask, answer)
+            if path_doc:
                 print(f"\nRespuesta guardada en: {path_doc}")
     else:
-        print("\n(Pista) Usa --ask \"tu pregunta\" para interactuar.")
+        print("\n(Pista) Usa --ask \"tu pregunta\", --repl o --batch preguntas.txt para interactuar.")
 
 
 if __name__ == "__main__":
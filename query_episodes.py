@@ -1,16 +1,48 @@
 import argparse
 from episodes_db import init_db, ingest_csv, search_episodes, format_citation
+from episode_snapshot import activate_snapshot
 
 def main():
     parser = argparse.ArgumentParser(description="Prueba de búsqueda de episodios.")
     parser.add_argument("--ingest", action="store_true", help="Ingerir CSV antes de buscar")
     parser.add_argument("--csv", default="data/episodios/episodios.csv", help="Ruta al CSV")
     parser.add_argument("query", nargs="?", default="Gary", help="Texto a buscar")
+    bench = parser.add_argument_group("benchmark de recuperación")
+    bench.add_argument("--bench", action="store_true", help="Ejecutar el benchmark con un corpus sintético")
+    bench.add_argument("--sizes", default="300,3000,30000,100000", help="Tamaños de corpus separados por comas")
+    bench.add_argument("--queries", type=int, default=200, help="Consultas etiquetadas por tamaño")
+    bench.add_argument("--k", type=int, default=5, help="k para recall@k")
+    bench.add_argument("--backends", help="Backends a medir (p. ej. postgres,postgres_ranked,memory,snapshot)")
+    bench.add_argument("--concurrency", type=int, default=1, help="Consultas simultáneas al reproducir el workload")
+    bench.add_argument("--seed", type=int, default=42, help="Semilla del generador")
+    bench.add_argument("--no-db", action="store_true", help="Medir solo los backends sin Postgres")
+    bench.add_argument("--json", help="Guardar el informe en este archivo JSON")
+    parser.add_argument("--snapshot", help="Buscar en este snapshot (episode_snapshot.py export) en lugar de Postgres")
     args = parser.parse_args()
 
-    init_db()
-    if args.ingest:
-        ingest_csv(args.csv)
+    if args.bench:
+        from retrieval_bench import run_benchmark
+        use_db = not args.no_db
+        if use_db:
+            try:
+                init_db()
+            except Exception as e:
+                print(f"[Aviso] Postgres no disponible ({e}); solo se miden los backends sin BD.")
+                use_db = False
+        run_benchmark(
+            sizes=[int(size) for size in args.sizes.split(",")], n_queries=args.queries, k=args.k,
+            backends=args.backends.split(",") if args.backends else None, concurrency=args.concurrency,
+            seed=args.seed, use_db=use_db, json_out=args.json
+        )
+        return
+
+    if args.snapshot:
+        # Si está obsoleto y hay BD, se busca en Postgres; sin BD se usa igualmente.
+        activate_snapshot(args.snapshot)
+    else:
+        init_db()
+        if args.ingest:
+            ingest_csv(args.csv)
 
     results = search_episodes(args.query, limit=5)
     if not results:
@@ -0,0 +1,197 @@
+"""
+Perfilado opcional de peticiones individuales (p. ej. un /ask lento en producción).
+
+Se activa por petición con la cabecera X-Profile con el valor de PROFILE_TOKEN (sin token
+configurado la cabecera se ignora) o por muestreo con PROFILE_SAMPLE_RATE. En PROFILE_DIR se
+conservan como mucho PROFILE_MAX_FILES perfiles; los más antiguos se borran. Con pyinstrument instalado se guarda un perfil
+async-aware en formato speedscope; si no, un muestreador propio guarda pilas colapsadas
+(formato de flamegraph.pl / speedscope). Desactivado, el coste es comprobar la ruta.
+"""
+
+import os
+import re
+import sys
+import hmac
+import time
+import uuid
+import random
+import asyncio
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "data/out/profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_PATHS = tuple(p for p in os.environ.get("PROFILE_PATHS", "/ask").split(",") if p)
+PROFILE_INTERVAL_S = float(os.environ.get("PROFILE_INTERVAL_S", "0.005"))
+# Perfiles simultáneos como máximo; el resto de peticiones se sirven sin perfilar.
+PROFILE_MAX_CONCURRENT = int(os.environ.get("PROFILE_MAX_CONCURRENT", "2"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+
+_PROFILE_HEADER = b"x-profile"
+_REQUEST_ID_HEADER = b"x-request-id"
+_SAFE_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class StackSampler:
+    """
+    Muestreador de pared para un hilo (el del event loop): cada intervalo anota su pila.
+    Las esperas a la API o a la BD aparecen como el selector del loop; si hay otras
+    peticiones en curso, sus pilas también aparecen en el perfil.
+    """
+
+    def __init__(self, thread_id: int, interval_s: float = PROFILE_INTERVAL_S):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _Profile:
+    """Un perfil en curso: pyinstrument si está disponible, si no StackSampler."""
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(interval=PROFILE_INTERVAL_S, async_mode="enabled")
+            self._sampler = None
+        except Exception:
+            self._profiler = None
+            self._sampler = StackSampler(threading.get_ident())
+
+    def start(self):
+        if self._profiler:
+            self._profiler.start()
+        else:
+            self._sampler.start()
+
+    def stop(self):
+        if self._profiler:
+            self._profiler.stop()
+        else:
+            self._sampler.stop()
+
+    def render(self) -> Tuple[str, str]:
+        """(extensión, contenido) del archivo de salida."""
+        if self._profiler:
+            from pyinstrument.renderers import SpeedscopeRenderer
+            return "speedscope.json", self._profiler.output(SpeedscopeRenderer())
+        return "collapsed.txt", self._sampler.collapsed()
+
+
+def _prune_profiles(directory: str, max_files: int):
+    """Borra los perfiles más antiguos por encima de `max_files`."""
+    entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def save_profile(request_id: str, path: str, extension: str, content: str, directory: str = PROFILE_DIR,
+                 max_files: int = PROFILE_MAX_FILES) -> str:
+    os.makedirs(directory, exist_ok=True)
+    slug = path.strip("/").replace("/", "_") or "root"
+    file_path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{slug}_{request_id}.{extension}")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    _prune_profiles(directory, max_files)
+    return file_path
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI puro: no envuelve la respuesta salvo en las peticiones que se perfilan."""
+
+    def __init__(self, app, paths: Tuple[str, ...] = PROFILE_PATHS, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 token: str = PROFILE_TOKEN):
+        self.app = app
+        self.paths = paths
+        self.sample_rate = sample_rate
+        self.token = token
+        self.active = 0
+        self.saved = 0
+
+    def _wants_profile(self, scope) -> bool:
+        requested = _header(scope["headers"], _PROFILE_HEADER)
+        if requested is not None and self.token and hmac.compare_digest(requested.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not scope["path"].startswith(self.paths)
+                or self.active >= PROFILE_MAX_CONCURRENT or not self._wants_profile(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        # El ID va en el nombre del archivo: solo se acepta el del cliente si es seguro.
+        request_id = _header(scope["headers"], _REQUEST_ID_HEADER) or ""
+        if not _SAFE_ID_RE.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-request-id", request_id.encode("latin-1")),
+                                                  (b"x-profiled", b"1")]}
+            await send(message)
+
+        # El perfilado nunca puede hacer fallar la petición que observa.
+        try:
+            profile = _Profile()
+            profile.start()
+        except Exception as e:
+            print(f"No se pudo iniciar el perfil de la petición {request_id}: {e}")
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            self.active += 1
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.active -= 1
+            await self._save(profile, scope["path"], request_id, (time.perf_counter() - started) * 1000)
+
+    async def _save(self, profile: "_Profile", path: str, request_id: str, elapsed_ms: float):
+        try:
+            profile.stop()
+            extension, content = profile.render()
+            file_path = await asyncio.to_thread(save_profile, request_id, path, extension, content)
+            self.saved += 1
+            print(f"Perfil de {path} ({elapsed_ms:.0f} ms, petición {request_id}) guardado en: {file_path}")
+        except Exception as e:
+            print(f"No se pudo guardar el perfil de la petición {request_id}: {e}")
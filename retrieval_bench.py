@@ -0,0 +1,184 @@
+import os
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from psycopg2.extras import DictCursor, execute_values
+
+from episode_index import EpisodeIndex
+from episode_snapshot import EpisodeSnapshot, write_snapshot
+from episodes_db import EPISODE_COLUMNS, _connect, _extract_keywords, build_search_sql
+
+BENCH_TABLE = "episodes_bench"
+
+CHARACTERS = ["Bob Esponja", "Patricio", "Calamardo", "Don Cangrejo", "Arenita", "Plankton", "Gary",
+              "Señora Puff", "Perlita", "Karen", "Larry", "Sirenoman", "Chico Percebe", "El Holandés Errante"]
+PLACES = ["el Crustáceo Cascarudo", "la piña", "la roca de Patricio", "el Campo de Medusas", "el Balde de Carnada",
+          "la escuela de navegación", "la cúpula de Arenita", "Fondo de Bikini", "la Laguna Gu", "el Barco Fantasma"]
+OBJECTS = ["cangreburger", "espátula", "red de medusas", "fórmula secreta", "clarinete", "burbujas", "concha mágica",
+           "caja de cartón", "barco de madera", "karate", "comida de caracol", "trofeo", "mapa del tesoro"]
+ACTIONS = ["se escapa de", "cocina en", "pierde algo en", "busca un tesoro en", "construye un invento en",
+           "canta en", "se disfraza en", "compite en", "duerme en", "organiza una fiesta en", "se pierde en"]
+MOODS = ["nervioso", "feliz", "aburrido", "celoso", "asustado", "orgulloso", "confundido", "furioso"]
+SYLLABLES = ["bur", "cor", "ma", "lun", "gre", "pi", "to", "nal", "fo", "quen", "dri", "sa", "bel", "zum", "tri"]
+
+
+def _rare_word(rng: random.Random, used: Set[str]) -> str:
+    while True:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4)))
+        if word not in used:
+            used.add(word)
+            return word
+
+
+def generate_corpus(size: int, n_queries: int, seed: int = 42) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Genera `size` episodios sintéticos en español y `n_queries` consultas etiquetadas.
+    Cada consulta apunta a una palabra inventada sembrada en 1-5 episodios (su conjunto relevante),
+    rodeada de palabras frecuentes para que la consulta tenga hasta ~10 palabras clave.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(size):
+        cast = rng.sample(CHARACTERS, rng.randint(2, 4))
+        place, obj, action, mood = rng.choice(PLACES), rng.choice(OBJECTS), rng.choice(ACTIONS), rng.choice(MOODS)
+        rows.append({
+            "id": i + 1, "season": i // 40 + 1, "episode": i + 1, "code": f"{i + 1}{'ab'[i % 2]}",
+            "title": f"{cast[0]} y la {obj}" if i % 2 else f"El día que {cast[0]} {action} {place}",
+            "summary": f"{cast[0]} {action} {place} con {cast[1]}. Todo se complica por una {obj} y {cast[0]} acaba {mood}.",
+            "quotes": f"¡Estoy {mood}! | ¿Dónde está mi {obj}?",
+            "characters": "; ".join(cast),
+            "visual_summary": f"{cast[0]} en {place} junto a una {obj}.",
+            "key_characters": ", ".join(cast[:3]),
+            "key_objects_locations": f"{obj}, {place}",
+        })
+
+    used: Set[str] = set()
+    queries = []
+    for _ in range(n_queries):
+        rare = _rare_word(rng, used)
+        relevant = rng.sample(range(size), min(size, rng.randint(1, 5)))
+        for doc in relevant:
+            rows[doc]["summary"] += f" Aparece el misterioso {rare}."
+        fillers = rng.sample([rng.choice(CHARACTERS).split()[-1], rng.choice(OBJECTS).split()[0],
+                              rng.choice(MOODS), rng.choice(PLACES).split()[-1], "episodio", "recuerdas",
+                              "pasó", "cuando", "escapó", "fiesta"], rng.randint(1, 9))
+        text = f"¿{' '.join(fillers)} {rare}?"
+        queries.append({"query": text, "relevant": {rows[doc]["id"] for doc in relevant}})
+    return rows, queries
+
+
+def ingest_corpus(rows: List[Dict[str, Any]], table: str = BENCH_TABLE):
+    """Carga el corpus en una tabla aparte (no toca `episodes`)."""
+    columns = EPISODE_COLUMNS
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (LIKE episodes INCLUDING DEFAULTS);")
+            cur.execute(f"TRUNCATE TABLE {table};")
+            execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                           [tuple(row[col] for col in columns) for row in rows], page_size=1000)
+            cur.execute(f"ANALYZE {table};")
+        conn.commit()
+
+
+def _sql_backend(table: str, ranked: bool) -> Callable[[str, int], List[Dict[str, Any]]]:
+    def search(query: str, limit: int) -> List[Dict[str, Any]]:
+        keywords = _extract_keywords(query)
+        if not keywords:
+            return []
+        sql_query, sql_params = build_search_sql(keywords, limit, table=table, ranked=ranked)
+        with _connect() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(sql_query, sql_params)
+                return [dict(row) for row in cur.fetchall()]
+    return search
+
+
+def available_backends(rows: List[Dict[str, Any]], use_db: bool, work_dir: str) -> Dict[str, Callable[[str, int], List[Dict[str, Any]]]]:
+    """Backends de búsqueda disponibles para el corpus (los de Postgres solo si hay BD); el snapshot se escribe en `work_dir`."""
+    backends: Dict[str, Callable[[str, int], List[Dict[str, Any]]]] = {}
+    if use_db:
+        backends["postgres"] = _sql_backend(BENCH_TABLE, ranked=False)
+        backends["postgres_ranked"] = _sql_backend(BENCH_TABLE, ranked=True)
+    started = time.perf_counter()
+    index = EpisodeIndex(rows)
+    print(f"  Índice en memoria construido en {(time.perf_counter() - started) * 1000:.0f} ms ({len(index.postings)} términos).")
+    backends["memory"] = index.search
+
+    path = os.path.join(work_dir, f"episodes_{len(rows)}.snap")
+    write_snapshot(path, rows)
+    started = time.perf_counter()
+    snapshot = EpisodeSnapshot(path)
+    print(f"  Snapshot de {os.path.getsize(path) / 1e6:.1f} MB abierto en {(time.perf_counter() - started) * 1000:.0f} ms.")
+    backends["snapshot"] = snapshot.search
+    return backends
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+def replay(search: Callable[[str, int], List[Dict[str, Any]]], queries: List[Dict[str, Any]],
+           k: int, concurrency: int = 1) -> Dict[str, float]:
+    """Reproduce el workload y devuelve percentiles de latencia, throughput y recall@k."""
+
+    def run_one(q: Dict[str, Any]) -> Tuple[float, float]:
+        started = time.perf_counter()
+        hits = search(q["query"], k)
+        elapsed = time.perf_counter() - started
+        found = {hit["id"] for hit in hits} & q["relevant"]
+        return elapsed, len(found) / min(k, len(q["relevant"]))
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run_one, queries))
+    else:
+        results = [run_one(q) for q in queries]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    return {
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "qps": len(results) / wall if wall else 0.0,
+        f"recall@{k}": sum(r[1] for r in results) / len(results) if results else 0.0,
+    }
+
+
+def run_benchmark(sizes: List[int], n_queries: int = 200, k: int = 5, backends: Optional[List[str]] = None,
+                  concurrency: int = 1, seed: int = 42, use_db: bool = True, json_out: Optional[str] = None):
+    report = []
+    for size in sizes:
+        print(f"\n=== Corpus sintético de {size} episodios, {n_queries} consultas ===")
+        rows, queries = generate_corpus(size, n_queries, seed)
+        db_ok = use_db
+        if db_ok:
+            try:
+                started = time.perf_counter()
+                ingest_corpus(rows)
+                print(f"  Ingesta en '{BENCH_TABLE}': {(time.perf_counter() - started):.1f} s")
+            except Exception as e:
+                print(f"  Postgres no disponible, solo se mide el backend en memoria: {e}")
+                db_ok = False
+        # ignore_cleanup_errors: en Windows el snapshot sigue mapeado al salir del bloque.
+        with tempfile.TemporaryDirectory(prefix="garybot_bench_", ignore_cleanup_errors=True) as work_dir:
+            for name, search in available_backends(rows, db_ok, work_dir).items():
+                if backends and name not in backends:
+                    continue
+                stats = replay(search, queries, k, concurrency)
+                report.append({"size": size, "backend": name, **stats})
+                print(f"  {name:16s} p50 {stats['p50_ms']:8.2f} ms | p95 {stats['p95_ms']:8.2f} ms | "
+                      f"p99 {stats['p99_ms']:8.2f} ms | {stats['qps']:8.1f} q/s | recall@{k} {stats[f'recall@{k}']:.3f}")
+
+    if json_out:
+        with open(json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nInforme guardado en: {json_out}")
+    return report
@@ -0,0 +1,132 @@
+import os
+import uuid
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from psycopg2.extras import DictCursor
+
+from episodes_db import _connect, init_pool
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "data/out/sesiones")
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EXPORT_FORMATS = ("pdf", "docx")
+# Filas que trae cada viaje del cursor del servidor.
+_CURSOR_ITERSIZE = 500
+
+ExportResult = Tuple[str, Optional[str], Optional[str]]
+
+
+def iter_session_ids(since: Optional[str] = None) -> Iterator[str]:
+    """Recorre los session_id de chat_history con un cursor del servidor (sin cargarlos todos)."""
+    with _connect() as conn:
+        with conn.cursor(name=f"export_sessions_{uuid.uuid4().hex}") as cur:
+            cur.itersize = _CURSOR_ITERSIZE
+            if since:
+                cur.execute(
+                    "SELECT session_id FROM chat_history GROUP BY session_id HAVING MAX(created_at) >= %s ORDER BY session_id",
+                    (since,)
+                )
+            else:
+                cur.execute("SELECT DISTINCT session_id FROM chat_history ORDER BY session_id")
+            for (session_id,) in cur:
+                yield session_id
+
+
+def iter_session_messages(session_id: str) -> Iterator[Dict[str, str]]:
+    """Mensajes de una sesión en orden, leídos por lotes con un cursor del servidor."""
+    with _connect() as conn:
+        with conn.cursor(name=f"export_messages_{uuid.uuid4().hex}", cursor_factory=DictCursor) as cur:
+            cur.itersize = _CURSOR_ITERSIZE
+            cur.execute(
+                "SELECT role, content, created_at FROM chat_history WHERE session_id = %s ORDER BY created_at ASC, id ASC",
+                (session_id,)
+            )
+            for row in cur:
+                yield dict(row)
+
+
+def _init_worker():
+    # Cada proceso reutiliza una única conexión para todas las sesiones que exporta.
+    try:
+        init_pool(1, 1)
+    except Exception as e:
+        # Sin pool, cada sesión abrirá su propia conexión (y el error se reportará por sesión).
+        print(f"No se pudo crear la conexión del proceso de exportación: {e}")
+
+
+def export_session(session_id: str, fmt: str = "pdf", out_dir: str = EXPORT_DIR,
+                   character_name: str = "GaryBot") -> ExportResult:
+    """Renderiza una sesión. Se ejecuta en un proceso del pool; devuelve (session_id, ruta, error)."""
+    from document_utils import save_session_to_docx, save_session_to_pdf
+
+    render = save_session_to_pdf if fmt == "pdf" else save_session_to_docx
+    try:
+        return session_id, render(character_name, session_id, iter_session_messages(session_id), out_dir), None
+    except Exception as e:
+        return session_id, None, str(e)
+
+
+def make_executor(workers: int = EXPORT_WORKERS) -> ProcessPoolExecutor:
+    # 'spawn' evita heredar hilos y conexiones abiertas del proceso padre (p. ej. la API).
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+
+
+def export_sessions(session_ids: Iterable[str], fmt: str = "pdf", out_dir: str = EXPORT_DIR,
+                    character_name: str = "GaryBot", workers: int = EXPORT_WORKERS,
+                    executor: Optional[ProcessPoolExecutor] = None) -> Iterator[ExportResult]:
+    """
+    Exporta muchas sesiones en paralelo y va devolviendo cada resultado al terminar.
+    Solo mantiene unas pocas tareas en vuelo por proceso, así que sirve para miles de sesiones.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: '{fmt}'. Usa uno de {', '.join(EXPORT_FORMATS)}.")
+    own_executor = executor is None
+    executor = executor or make_executor(workers)
+    max_in_flight = workers * 4
+    in_flight: Set[Future] = set()
+    try:
+        for session_id in session_ids:
+            in_flight.add(executor.submit(export_session, session_id, fmt, out_dir, character_name))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(in_flight).done:
+            yield future.result()
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta conversaciones de chat_history a PDF/DOCX.")
+    parser.add_argument("sessions", nargs="*", help="session_id a exportar")
+    parser.add_argument("--all", action="store_true", help="Exportar todas las sesiones")
+    parser.add_argument("--since", help="Con --all, solo sesiones con actividad desde esta fecha (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="pdf", help="Formato de salida")
+    parser.add_argument("--out", default=EXPORT_DIR, help="Carpeta de salida")
+    parser.add_argument("--character", default="GaryBot", help="Nombre del personaje para la cabecera")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="Procesos de renderizado")
+    args = parser.parse_args()
+
+    if not args.sessions and not args.all:
+        parser.error("Indica uno o más session_id, o --all.")
+
+    session_ids = iter_session_ids(args.since) if args.all else iter(args.sessions)
+    ok, failed = 0, 0
+    for session_id, path, error in export_sessions(session_ids, args.format, args.out, args.character, args.workers):
+        if error:
+            failed += 1
+            print(f"  -> Error en la sesión {session_id}: {error}")
+        else:
+            ok += 1
+            if ok % 100 == 0:
+                print(f"{ok} sesiones exportadas...")
+    print(f"\nExportación finalizada: {ok} sesiones exportadas, {failed} con error. Carpeta: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Los módulos del proyecto están en la raíz del repositorio, sin paquete.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Sin red ni claves: los modelos los responde el backend determinista de llm_provider.
+os.environ.setdefault("LLM_BACKEND", "stub")
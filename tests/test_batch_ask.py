@@ -0,0 +1,38 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import app
+from character_models import CharacterSheet
+
+SHEET = CharacterSheet(name="Gary", visual_description_for_ai="Un caracol de concha rosa.")
+
+
+def test_invalid_characters_are_not_classified(monkeypatch):
+    def resolve(character):
+        if character != "gary":
+            raise ValueError(f"Personaje no válido: '{character}'.")
+        return "gary.json"
+
+    classified = []
+
+    async def classify(questions):
+        classified.extend(questions)
+        return ["chat"] * len(questions)
+
+    async def answer(question, session_id, sheet):
+        return {"type": "text", "content": f"Miau: {question}"}
+
+    monkeypatch.setattr(app, "resolve_sheet_path", resolve)
+    monkeypatch.setattr(app, "get_sheet", lambda path: SHEET)
+    monkeypatch.setattr(app, "classify_intents", classify)
+    monkeypatch.setattr(app, "answer_text", answer)
+
+    response = TestClient(app.app).post("/ask/batch", json={"items": [
+        {"question": "hola", "session_id": "a", "character": "gary"},
+        {"question": "qué tal", "session_id": "b", "character": "../x"},
+    ]})
+    lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+
+    assert classified == ["hola"]
+    assert [line["type"] for line in lines] == ["text", "error"]
@@ -0,0 +1,71 @@
+import os
+import json
+
+import pytest
+
+import batch_jobs
+
+
+@pytest.fixture
+def batch_dir(tmp_path, monkeypatch):
+    """Trabajos y servicio local en un directorio temporal, con el backend stub (ver conftest)."""
+    monkeypatch.setattr(batch_jobs, "BATCH_DIR", str(tmp_path / "batches"))
+    return tmp_path
+
+
+def _read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _success_line(custom_id: str, episodes) -> dict:
+    completion = {"choices": [{"index": 0, "message": {"role": "assistant",
+                                                       "content": json.dumps({"episodes": episodes})}}]}
+    return {"custom_id": custom_id, "response": {"status_code": 200, "body": completion}, "error": None}
+
+
+def _episode(number: int) -> dict:
+    return {"season": 1, "episode": number, "code": f"1{number:02d}a", "title": f"Episodio {number}",
+            "summary": "Resumen.", "quotes": "Miau", "characters": "Gary"}
+
+
+def test_episode_data_job_runs_offline_and_ingest_is_idempotent(batch_dir):
+    csv_path = str(batch_dir / "episodios.csv")
+    job_dir = batch_jobs.submit_job("episode_data", "local", total=20, batch_size=10, output=csv_path)
+    assert job_dir is not None
+
+    info = batch_jobs.wait_job(job_dir, poll_s=0)
+    assert info["status"] == "completed" and info["total"] == 2 and info["failed"] == 0
+
+    first = batch_jobs.ingest_job(job_dir)
+    assert first["errors"] == 0 and first["applied"] > 0
+    content = _read(csv_path)
+
+    assert batch_jobs.ingest_job(job_dir) == first
+    assert _read(csv_path) == content
+
+
+def test_ingest_skips_error_lines(batch_dir):
+    csv_path = str(batch_dir / "episodios.csv")
+    job_dir = batch_jobs.submit_job("episode_data", "local", total=30, batch_size=10, output=csv_path)
+    batch_jobs.wait_job(job_dir, poll_s=0)
+    # Salida como la de OpenAI: un lote correcto y los otros dos en el archivo de errores.
+    batch_jobs.write_jsonl(os.path.join(job_dir, "output.jsonl"), [
+        _success_line("episodes-0001-0010", [_episode(1), _episode(2)]),
+        {"custom_id": "episodes-0011-0020", "error": None,
+         "response": {"status_code": 400, "body": {"error": {"message": "Invalid request"}}}},
+        {"custom_id": "episodes-0021-0030", "response": None,
+         "error": {"code": "batch_expired", "message": "This request could not be executed"}},
+    ])
+
+    assert batch_jobs.ingest_job(job_dir) == {"applied": 2, "errors": 2}
+    with open(csv_path, encoding="utf-8") as f:
+        rows = f.read().splitlines()
+    assert len(rows) == 3  # cabecera + episodios 1 y 2
+
+
+def test_jobs_submitted_in_the_same_second_do_not_share_a_directory(batch_dir):
+    first = batch_jobs.submit_job("episode_data", "local", total=10, batch_size=10)
+    second = batch_jobs.submit_job("episode_data", "local", total=10, batch_size=10)
+    assert first != second
+    assert batch_jobs._load_job(first)["batch_id"] != batch_jobs._load_job(second)["batch_id"]
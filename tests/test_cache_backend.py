@@ -0,0 +1,129 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+import cache_backend
+from cache_backend import Cache, InMemoryRedis, LocalBackend, RedisBackend
+
+
+def _shared_cache(namespace: str) -> Cache:
+    return Cache(namespace, backend=RedisBackend(InMemoryRedis()))
+
+
+def test_local_cache_hits_and_misses():
+    cache = Cache("test_local", backend=LocalBackend())
+    assert cache.get("k") is None
+    cache.set("k", {"a": 1})
+    assert cache.get("k") == {"a": 1}
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+    assert cache.info()["backend"] == "local"
+
+
+def test_local_backend_expires_and_evicts():
+    backend = LocalBackend(max_items=2)
+    backend.set("a", 1, ttl_s=0.01)
+    backend.set("b", 2)
+    backend.set("c", 3)
+    time.sleep(0.02)
+    assert backend.get("a") is None
+    assert backend.get("b") == 2 and backend.get("c") == 3
+    assert not backend.set("b", 20, nx=True)
+
+
+def test_shared_cache_serializes_values():
+    cache = _shared_cache("test_shared")
+    cache.set("k", ["x", 1])
+    assert cache.get("k") == ["x", 1]
+    assert cache.peek("missing") is None
+    # peek no cuenta en las estadísticas.
+    assert cache.stats == {"hits": 1, "misses": 0, "errors": 0}
+
+
+def test_bump_invalidates_namespace_in_every_worker(monkeypatch):
+    monkeypatch.setattr(cache_backend, "_GENERATION_REFRESH_S", 0.0)
+    backend = RedisBackend(InMemoryRedis())
+    worker_a = Cache("test_bump", backend=backend)
+    worker_b = Cache("test_bump", backend=backend)
+    worker_a.set("k", "old")
+    assert worker_b.get("k") == "old"
+
+    worker_a.bump()
+    assert worker_a.get("k") is None
+    assert worker_b.get("k") is None
+
+
+def test_get_or_set_computes_once_across_threads():
+    cache = _shared_cache("test_single_flight")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_set("k", compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 5
+    assert len(calls) == 1
+
+
+def test_stale_lock_owner_does_not_release_another_workers_lock():
+    cache = _shared_cache("test_lock_owner")
+    full_key = cache._full_key("k")
+    value, token = cache._wait_for_other_worker(full_key)
+    assert value is cache_backend._MISS and token is not None
+
+    # El cerrojo caducó y lo tomó otro worker: el primero no puede borrarlo al terminar.
+    client = cache.backend.client
+    client.delete(f"{full_key}:lock")
+    assert client.set(f"{full_key}:lock", b"other-worker", nx=True)
+    cache._release(full_key, token)
+    assert client.get(f"{full_key}:lock") == b"other-worker"
+
+    cache._release(full_key, b"other-worker")
+    assert client.get(f"{full_key}:lock") is None
+
+
+def test_aget_or_set_survives_cancellation_of_the_computing_coroutine():
+    cache = Cache("test_cancel", backend=LocalBackend())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        first = asyncio.create_task(cache.aget_or_set("k", compute))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(cache.aget_or_set("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "value"
+    assert len(calls) == 2
+    assert cache.get("k") == "value"
+
+
+def test_aget_or_set_forwards_errors_to_waiters():
+    cache = Cache("test_errors", backend=LocalBackend())
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(cache.aget_or_set("k", compute), cache.aget_or_set("k", compute),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
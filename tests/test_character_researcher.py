@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import character_researcher
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "research")
+PAGES = {
+    "https://spongebob.fandom.com/wiki/Gary_the_Snail": "wiki_gary.html",
+    "https://example.com/gary-el-caracol": "article_gary.html",
+}
+
+
+@pytest.fixture
+def saved_pages(monkeypatch):
+    """Sirve las páginas guardadas en lugar de descargarlas; las URLs desconocidas fallan como un 404."""
+    def fake_fetch_html(url, cache_dir=character_researcher.RESEARCH_CACHE_DIR):
+        if url not in PAGES:
+            return ""
+        with open(os.path.join(FIXTURES, PAGES[url]), encoding="utf-8") as f:
+            return f.read()
+    monkeypatch.setattr(character_researcher, "fetch_html", fake_fetch_html)
+    return list(PAGES) + ["https://example.com/no-existe"]
+
+
+def test_gather_research_context_ranks_relevant_passages(saved_pages):
+    passages = character_researcher.gather_research_context("Gary the Snail", saved_pages, token_budget=10_000)
+
+    assert [p[:40] for p in passages] == [
+        "Gary has a pink shell with a dark pink s",
+        "Gary has a calm and intelligent personal",
+        "Gary the Snail is SpongeBob SquarePants'",
+        "Gary es el caracol de Bob Esponja. Tiene",
+        "Gary es muy leal a su dueño, aunque a ve",
+        'First appearance: "Help Wanted", where h',
+    ]
+    text = "\n".join(passages)
+    # Ruido de la página (scripts, navegación, pie, formularios) y pasajes sin términos relevantes.
+    assert "script text" not in text
+    assert "Community content" not in text
+    assert "boletín" not in text
+    assert "millones de espectadores" not in text
+
+
+def test_relevant_terms_match_whole_words(saved_pages):
+    passages = character_researcher.gather_research_context("Gary the Snail", saved_pages, token_budget=10_000)
+    # 'colorful', 'colourless' y 'shapeless' no cuentan como 'color', 'colour' ni 'shape'.
+    assert not any("colorful" in p for p in passages)
+
+
+def test_gather_research_context_respects_token_budget(saved_pages):
+    ranked = character_researcher.gather_research_context("Gary the Snail", saved_pages, token_budget=10_000)
+    budget = sum(len(p) // character_researcher.CHARS_PER_TOKEN + 1 for p in ranked[:2])
+
+    assert character_researcher.gather_research_context("Gary the Snail", saved_pages, token_budget=budget) == ranked[:2]
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import app
+import ai_core
+from character_models import CharacterSheet
+from intent_parity import DEFAULT_QUESTIONS, two_call_flow
+
+SHEET = CharacterSheet(
+    name="Gary",
+    series="Bob Esponja",
+    description="El caracol mascota de Bob Esponja.",
+    visual_description_for_ai="Un caracol de dibujos animados con concha rosa en espiral y cuerpo azul verdoso.",
+    personality_traits=["leal", "inteligente"],
+    catchphrases=["Miau"],
+)
+EPISODE = {"id": 7, "title": "Gary se escapa", "visual_summary": "Gary duerme en su concha dentro de la piña."}
+
+
+@pytest.fixture(params=["sin_episodio", "con_escena_precalculada"])
+def offline_app(request, monkeypatch):
+    """route_question sin BD: sin episodios o con un episodio que tiene escena precalculada."""
+    hits = [] if request.param == "sin_episodio" else [EPISODE]
+    monkeypatch.setattr(app, "search_episodes", lambda question, limit=5: hits)
+    monkeypatch.setattr(app, "get_scene_prompt", lambda episode_id, character: "Gary en la piña, estilo de la serie.")
+    monkeypatch.setattr(app, "is_specific_request", lambda question: bool(hits))
+    return app
+
+
+def _route(question: str, combined: bool, monkeypatch):
+    monkeypatch.setattr(app, "COMBINED_INTENT_MODE", combined)
+    return asyncio.run(app.route_question(question, SHEET))
+
+
+@pytest.mark.parametrize("question", DEFAULT_QUESTIONS)
+def test_combined_mode_routes_like_two_calls(question, offline_app, monkeypatch):
+    intent_off, prompt_off, _ = _route(question, False, monkeypatch)
+    intent_on, prompt_on, _ = _route(question, True, monkeypatch)
+
+    assert intent_on == intent_off
+    # Sin modo combinado el prompt se sintetiza después; con él, llega ya hecho solo si es una imagen.
+    assert prompt_off is None
+    assert bool(prompt_on) == (intent_on == "image")
+
+
+@pytest.mark.parametrize("question", DEFAULT_QUESTIONS)
+def test_combined_call_matches_two_call_flow(question):
+    material = app.scene_material(question, SHEET, "No hay contexto de episodio específico.")
+    intent_a, prompt_a = asyncio.run(two_call_flow(question, material))
+    routed = asyncio.run(ai_core.classify_intent_and_build_prompt(question, material))
+
+    assert routed is not None
+    assert routed["intent"] == intent_a
+    assert bool(routed["image_prompt"]) == bool(prompt_a) == (intent_a == "image")
+
+
+def test_question_set_covers_both_intents():
+    intents = {asyncio.run(ai_core.classify_intent(question)) for question in DEFAULT_QUESTIONS}
+    assert intents == {"chat", "image"}
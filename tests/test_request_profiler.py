@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import request_profiler
+from request_profiler import ProfilingMiddleware
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _request(middleware, headers):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware({"type": "http", "path": "/ask", "headers": headers}, None, send))
+    return sent
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    saved = request_profiler.save_profile
+    monkeypatch.setattr(request_profiler, "save_profile",
+                        lambda *args: saved(*args, directory=str(tmp_path), max_files=3))
+    return tmp_path
+
+
+def test_header_is_ignored_without_token(profile_dir):
+    sent = _request(ProfilingMiddleware(_app, token=""), [(b"x-profile", b"1")])
+    assert (b"x-profiled", b"1") not in sent[0]["headers"]
+    assert not list(profile_dir.iterdir())
+
+
+def test_profiles_are_capped(profile_dir):
+    middleware = ProfilingMiddleware(_app, token="secreto")
+    for _ in range(5):
+        sent = _request(middleware, [(b"x-profile", b"secreto")])
+        assert (b"x-profiled", b"1") in sent[0]["headers"]
+    assert middleware.saved == 5 and middleware.active == 0
+    assert len(list(profile_dir.iterdir())) == 3
+
+
+@pytest.mark.parametrize("failing", ["start", "stop"])
+def test_profiler_failures_never_fail_the_request(failing, profile_dir, monkeypatch):
+    def boom(self):
+        raise RuntimeError("perfilador roto")
+    monkeypatch.setattr(request_profiler._Profile, failing, boom)
+    middleware = ProfilingMiddleware(_app, token="secreto")
+
+    sent = _request(middleware, [(b"x-profile", b"secreto")])
+    assert sent[0]["status"] == 200 and sent[1]["body"] == b"ok"
+    assert middleware.active == 0